@@ -29,6 +29,11 @@ version = "2025.03"
 project {
     description = "Contains all other projects"
 
+    params {
+        // Rewritten and committed by `deploy.py --probe` to time how long a settings commit takes to apply
+        param("sync.probe.marker", "none")
+    }
+
     features {
         buildReportTab {
             id = "PROJECT_EXT_1"
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+TeamCity Artifact Downloader
+Lists build artifacts and downloads them with parallel resumable range requests, or single files out of report zips
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import requests
+
+from deploy import load_environment
+from teamcity_api import TeamCityAPI
+from teamcity_artifacts import (
+    DEFAULT_PARALLEL, DEFAULT_PART_SIZE, Artifact, ArtifactDownloader, ArtifactError, artifact_endpoint,
+    list_artifacts, match_artifacts,
+)
+from teamcity_transport import CircuitOpenError, add_transport_arguments, transport_from_args
+
+DEFAULT_URL = "https://teamcity.devinfra.ru"
+SIDECAR_SUFFIX = '.sha256'
+
+
+def resolve_build(api: TeamCityAPI, build: str) -> int:
+    """A build id as given, or the latest successful build of a ``buildType:ID`` configuration"""
+    if build.isdigit():
+        return int(build)
+    build_type = build.split(':', 1)[1] if build.startswith('buildType:') else build
+    locator = {'buildType': {'id': build_type}, 'state': 'finished', 'status': 'SUCCESS', 'count': 1}
+    builds = api.query_items('builds', 'build', locator, fields={'build': ['id']})
+    if not builds:
+        raise LookupError(f"{build_type} has no successful builds")
+    return int(builds[0]['id'])
+
+
+def parse_size(value: str) -> int:
+    """Byte count with an optional K/M/G suffix, e.g. 8M"""
+    match = re.fullmatch(r'(\d+)([KMG]?)', value.strip().upper())
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid size '{value}'")
+    return int(match.group(1)) * 1024 ** ' KMG'.index(match.group(2) or ' ')
+
+
+def published_sha256(api: TeamCityAPI, build_id: int, artifact: Artifact,
+                     artifacts: List[Artifact]) -> Optional[str]:
+    """Checksum from a ``<name>.sha256`` artifact published next to ``artifact``, if there is one"""
+    sidecar = artifact.path + SIDECAR_SUFFIX
+    if not any(other.path == sidecar for other in artifacts):
+        return None
+    response = api.stream(artifact_endpoint(build_id, 'content', sidecar))
+    try:
+        response.raise_for_status()
+        words = response.text.split()
+    finally:
+        response.close()
+    return words[0].lower() if words and re.fullmatch(r'[0-9a-fA-F]{64}', words[0]) else None
+
+
+def format_size(size: int) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def print_listing(artifacts: List[Artifact]):
+    width = max([len(artifact.path) for artifact in artifacts] + [len('Artifact')])
+    print(f"   {'Artifact':<{width}} {'Size':>10}")
+    for artifact in artifacts:
+        print(f"   {artifact.path:<{width}} {format_size(artifact.size):>10}")
+    print(f"   {len(artifacts)} files, {format_size(sum(artifact.size for artifact in artifacts))}")
+
+
+def download_all(api: TeamCityAPI, downloader: ArtifactDownloader, build_id: int, patterns: List[str],
+                 dest: Path, expected_sha256: Optional[str]) -> int:
+    """Download every artifact or archive member named by ``patterns``; returns the number of failures"""
+    artifacts = list_artifacts(api, build_id)
+    failures = 0
+    for pattern in patterns:
+        archive, _, member = pattern.partition('!')
+        if member:
+            target = dest / member.lstrip('/')
+            try:
+                result = downloader.extract_member(build_id, archive, member.lstrip('/'), target)
+            except (ArtifactError, requests.RequestException) as e:
+                print(f"   ❌ {pattern}: {e}")
+                failures += 1
+                continue
+            archive_size = next((artifact.size for artifact in artifacts if artifact.path == archive), None)
+            share = f", {result.transferred / archive_size:.1%} of the archive" if archive_size else ''
+            print(f"   ✅ {result.name} -> {target} ({format_size(result.size)}, "
+                  f"{format_size(result.transferred)} transferred{share}; {result.verified} checked)")
+            continue
+
+        matches = match_artifacts(artifacts, pattern)
+        if not matches:
+            print(f"   ❌ {pattern}: no such artifact")
+            failures += 1
+            continue
+        if expected_sha256 and len(matches) > 1:
+            print(f"   ❌ {pattern}: matches {len(matches)} artifacts, but --sha256 is the checksum of one file")
+            failures += 1
+            continue
+        for artifact in matches:
+            target = dest / artifact.path
+            try:
+                checksum = expected_sha256 or published_sha256(api, build_id, artifact, artifacts)
+                result = downloader.download(build_id, artifact, target, checksum)
+            except (ArtifactError, requests.RequestException) as e:
+                print(f"   ❌ {artifact.path}: {e}")
+                failures += 1
+                continue
+            if not result.transferred:
+                print(f"   ⏭️  {artifact.path}: already downloaded ({result.verified} checked)")
+                continue
+            resumed = f", {format_size(result.resumed)} resumed" if result.resumed else ''
+            print(f"   ✅ {artifact.path} ({format_size(result.size)} in {result.elapsed:.2f}s, "
+                  f"{result.mb_per_second:.1f} MB/s, {result.parts} parts{resumed}; {result.verified} checked)")
+    return failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="List and download TeamCity build artifacts")
+    parser.add_argument('command', choices=['list', 'get'])
+    parser.add_argument('build', help="Build id, or buildType:ID for its latest successful build")
+    parser.add_argument('paths', nargs='*', metavar='PATH',
+                        help="Artifacts to get: a path, a directory, a glob, or ARCHIVE!MEMBER "
+                             "(e.g. coverage.zip!index.html)")
+    parser.add_argument('--url', help=f"TeamCity URL (default: $TEAMCITY_URL or {DEFAULT_URL})")
+    parser.add_argument('--dest', type=Path, default=Path('.'), help="Directory to download into (default: .)")
+    parser.add_argument('--parallel', type=int, default=DEFAULT_PARALLEL,
+                        help=f"Range requests in flight per file (default: {DEFAULT_PARALLEL})")
+    parser.add_argument('--part-size', type=parse_size, default=DEFAULT_PART_SIZE,
+                        help=f"Bytes per range request, e.g. 4M (default: {DEFAULT_PART_SIZE // 1024 // 1024}M)")
+    parser.add_argument('--sha256', help="Expected SHA-256 of the (single) file being downloaded")
+    add_transport_arguments(parser)
+    args = parser.parse_args()
+    if args.command == 'get' and not args.paths:
+        parser.error("get needs at least one PATH")
+    if args.sha256 and len(args.paths) != 1:
+        parser.error("--sha256 checks a single file, so give exactly one PATH")
+    return args
+
+
+def main():
+    args = parse_args()
+
+    print("📦 TeamCity Artifact Downloader")
+    print("==============================")
+    print()
+
+    load_environment()
+    teamcity_url = args.url or os.getenv('TEAMCITY_URL', DEFAULT_URL)
+    admin_token = os.getenv('TEAMCITY_ADMIN_TOKEN')
+    if not admin_token:
+        print("❌ ERROR: TEAMCITY_ADMIN_TOKEN environment variable not set")
+        sys.exit(1)
+
+    transport = transport_from_args(args)
+    api = TeamCityAPI(teamcity_url, admin_token, transport=transport)
+    started = time.monotonic()
+    try:
+        build_id = resolve_build(api, args.build)
+        if args.command == 'list':
+            print(f"📋 Artifacts of build {build_id}:")
+            print_listing(list_artifacts(api, build_id))
+            failures = 0
+        else:
+            downloader = ArtifactDownloader(api, args.parallel, args.part_size)
+            print(f"⬇️  Downloading from build {build_id} into {args.dest}...")
+            failures = download_all(api, downloader, build_id, args.paths, args.dest, args.sha256)
+    except LookupError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    except requests.HTTPError as e:
+        print(f"❌ TeamCity rejected {e.request.url} (HTTP {e.response.status_code})")
+        sys.exit(1)
+    except (requests.RequestException, CircuitOpenError) as e:
+        print(f"❌ Error talking to TeamCity: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print()
+        print("⏹️  Interrupted; finished parts are kept and the next run resumes from them")
+        sys.exit(130)
+
+    print()
+    print(f"⏱️  {time.monotonic() - started:.1f}s")
+    print(f"📊 API usage: {api.stats.summary()}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
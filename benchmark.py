@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+TeamCity Scripts Benchmark
+Runs deploy.py and diagnose.py against the fake server at several inventory sizes and records time, requests and memory
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import requests
+
+from fake_teamcity import STATS_PATH, FakeConfig, serve
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+DEFAULT_SIZES = '10,100,1000,10000,50000'
+
+# name -> (module, extra argv); every scenario starts from a fresh server
+SCENARIOS = {
+    'deploy': ('deploy', []),
+    'deploy-apply': ('deploy', ['--apply']),
+    'diagnose': ('diagnose', []),
+}
+
+
+def run_child(module: str, argv: List[str], result_path: Path):
+    """Body of the child process: run one script's main() and record time and peak RSS"""
+    sys.path.insert(0, str(SCRIPT_DIR))
+    script = __import__(module)
+    sys.argv = [f"{module}.py"] + argv
+    exit_code = 0
+    started = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        try:
+            script.main()
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    elapsed = time.perf_counter() - started
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_kb = peak // 1024 if sys.platform == 'darwin' else peak
+    result_path.write_text(json.dumps({'seconds': elapsed, 'exit_code': exit_code, 'peak_rss_kb': peak_kb}))
+
+
+class FakeServer:
+    """The fake in a background thread of this process, so its work is not counted in the child's RSS"""
+
+    def __init__(self, config: FakeConfig):
+        self.server = serve(config, port=0)
+        host, port = self.server.server_address[:2]
+        self.url = f"http://{host}:{port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> 'FakeServer':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self) -> Dict:
+        return requests.get(self.url + STATS_PATH, timeout=10).json()
+
+
+def run_scenario(name: str, size: int, args: argparse.Namespace) -> Dict:
+    module, argv = SCENARIOS[name]
+    runs = []
+    for _ in range(args.repeat):
+        config = FakeConfig(projects=size, build_types=size * args.build_types_per_project,
+                            vcs_roots=args.vcs_roots, latency=args.latency, error_rate=args.error_rate,
+                            sync_delay=args.sync_delay, seed=0)
+        with FakeServer(config) as fake, tempfile.TemporaryDirectory() as workdir:
+            result_path = Path(workdir) / 'result.json'
+            # Run from an empty directory so a developer's .env cannot point the child at a real server
+            env = dict(os.environ, TEAMCITY_URL=fake.url, TEAMCITY_ADMIN_TOKEN='benchmark-token')
+            child = subprocess.run([sys.executable, str(Path(__file__).resolve()), '--child', module,
+                                    str(result_path), '--'] + argv,
+                                   cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                   timeout=args.timeout)
+            if child.returncode != 0 or not result_path.exists():
+                raise RuntimeError(f"{name} at {size} crashed: {child.stderr.decode(errors='replace')[-500:]}")
+            result = json.loads(result_path.read_text())
+            result.update(fake.stats())
+            runs.append(result)
+
+    return {
+        'scenario': name,
+        'size': size,
+        'runs': len(runs),
+        'seconds': statistics.median(r['seconds'] for r in runs),
+        'seconds_min': min(r['seconds'] for r in runs),
+        'requests': runs[-1]['requests'],
+        'by_method': runs[-1]['by_method'],
+        'peak_rss_kb': max(r['peak_rss_kb'] for r in runs),
+        'exit_code': runs[-1]['exit_code'],
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(old: Dict, new: Dict):
+    baseline = {(r['scenario'], r['size']): r for r in old['results']}
+    print(f"📈 Compared with {old['meta'].get('commit') or 'baseline'}:")
+    for result in new['results']:
+        before = baseline.get((result['scenario'], result['size']))
+        if before is None:
+            continue
+        time_delta = (result['seconds'] - before['seconds']) / before['seconds'] * 100 if before['seconds'] else 0.0
+        print(f"  {result['scenario']:<13} {result['size']:>6}  "
+              f"time {before['seconds']:.2f}s → {result['seconds']:.2f}s ({time_delta:+.0f}%)  "
+              f"requests {before['requests']} → {result['requests']}  "
+              f"peak {before['peak_rss_kb'] / 1024:.0f} → {result['peak_rss_kb'] / 1024:.0f} MiB")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the deployment scripts against a fake TeamCity")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f"Comma-separated project counts (default: {DEFAULT_SIZES})")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"Comma-separated scenarios (default: {','.join(SCENARIOS)})")
+    parser.add_argument('--build-types-per-project', type=int, default=3, help="Build types per project (default: 3)")
+    parser.add_argument('--vcs-roots', type=int, default=5, help="VCS roots on the fake server (default: 5)")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every fake response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of fake responses that are 503")
+    parser.add_argument('--sync-delay', type=float, default=0.2, help="Fake sync duration in seconds (default: 0.2)")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per scenario; the median time is reported")
+    parser.add_argument('--timeout', type=float, default=600, help="Seconds allowed per run (default: 600)")
+    parser.add_argument('--output', type=Path, help="Write the results as JSON")
+    parser.add_argument('--compare', type=Path, metavar='OLD_JSON', help="Print deltas against an earlier --output")
+    return parser.parse_args()
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        run_child(sys.argv[2], sys.argv[5:], Path(sys.argv[3]))
+        return
+
+    args = parse_args()
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        print(f"❌ ERROR: Unknown scenario(s): {', '.join(unknown)}")
+        sys.exit(1)
+
+    print("⏱️  TeamCity Scripts Benchmark")
+    print("=============================")
+    print()
+
+    results = []
+    for size in sizes:
+        for name in scenarios:
+            try:
+                result = run_scenario(name, size, args)
+            except (RuntimeError, subprocess.TimeoutExpired) as e:
+                print(f"❌ {name} at {size}: {e}")
+                sys.exit(1)
+            status = '✅' if result['exit_code'] == 0 else '⚠️ '
+            print(f"{status} {name:<13} {size:>6} projects  {result['seconds']:7.2f}s  "
+                  f"{result['requests']:>5} requests  peak {result['peak_rss_kb'] / 1024:.0f} MiB")
+            results.append(result)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'build_types_per_project': args.build_types_per_project,
+            'vcs_roots': args.vcs_roots,
+            'latency': args.latency,
+            'error_rate': args.error_rate,
+            'sync_delay': args.sync_delay,
+        },
+        'results': results,
+    }
+    print()
+    if args.compare:
+        print_comparison(json.loads(args.compare.read_text()), report)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + '\n')
+        print(f"💾 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
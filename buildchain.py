@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+TeamCity Build Chain Analyzer
+Builds the snapshot/artifact dependency graph of every build configuration and finds what serializes it
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import requests
+
+from deploy import load_environment
+from teamcity_api import TeamCityAPI, BUILD_TYPE_DEPENDENCY_FIELDS, DEFAULT_PAGE_SIZE
+from teamcity_model import ROOT_PROJECT_ID, format_date, parse_date
+from teamcity_transport import add_transport_arguments, transport_from_args
+
+DEFAULT_URL = "https://teamcity.devinfra.ru"
+DEFAULT_HISTORY_DAYS = 30
+HISTORY_PAGE_SIZE = 1000
+
+# int.bit_count() is Python 3.10+; bin().count() builds a string per call and is far slower
+popcount = int.bit_count if hasattr(int, 'bit_count') else (lambda bits: bin(bits).count('1'))
+
+
+class BuildChainGraph:
+    """Dependency DAG over integer node indices; edges point from a dependency to its dependent
+
+    Adjacency is kept as lists of ints so the analyses below are plain loops
+    over arrays and stay well under a second for thousands of nodes.
+    """
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.names: List[str] = []
+        self.projects: List[Optional[str]] = []
+        # Referenced by a dependency but outside the fetched scope
+        self.external: List[bool] = []
+        self.index: Dict[str, int] = {}
+        self.upstream: List[List[int]] = []
+        self.downstream: List[List[int]] = []
+        self.edge_kinds: Dict[Tuple[int, int], str] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.edge_kinds)
+
+    def node(self, build_type_id: str, name: Optional[str] = None, project_id: Optional[str] = None,
+             external: bool = True) -> int:
+        """Index of a node, creating it on first sight; a later full definition clears ``external``"""
+        index = self.index.get(build_type_id)
+        if index is None:
+            index = len(self.ids)
+            self.index[build_type_id] = index
+            self.ids.append(build_type_id)
+            self.names.append(name or build_type_id)
+            self.projects.append(project_id)
+            self.external.append(external)
+            self.upstream.append([])
+            self.downstream.append([])
+        elif not external:
+            self.names[index] = name or build_type_id
+            self.projects[index] = project_id
+            self.external[index] = False
+        return index
+
+    def add_dependency(self, dependent: int, source: int, kind: str):
+        key = (source, dependent)
+        existing = self.edge_kinds.get(key)
+        if existing is None:
+            self.edge_kinds[key] = kind
+            self.upstream[dependent].append(source)
+            self.downstream[source].append(dependent)
+        elif kind not in existing.split('+'):
+            self.edge_kinds[key] = f"{existing}+{kind}"
+
+    @classmethod
+    def from_build_types(cls, build_types: Iterable[Dict]) -> 'BuildChainGraph':
+        graph = cls()
+        for data in build_types:
+            dependent = graph.node(data['id'], data.get('name'), data.get('projectId'), external=False)
+            for kind, block, item in (('snapshot', 'snapshot-dependencies', 'snapshot-dependency'),
+                                      ('artifact', 'artifact-dependencies', 'artifact-dependency')):
+                for dependency in (data.get(block) or {}).get(item, []):
+                    source_id = (dependency.get('source-buildType') or {}).get('id')
+                    if source_id:
+                        graph.add_dependency(dependent, graph.node(source_id), kind)
+        return graph
+
+    def topological_order(self) -> Tuple[List[int], List[int]]:
+        """Kahn's algorithm; returns (order, nodes left over because they are on or behind a cycle)"""
+        indegree = [len(sources) for sources in self.upstream]
+        ready = [node for node, degree in enumerate(indegree) if degree == 0]
+        order = []
+        while ready:
+            node = ready.pop()
+            order.append(node)
+            for dependent in self.downstream[node]:
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    ready.append(dependent)
+        remaining = [node for node, degree in enumerate(indegree) if degree > 0]
+        return order, remaining
+
+    def cycles(self, nodes: Iterable[int]) -> List[List[int]]:
+        """Strongly connected components with more than one node (or a self-loop), via iterative Tarjan"""
+        candidates = set(nodes)
+        index_of: Dict[int, int] = {}
+        lowlink: Dict[int, int] = {}
+        on_stack: Set[int] = set()
+        stack: List[int] = []
+        components = []
+        counter = 0
+        for root in candidates:
+            if root in index_of:
+                continue
+            work = [(root, 0)]
+            while work:
+                node, position = work.pop()
+                if position == 0:
+                    index_of[node] = lowlink[node] = counter
+                    counter += 1
+                    stack.append(node)
+                    on_stack.add(node)
+                successors = self.downstream[node]
+                for i in range(position, len(successors)):
+                    successor = successors[i]
+                    if successor not in candidates:
+                        continue
+                    if successor not in index_of:
+                        work.append((node, i + 1))
+                        work.append((successor, 0))
+                        break
+                    if successor in on_stack:
+                        lowlink[node] = min(lowlink[node], index_of[successor])
+                else:
+                    if lowlink[node] == index_of[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        if len(component) > 1 or (node, node) in self.edge_kinds:
+                            components.append(component[::-1])
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+        return components
+
+    def levels(self, order: List[int]) -> List[int]:
+        """Level 0 has no dependencies; every other node sits one level after its deepest dependency"""
+        level = [0] * len(self)
+        for node in order:
+            for source in self.upstream[node]:
+                if level[source] + 1 > level[node]:
+                    level[node] = level[source] + 1
+        return level
+
+    def transitive_dependents(self, order: List[int]) -> List[int]:
+        """How many configurations (directly or indirectly) wait for each node, using int bitsets"""
+        # reach[node] has a bit for the node itself and everything downstream of it
+        reach = [0] * len(self)
+        for node in reversed(order):
+            bits = 1 << node
+            for dependent in self.downstream[node]:
+                bits |= reach[dependent]
+            reach[node] = bits
+        return [max(popcount(bits) - 1, 0) for bits in reach]
+
+
+class ChainAnalysis:
+    """Results of analysing an acyclic graph with per-node durations in seconds"""
+
+    def __init__(self, graph: BuildChainGraph, durations: Dict[str, float]):
+        started = time.perf_counter()
+        self.graph = graph
+        self.order, remaining = graph.topological_order()
+        self.cycles = graph.cycles(remaining) if remaining else []
+        # Nodes behind a cycle are left out of the level/path analysis
+        self.blocked = len(remaining)
+
+        known = [durations[build_type_id] for build_type_id in graph.ids if build_type_id in durations]
+        self.timed = bool(known)
+        default = statistics.median(known) if known else 1.0
+        self.weights = [durations.get(build_type_id, default) for build_type_id in graph.ids]
+        self.estimated = sum(1 for build_type_id in graph.ids if build_type_id not in durations) if known else 0
+
+        self.level = graph.levels(self.order)
+        self.widths: Dict[int, int] = {}
+        for node in self.order:
+            self.widths[self.level[node]] = self.widths.get(self.level[node], 0) + 1
+
+        # Earliest finish along the heaviest path into each node, and the node it came from
+        finish = [0.0] * len(graph)
+        via: List[Optional[int]] = [None] * len(graph)
+        for node in self.order:
+            start = 0.0
+            for source in graph.upstream[node]:
+                if finish[source] > start:
+                    start, via[node] = finish[source], source
+            finish[node] = start + self.weights[node]
+        self.finish = finish
+        self.makespan = max((finish[node] for node in self.order), default=0.0)
+        end = max(self.order, key=lambda node: finish[node], default=None)
+        path = []
+        while end is not None:
+            path.append(end)
+            end = via[end]
+        self.critical_path = path[::-1]
+
+        # Latest finish that does not delay the makespan; zero slack means on a critical path
+        latest = [self.makespan] * len(graph)
+        for node in reversed(self.order):
+            for dependent in graph.downstream[node]:
+                latest[node] = min(latest[node], latest[dependent] - self.weights[dependent])
+        self.slack = [latest[node] - finish[node] for node in range(len(graph))]
+        self.dependents = graph.transitive_dependents(self.order)
+        self.elapsed = time.perf_counter() - started
+
+    @property
+    def max_width(self) -> Tuple[int, int]:
+        """(width, level) of the widest level"""
+        if not self.widths:
+            return 0, 0
+        level = max(self.widths, key=lambda key: self.widths[key])
+        return self.widths[level], level
+
+    def serializing(self, top: int) -> List[Tuple[int, str]]:
+        """Configurations that force work to run one after another, most dependents first
+
+        A zero-slack node is on a critical path, so any time it takes is
+        added to the whole chain; a node alone on its level is a choke point
+        every later level waits for.
+        """
+        reasons: Dict[int, List[str]] = {}
+        for node in self.order:
+            if not self.graph.downstream[node]:
+                continue
+            if abs(self.slack[node]) < 1e-9:
+                reasons.setdefault(node, []).append('critical path')
+            if self.widths[self.level[node]] == 1:
+                reasons.setdefault(node, []).append(f"alone on level {self.level[node]}")
+        ranked = sorted(reasons, key=lambda node: (-self.dependents[node], -self.weights[node]))
+        return [(node, ', '.join(reasons[node])) for node in ranked[:top]]
+
+    def describe(self, node: int) -> str:
+        graph = self.graph
+        label = graph.names[node] if graph.names[node] == graph.ids[node] else f"{graph.names[node]} ({graph.ids[node]})"
+        return label + (' [outside scope]' if graph.external[node] else '')
+
+    def format_duration(self, seconds: float) -> str:
+        if not self.timed:
+            return f"{seconds:.0f} step{'s' if seconds != 1 else ''}"
+        if seconds >= 3600:
+            return f"{seconds / 3600:.1f}h"
+        if seconds >= 60:
+            return f"{seconds / 60:.1f}m"
+        return f"{seconds:.0f}s"
+
+    def print(self, top: int = 10):
+        graph = self.graph
+        snapshot = sum(1 for kind in graph.edge_kinds.values() if 'snapshot' in kind)
+        artifact = sum(1 for kind in graph.edge_kinds.values() if 'artifact' in kind)
+        external = sum(graph.external)
+        print(f"🔗 {len(graph)} configurations, {graph.edge_count} dependencies "
+              f"({snapshot} snapshot, {artifact} artifact)" + (f", {external} outside scope" if external else ""))
+
+        if self.cycles:
+            print(f"❌ {len(self.cycles)} dependency cycle(s); {self.blocked} configurations are on or behind one:")
+            for cycle in self.cycles:
+                print(f"   🔁 {' → '.join(graph.ids[node] for node in cycle + cycle[:1])}")
+        else:
+            print("✅ No dependency cycles")
+
+        if not self.order:
+            return
+        width, widest = self.max_width
+        standalone = sum(1 for node in self.order if not graph.upstream[node] and not graph.downstream[node])
+        print(f"📶 {len(self.widths)} level{'s' if len(self.widths) != 1 else ''}, maximum parallel width {width} (level {widest}), "
+              f"{standalone} standalone configurations")
+
+        basis = 'average duration' if self.timed else 'chain length; no build history'
+        if self.estimated:
+            basis += f", {self.estimated} without history use the median"
+        print(f"⏱️  Critical path: {self.format_duration(self.makespan)} over {len(self.critical_path)} "
+              f"configurations ({basis})")
+        for node in self.critical_path:
+            share = self.weights[node] / self.makespan * 100 if self.makespan else 0.0
+            print(f"   → {self.describe(node)}  {self.format_duration(self.weights[node])} ({share:.0f}%)")
+
+        serializing = self.serializing(top)
+        if serializing:
+            print("🚧 Configurations that serialize the pipeline:")
+            for node, reason in serializing:
+                print(f"   - {self.describe(node)}: {self.dependents[node]} downstream, "
+                      f"{self.format_duration(self.weights[node])} ({reason})")
+        print(f"⚡ Analysis took {self.elapsed * 1000:.0f} ms")
+
+    def as_dict(self) -> Dict:
+        graph = self.graph
+        return {
+            'nodes': len(graph),
+            'edges': graph.edge_count,
+            'cycles': [[graph.ids[node] for node in cycle] for cycle in self.cycles],
+            'levels': len(self.widths),
+            'widths': [self.widths[level] for level in sorted(self.widths)],
+            'timed': self.timed,
+            'makespan': self.makespan,
+            'critical_path': [{'id': graph.ids[node], 'duration': self.weights[node]} for node in self.critical_path],
+            'configurations': [
+                {'id': graph.ids[node], 'name': graph.names[node], 'level': self.level[node],
+                 'duration': self.weights[node], 'slack': self.slack[node], 'downstream': self.dependents[node],
+                 'dependencies': [graph.ids[source] for source in graph.upstream[node]]}
+                for node in self.order
+            ],
+        }
+
+    def write_dot(self, path: Path):
+        """Graphviz export with the critical path highlighted"""
+        graph = self.graph
+        critical = set(zip(self.critical_path, self.critical_path[1:]))
+        with open(path, 'w') as f:
+            f.write('digraph build_chain {\n  rankdir=LR;\n  node [shape=box];\n')
+            for node in range(len(graph)):
+                style = ', style=dashed' if graph.external[node] else ''
+                f.write(f'  "{graph.ids[node]}" [label="{graph.names[node]}"{style}];\n')
+            for (source, dependent), kind in graph.edge_kinds.items():
+                attributes = ['style=dotted'] if kind == 'artifact' else []
+                if (source, dependent) in critical:
+                    attributes.append('color=red, penwidth=2')
+                suffix = f" [{', '.join(attributes)}]" if attributes else ''
+                f.write(f'  "{graph.ids[source]}" -> "{graph.ids[dependent]}"{suffix};\n')
+            f.write('}\n')
+
+
+def fetch_graph(api: TeamCityAPI, project_id: str, page_size: int) -> BuildChainGraph:
+    """Every build configuration under ``project_id`` with its dependencies, in one paged pass"""
+    locator = {'affectedProject': {'id': project_id}} if project_id != ROOT_PROJECT_ID else None
+    return BuildChainGraph.from_build_types(
+        api.iter_build_types(locator, fields=BUILD_TYPE_DEPENDENCY_FIELDS, page_size=page_size))
+
+
+def fetch_average_durations(api: TeamCityAPI, days: int, project_id: str = ROOT_PROJECT_ID) -> Dict[str, float]:
+    """Mean run time per build configuration over recent finished builds, from one paged builds query"""
+    locator = {
+        'affectedProject': {'id': project_id} if project_id != ROOT_PROJECT_ID else None,
+        'state': 'finished',
+        'defaultFilter': False,
+        'sinceDate': format_date(time.time() - days * 86400),
+    }
+    totals: Dict[str, List[float]] = {}
+    fields = {'build': ['buildTypeId', 'startDate', 'finishDate']}
+    for build in api.iter_builds(locator, fields=fields, page_size=HISTORY_PAGE_SIZE):
+        started, finished = parse_date(build.get('startDate')), parse_date(build.get('finishDate'))
+        if started is None or finished is None:
+            continue
+        total = totals.setdefault(build['buildTypeId'], [0.0, 0])
+        total[0] += finished - started
+        total[1] += 1
+    return {build_type_id: total / count for build_type_id, (total, count) in totals.items()}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Analyze TeamCity build chains")
+    parser.add_argument('--url', help=f"TeamCity URL (default: $TEAMCITY_URL or {DEFAULT_URL})")
+    parser.add_argument('--project', default=ROOT_PROJECT_ID,
+                        help=f"Only configurations under this project (default: {ROOT_PROJECT_ID})")
+    parser.add_argument('--days', type=int, default=DEFAULT_HISTORY_DAYS,
+                        help=f"Build history used for average durations (default: {DEFAULT_HISTORY_DAYS})")
+    parser.add_argument('--no-durations', action='store_true',
+                        help="Skip build history and weight every configuration equally")
+    parser.add_argument('--top', type=int, default=10, help="Serializing configurations to list (default: 10)")
+    parser.add_argument('--json', type=Path, help="Write the analysis as JSON")
+    parser.add_argument('--dot', type=Path, help="Write the graph in Graphviz format")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                        help=f"Items per page when listing build configurations (default: {DEFAULT_PAGE_SIZE})")
+    add_transport_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    print("🔗 TeamCity Build Chain Analysis")
+    print("================================")
+    print()
+
+    load_environment()
+    teamcity_url = args.url or os.getenv('TEAMCITY_URL', DEFAULT_URL)
+    admin_token = os.getenv('TEAMCITY_ADMIN_TOKEN')
+    if not admin_token:
+        print("❌ ERROR: TEAMCITY_ADMIN_TOKEN environment variable not set")
+        sys.exit(1)
+
+    api = TeamCityAPI(teamcity_url, admin_token, transport=transport_from_args(args))
+    try:
+        started = time.perf_counter()
+        graph = fetch_graph(api, args.project, args.page_size)
+        durations = {} if args.no_durations else fetch_average_durations(api, args.days, args.project)
+        print(f"📥 Fetched {len(graph)} configurations"
+              + ("" if args.no_durations else f" and history for {len(durations)}")
+              + f" in {time.perf_counter() - started:.1f}s")
+    except requests.HTTPError as e:
+        print(f"❌ Failed to fetch build configurations (HTTP {e.response.status_code})")
+        sys.exit(1)
+    except requests.RequestException as e:
+        print(f"❌ Error talking to TeamCity: {e}")
+        sys.exit(1)
+    print()
+
+    analysis = ChainAnalysis(graph, durations)
+    analysis.print(args.top)
+    if args.json:
+        args.json.write_text(json.dumps(analysis.as_dict(), indent=2) + '\n')
+        print(f"💾 Analysis written to {args.json}")
+    if args.dot:
+        analysis.write_dot(args.dot)
+        print(f"💾 Graph written to {args.dot}")
+    print()
+    print(f"📊 API usage: {api.stats.summary()}")
+    if analysis.cycles:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
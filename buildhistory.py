@@ -0,0 +1,574 @@
+#!/usr/bin/env python3
+"""
+TeamCity Build History Analytics
+Streams finished builds into a local columnar store and reports duration, queue and failure statistics per configuration
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import requests
+
+try:
+    import numpy as np
+except ImportError:  # optional: the pure-Python path gives the same numbers, just slower
+    np = None
+
+from deploy import load_environment
+from teamcity_api import TeamCityAPI
+from teamcity_model import format_date, parse_date
+from teamcity_transport import add_transport_arguments, transport_from_args
+
+DEFAULT_URL = "https://teamcity.devinfra.ru"
+DEFAULT_STORE = Path('.teamcity-history')
+DEFAULT_DAYS = 30
+HISTORY_PAGE_SIZE = 1000
+PERCENTILES = (50, 95, 99)
+HISTORY_FIELDS = {'build': ['id', 'buildTypeId', 'status', 'queuedDate', 'startDate', 'finishDate',
+                            {'agent': ['name']}]}
+
+# Column name -> array typecode; the same files are read with numpy.fromfile
+COLUMNS = {
+    'build_id': 'q',
+    'build_type': 'i',
+    'queued': 'd',
+    'started': 'd',
+    'finished': 'd',
+    'status': 'b',
+    'agent': 'i',
+}
+NUMPY_DTYPES = {'q': '<i8', 'i': '<i4', 'd': '<f8', 'b': 'i1'}
+STATUS_CODES = {'SUCCESS': 1, 'FAILURE': 0}
+UNKNOWN = -1
+
+
+class HistoryStore:
+    """Append-only column files plus a meta.json that records how many rows are committed
+
+    Rows are appended to every column first and the row count is written
+    by commit(), so an interrupted fetch leaves a store that loads as
+    before; the uncommitted tail is cut off by the next append. Build
+    configuration ids and agent names are stored once in meta.json and
+    referenced from the columns by index.
+
+    Refresh watermarks are kept per selection: ``*`` for the whole server,
+    otherwise the build configuration id. Every build at or below a
+    watermark had finished when it was set.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.meta_path = path / 'meta.json'
+        try:
+            with open(self.meta_path) as f:
+                self.meta = json.load(f)
+        except (OSError, ValueError):
+            self.meta = {'rows': 0, 'watermarks': {}, 'build_types': [], 'agents': [], 'server_url': None}
+        # Stores written before per-configuration watermarks kept a single last_build_id
+        last_build_id = self.meta.pop('last_build_id', 0)
+        self.meta.setdefault('watermarks', {'*': last_build_id} if last_build_id else {})
+        self._build_type_index = {value: i for i, value in enumerate(self.meta['build_types'])}
+        self._agent_index = {value: i for i, value in enumerate(self.meta['agents'])}
+        self._pending = 0
+
+    @property
+    def rows(self) -> int:
+        return self.meta['rows']
+
+    @property
+    def build_types(self) -> List[str]:
+        return self.meta['build_types']
+
+    def column_path(self, name: str) -> Path:
+        return self.path / f"{name}.bin"
+
+    def clear(self):
+        for name in COLUMNS:
+            if self.column_path(name).exists():
+                self.column_path(name).unlink()
+        self.meta = {'rows': 0, 'watermarks': {}, 'build_types': [], 'agents': [],
+                     'server_url': self.meta.get('server_url')}
+        self._build_type_index, self._agent_index = {}, {}
+
+    def _intern(self, table: Dict[str, int], values: List[str], value: Optional[str]) -> int:
+        if value is None:
+            return UNKNOWN
+        index = table.get(value)
+        if index is None:
+            index = table[value] = len(values)
+            values.append(value)
+        return index
+
+    def append(self, builds: Iterable[Dict], batch_size: int = 10000) -> int:
+        """Write builds to the columns in batches; returns the number of rows written, not yet committed"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        if not self._pending:
+            self._truncate_uncommitted()
+        added = 0
+        batch = {name: array(code) for name, code in COLUMNS.items()}
+        for build in builds:
+            started, finished = parse_date(build.get('startDate')), parse_date(build.get('finishDate'))
+            queued = parse_date(build.get('queuedDate'))
+            batch['build_id'].append(int(build['id']))
+            batch['build_type'].append(self._intern(self._build_type_index, self.meta['build_types'],
+                                                    build.get('buildTypeId')))
+            batch['queued'].append(queued if queued is not None else math.nan)
+            batch['started'].append(started if started is not None else math.nan)
+            batch['finished'].append(finished if finished is not None else math.nan)
+            batch['status'].append(STATUS_CODES.get(build.get('status'), UNKNOWN))
+            batch['agent'].append(self._intern(self._agent_index, self.meta['agents'],
+                                               (build.get('agent') or {}).get('name')))
+            if len(batch['build_id']) >= batch_size:
+                added += self._flush(batch)
+        return added + self._flush(batch)
+
+    def _flush(self, batch: Dict[str, array]) -> int:
+        count = len(batch['build_id'])
+        if not count:
+            return 0
+        for name, values in batch.items():
+            with open(self.column_path(name), 'ab') as f:
+                values.tofile(f)
+            del values[:]
+        self._pending += count
+        return count
+
+    def watermark(self, build_type: Optional[str] = None) -> int:
+        """Build id a refresh of one configuration (or, with None, the whole server) can start after"""
+        watermarks = self.meta['watermarks']
+        if build_type is None:
+            return watermarks.get('*', 0)
+        # A server-wide refresh covers every configuration too
+        return max(watermarks.get(build_type, 0), watermarks.get('*', 0))
+
+    def build_ids_after(self, build_id: int) -> set:
+        """Ids of the committed builds above ``build_id``, to skip when a refresh reads them again"""
+        path = self.column_path('build_id')
+        if not self.rows or not path.exists():
+            return set()
+        ids = array('q')
+        with open(path, 'rb') as f:
+            ids.fromfile(f, self.rows)
+        return {value for value in ids if value > build_id}
+
+    def commit(self, watermark_key: str, watermark: int):
+        """Make the rows written since the last commit visible and set one selection's refresh watermark"""
+        self.meta['rows'] += self._pending
+        self.meta['watermarks'][watermark_key] = watermark
+        self._pending = 0
+        self._write_meta()
+
+    def _truncate_uncommitted(self):
+        """Drop bytes past the committed row count left by an interrupted append"""
+        for name, code in COLUMNS.items():
+            path = self.column_path(name)
+            expected = self.rows * array(code).itemsize
+            if path.exists() and path.stat().st_size != expected:
+                with open(path, 'r+b') as f:
+                    f.truncate(expected)
+
+    def _write_meta(self):
+        tmp = self.meta_path.with_name('meta.json.tmp')
+        tmp.write_text(json.dumps(self.meta))
+        os.replace(tmp, self.meta_path)
+
+    def set_meta(self, **values):
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.meta.update(values)
+        self._write_meta()
+
+    def load(self) -> Dict[str, Sequence]:
+        """Committed rows of every column, as numpy arrays when numpy is available"""
+        columns = {}
+        for name, code in COLUMNS.items():
+            path = self.column_path(name)
+            if np is not None:
+                columns[name] = (np.fromfile(path, dtype=NUMPY_DTYPES[code], count=self.rows)
+                                 if path.exists() else np.empty(0, dtype=NUMPY_DTYPES[code]))
+            else:
+                values = array(code)
+                if path.exists():
+                    with open(path, 'rb') as f:
+                        values.fromfile(f, self.rows)
+                columns[name] = values
+        return columns
+
+
+def open_builds(api: TeamCityAPI) -> Tuple[Dict[Optional[str], int], int]:
+    """Lowest id of a queued or running build per configuration (None: any), and the newest build id
+
+    Read before the finished builds, so a build that shows up later has a
+    higher id than everything returned here.
+    """
+    lowest: Dict[Optional[str], int] = {}
+    newest = 0
+    for state in ('queued', 'running'):
+        for build in api.iter_builds({'state': state, 'defaultFilter': False},
+                                     fields={'build': ['id', 'buildTypeId']}, page_size=HISTORY_PAGE_SIZE):
+            build_id = int(build['id'])
+            newest = max(newest, build_id)
+            for key in (build.get('buildTypeId'), None):
+                lowest[key] = min(lowest.get(key, build_id), build_id)
+    response = api.query('builds', {'state': 'finished', 'defaultFilter': False, 'count': 1},
+                         fields={'build': ['id']})
+    response.raise_for_status()
+    latest = response.json().get('build', [])
+    if latest:
+        newest = max(newest, int(latest[0]['id']))
+    return lowest, newest
+
+
+def fetch(api: TeamCityAPI, store: HistoryStore, days: int, build_types: Sequence[str] = ()) -> int:
+    """Append builds finished since the selection's watermark (or in the last ``days`` without one)
+
+    Build ids grow monotonically, so ``sinceBuild`` makes a refresh cost
+    only the pages of new builds. A build with a lower id may still be
+    queued or running, though, so the watermark stops below the oldest
+    such build; the finished builds above it that are read again are
+    skipped by id. Without ``build_types`` one paged query covers the
+    whole server. The server returns newest builds first, so each query
+    is committed, with its own watermark, only once it has been read to
+    the end.
+    """
+    lowest_open, newest = open_builds(api)
+    selections = list(build_types) or [None]
+    stored = store.build_ids_after(min(store.watermark(build_type) for build_type in selections))
+    added = 0
+    for build_type in selections:
+        locator = {'state': 'finished', 'defaultFilter': False}
+        if build_type is not None:
+            locator['buildType'] = {'id': build_type}
+        watermark = store.watermark(build_type)
+        if watermark:
+            locator['sinceBuild'] = {'id': watermark}
+        else:
+            locator['sinceDate'] = format_date(time.time() - days * 86400)
+
+        builds = api.iter_builds(locator, fields=HISTORY_FIELDS, page_size=HISTORY_PAGE_SIZE)
+        added += store.append(build for build in builds if int(build['id']) not in stored)
+        open_id = lowest_open.get(build_type)
+        store.commit(build_type or '*', max(watermark, min(newest, open_id - 1) if open_id else newest))
+    return added
+
+
+def interpolated(sorted_values: Sequence[float], q: float) -> float:
+    """Percentile with linear interpolation between ranks, as numpy.percentile does by default"""
+    if not sorted_values:
+        return math.nan
+    position = (len(sorted_values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (position - low)
+
+
+def grouped_percentiles_numpy(groups, values, group_count: int, percentiles: Sequence[int]) -> Dict[int, 'np.ndarray']:
+    """Per-group percentiles for every group at once
+
+    Sorting by (group, value) puts each group's values in one contiguous,
+    ordered run; a percentile is then an interpolation between two
+    positions inside that run, computed for all groups with array indexing.
+    """
+    keep = ~np.isnan(values)
+    groups, values = groups[keep], values[keep]
+    order = np.lexsort((values, groups))
+    ordered = values[order]
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    result = {}
+    with np.errstate(invalid='ignore'):
+        for q in percentiles:
+            position = starts + (counts - 1) * (q / 100)
+            low = np.floor(position).astype(np.int64)
+            high = np.minimum(low + 1, starts + counts - 1)
+            low = np.clip(low, 0, max(len(ordered) - 1, 0))
+            high = np.clip(high, 0, max(len(ordered) - 1, 0))
+            if len(ordered):
+                value = ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+            else:
+                value = np.zeros(group_count)
+            result[q] = np.where(counts > 0, value, np.nan)
+    return result
+
+
+class ConfigurationStats:
+    __slots__ = ('build_type', 'builds', 'duration', 'queue', 'failure_rate', 'trend', 'agents')
+
+    def __init__(self, build_type: str, builds: int, duration: Dict[int, float], queue: Dict[int, float],
+                 failure_rate: float, trend: float, agents: int):
+        self.build_type = build_type
+        self.builds = builds
+        self.duration = duration
+        self.queue = queue
+        self.failure_rate = failure_rate
+        # Median duration in the recent window over the median before it; 1.0 is unchanged
+        self.trend = trend
+        self.agents = agents
+
+    def as_dict(self) -> Dict:
+        return {
+            'build_type': self.build_type,
+            'builds': self.builds,
+            'duration': {f"p{q}": value for q, value in self.duration.items()},
+            'queue': {f"p{q}": value for q, value in self.queue.items()},
+            'failure_rate': self.failure_rate,
+            'trend': self.trend,
+            'agents': self.agents,
+        }
+
+
+def analyze(store: HistoryStore, since: Optional[float] = None, trend_since: Optional[float] = None,
+            min_builds: int = 1) -> List[ConfigurationStats]:
+    columns = store.load()
+    analyze_columns = analyze_numpy if np is not None else analyze_python
+    return analyze_columns(columns, store.build_types, since, trend_since, min_builds)
+
+
+def analyze_numpy(columns, build_types: List[str], since, trend_since, min_builds) -> List[ConfigurationStats]:
+    group_count = len(build_types)
+    mask = columns['build_type'] >= 0
+    if since is not None:
+        mask &= columns['finished'] >= since
+    groups = columns['build_type'][mask].astype(np.int64)
+    started, finished, queued = columns['started'][mask], columns['finished'][mask], columns['queued'][mask]
+    duration = finished - started
+    queue = started - queued
+    status, agent = columns['status'][mask], columns['agent'][mask]
+
+    counts = np.bincount(groups, minlength=group_count)
+    failures = np.bincount(groups, weights=(status == 0), minlength=group_count)
+    decided = np.bincount(groups, weights=(status >= 0), minlength=group_count)
+    duration_percentiles = grouped_percentiles_numpy(groups, duration, group_count, PERCENTILES)
+    queue_percentiles = grouped_percentiles_numpy(groups, queue, group_count, PERCENTILES)
+
+    trend = np.full(group_count, np.nan)
+    if trend_since is not None:
+        recent = finished >= trend_since
+        recent_median = grouped_percentiles_numpy(groups[recent], duration[recent], group_count, (50,))[50]
+        before_median = grouped_percentiles_numpy(groups[~recent], duration[~recent], group_count, (50,))[50]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            trend = recent_median / before_median
+
+    # Distinct agents per configuration from the distinct (group, agent) pairs
+    pairs = np.unique(np.stack([groups, agent.astype(np.int64)]), axis=1)
+    agents = np.bincount(pairs[0], minlength=group_count)
+
+    results = []
+    for index in np.nonzero(counts >= max(min_builds, 1))[0]:
+        results.append(ConfigurationStats(
+            build_types[index], int(counts[index]),
+            {q: float(duration_percentiles[q][index]) for q in PERCENTILES},
+            {q: float(queue_percentiles[q][index]) for q in PERCENTILES},
+            float(failures[index] / decided[index]) if decided[index] else math.nan,
+            float(trend[index]), int(agents[index])))
+    return results
+
+
+def engines_disagree(columns, build_types: List[str], since, trend_since, min_builds) -> List[str]:
+    """Configurations where the numpy and pure-Python engines give different statistics"""
+    def close(a: float, b: float) -> bool:
+        return (math.isnan(a) and math.isnan(b)) or math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+
+    fast = {stats.build_type: stats for stats in analyze_numpy(columns, build_types, since, trend_since, min_builds)}
+    slow = {stats.build_type: stats for stats in analyze_python(columns, build_types, since, trend_since, min_builds)}
+    differing = []
+    for build_type in sorted(fast.keys() | slow.keys()):
+        a, b = fast.get(build_type), slow.get(build_type)
+        if a is None or b is None or (a.builds, a.agents) != (b.builds, b.agents) \
+                or not all(close(x, y) for x, y in zip(
+                    [a.failure_rate, a.trend, *a.duration.values(), *a.queue.values()],
+                    [b.failure_rate, b.trend, *b.duration.values(), *b.queue.values()])):
+            differing.append(build_type)
+    return differing
+
+
+def analyze_python(columns, build_types: List[str], since, trend_since, min_builds) -> List[ConfigurationStats]:
+    durations: Dict[int, List[float]] = {}
+    queues: Dict[int, List[float]] = {}
+    recent: Dict[int, List[float]] = {}
+    before: Dict[int, List[float]] = {}
+    failures: Dict[int, int] = {}
+    decided: Dict[int, int] = {}
+    agents: Dict[int, set] = {}
+    counts: Dict[int, int] = {}
+    for group, queued, started, finished, status, agent in zip(
+            columns['build_type'], columns['queued'], columns['started'], columns['finished'],
+            columns['status'], columns['agent']):
+        if group < 0 or (since is not None and not finished >= since):
+            continue
+        counts[group] = counts.get(group, 0) + 1
+        duration = finished - started
+        if not math.isnan(duration):
+            durations.setdefault(group, []).append(duration)
+            if trend_since is not None:
+                (recent if finished >= trend_since else before).setdefault(group, []).append(duration)
+        if not math.isnan(started - queued):
+            queues.setdefault(group, []).append(started - queued)
+        if status >= 0:
+            decided[group] = decided.get(group, 0) + 1
+            failures[group] = failures.get(group, 0) + (status == 0)
+        agents.setdefault(group, set()).add(agent)
+
+    results = []
+    for group in sorted(counts):
+        if counts[group] < max(min_builds, 1):
+            continue
+        duration = sorted(durations.get(group, []))
+        queue = sorted(queues.get(group, []))
+        trend = math.nan
+        if trend_since is not None and recent.get(group) and before.get(group):
+            before_median = interpolated(sorted(before[group]), 50)
+            if before_median:
+                trend = interpolated(sorted(recent[group]), 50) / before_median
+        results.append(ConfigurationStats(
+            build_types[group], counts[group],
+            {q: interpolated(duration, q) for q in PERCENTILES},
+            {q: interpolated(queue, q) for q in PERCENTILES},
+            failures.get(group, 0) / decided[group] if decided.get(group) else math.nan,
+            trend, len(agents[group])))
+    return results
+
+
+def format_seconds(seconds: float) -> str:
+    if math.isnan(seconds):
+        return '-'
+    if seconds >= 3600:
+        return f"{seconds / 3600:.1f}h"
+    if seconds >= 60:
+        return f"{seconds / 60:.1f}m"
+    return f"{seconds:.0f}s"
+
+
+SORT_KEYS = {
+    'p95': lambda stats: stats.duration[95],
+    'queue': lambda stats: stats.queue[95],
+    'failures': lambda stats: stats.failure_rate,
+    'trend': lambda stats: stats.trend,
+    'builds': lambda stats: stats.builds,
+}
+
+
+def print_report(results: List[ConfigurationStats], sort: str, top: int):
+    key = SORT_KEYS[sort]
+    ranked = sorted(results, key=lambda stats: (math.isnan(key(stats)), -key(stats) if not math.isnan(key(stats)) else 0))
+    print(f"{'Configuration':<40} {'Builds':>6} {'p50':>7} {'p95':>7} {'p99':>7} "
+          f"{'Queue p50':>9} {'Queue p95':>9} {'Fail':>5} {'Trend':>6}")
+    for stats in ranked[:top]:
+        trend = '-' if math.isnan(stats.trend) else f"{(stats.trend - 1) * 100:+.0f}%"
+        failure = '-' if math.isnan(stats.failure_rate) else f"{stats.failure_rate * 100:.0f}%"
+        print(f"{stats.build_type[:40]:<40} {stats.builds:>6} {format_seconds(stats.duration[50]):>7} "
+              f"{format_seconds(stats.duration[95]):>7} {format_seconds(stats.duration[99]):>7} "
+              f"{format_seconds(stats.queue[50]):>9} {format_seconds(stats.queue[95]):>9} {failure:>5} {trend:>6}")
+    if len(ranked) > top:
+        print(f"... {len(ranked) - top} more (use --top)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build duration, queue and failure statistics per configuration")
+    parser.add_argument('command', choices=['fetch', 'report', 'info'],
+                        help="fetch: add new builds to the store; report: statistics; info: store summary")
+    parser.add_argument('--store', type=Path, default=DEFAULT_STORE, help=f"History directory (default: {DEFAULT_STORE})")
+    parser.add_argument('--url', help=f"TeamCity URL (default: $TEAMCITY_URL or {DEFAULT_URL})")
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS,
+                        help=f"fetch: history to load into an empty store; report: window (default: {DEFAULT_DAYS})")
+    parser.add_argument('--build-type', action='append', default=[], metavar='ID',
+                        help="fetch: only these configurations (repeatable)")
+    parser.add_argument('--full', action='store_true', help="fetch: discard the store and load --days again")
+    parser.add_argument('--trend-days', type=int, default=7,
+                        help="report: compare the median of the last N days with the rest of the window (default: 7)")
+    parser.add_argument('--min-builds', type=int, default=3, help="report: skip configurations with fewer builds")
+    parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='p95', help="report: ranking (default: p95)")
+    parser.add_argument('--top', type=int, default=20, help="report: rows to print (default: 20)")
+    parser.add_argument('--json', type=Path, help="report: also write every configuration's statistics as JSON")
+    parser.add_argument('--check-engines', action='store_true',
+                        help="report: also run the pure-Python engine and fail if it disagrees with numpy")
+    add_transport_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    print("📈 TeamCity Build History")
+    print("=========================")
+    print()
+
+    store = HistoryStore(args.store)
+    if args.command == 'fetch':
+        load_environment()
+        teamcity_url = args.url or os.getenv('TEAMCITY_URL', DEFAULT_URL)
+        admin_token = os.getenv('TEAMCITY_ADMIN_TOKEN')
+        if not admin_token:
+            print("❌ ERROR: TEAMCITY_ADMIN_TOKEN environment variable not set")
+            sys.exit(1)
+        if store.meta.get('server_url') not in (None, teamcity_url) and not args.full:
+            print(f"❌ ERROR: {args.store} holds history of {store.meta['server_url']}; use --full to replace it")
+            sys.exit(1)
+        if args.full:
+            store.clear()
+        store.set_meta(server_url=teamcity_url)
+
+        api = TeamCityAPI(teamcity_url, admin_token, transport=transport_from_args(args))
+        watermarks = [store.watermark(build_type) for build_type in args.build_type or [None]]
+        since = f"after build {min(watermarks)}" if all(watermarks) else f"last {args.days} days"
+        print(f"📥 Fetching finished builds ({since})...")
+        started = time.perf_counter()
+        try:
+            added = fetch(api, store, args.days, args.build_type)
+        except requests.HTTPError as e:
+            print(f"❌ Failed to fetch builds (HTTP {e.response.status_code}); the store is unchanged")
+            sys.exit(1)
+        except requests.RequestException as e:
+            print(f"❌ Error talking to TeamCity: {e}; the store is unchanged")
+            sys.exit(1)
+        print(f"✅ {added} new builds in {time.perf_counter() - started:.1f}s, {store.rows} stored")
+        print(f"📊 API usage: {api.stats.summary()}")
+        return
+
+    if not store.rows:
+        print(f"❌ ERROR: No history in {args.store}, run '{sys.argv[0]} fetch' first")
+        sys.exit(1)
+
+    if args.command == 'info':
+        size = sum(store.column_path(name).stat().st_size for name in COLUMNS if store.column_path(name).exists())
+        print(f"📁 {args.store}: {store.rows} builds of {len(store.build_types)} configurations "
+              f"from {store.meta.get('server_url') or 'unknown server'}")
+        watermarks = ', '.join(f"{'all' if key == '*' else key} {value}"
+                               for key, value in sorted(store.meta['watermarks'].items()))
+        print(f"   {size / 1024 / 1024:.1f} MiB on disk, refreshed up to build {watermarks or '-'}")
+        return
+
+    now = time.time()
+    started = time.perf_counter()
+    results = analyze(store, now - args.days * 86400, now - args.trend_days * 86400, args.min_builds)
+    elapsed = time.perf_counter() - started
+    engine = 'numpy' if np is not None else 'pure Python; install numpy for faster reports'
+    print(f"🧮 {len(results)} configurations from the last {args.days} days analyzed in {elapsed * 1000:.0f} ms "
+          f"({engine})")
+    print()
+    print_report(results, args.sort, args.top)
+    if args.json:
+        args.json.write_text(json.dumps([stats.as_dict() for stats in results], indent=2) + '\n')
+        print(f"💾 Statistics written to {args.json}")
+    if args.check_engines:
+        print()
+        if np is None:
+            print("❌ --check-engines needs numpy")
+            sys.exit(1)
+        differing = engines_disagree(store.load(), store.build_types, now - args.days * 86400,
+                                     now - args.trend_days * 86400, args.min_builds)
+        if differing:
+            print(f"❌ numpy and pure-Python statistics differ for {len(differing)} configurations: "
+                  f"{', '.join(differing[:10])}")
+            sys.exit(1)
+        print(f"✅ numpy and pure-Python engines agree on all {len(results)} configurations")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+TeamCity Build Trigger & Track
+Queues builds through buildQueue and follows all of them with one polling loop until they finish
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import requests
+
+from deploy import load_environment
+from teamcity_api import AsyncTeamCityAPI, TeamCityAPI, DEFAULT_CONCURRENCY
+from teamcity_model import ROOT_PROJECT_ID, parse_date
+from teamcity_transport import CircuitOpenError, add_transport_arguments, transport_from_args
+
+DEFAULT_URL = "https://teamcity.devinfra.ru"
+DEFAULT_TIMEOUT = 3600
+DEFAULT_MIN_INTERVAL = 1.0
+DEFAULT_MAX_INTERVAL = 15.0
+# Builds per status query; keeps the locator well inside URL length limits
+MAX_BUILDS_PER_QUERY = 100
+TRACK_FIELDS = {'build': ['id', 'buildTypeId', 'state', 'status', 'statusText', 'percentageComplete', 'waitReason',
+                          'queuedDate', 'startDate', 'finishDate', 'webUrl']}
+
+
+class TrackedBuild:
+    """Last seen state of one queued build"""
+
+    def __init__(self, id: int, build_type: str, state: Optional[str] = 'queued'):
+        self.id = id
+        self.build_type = build_type
+        self.state = state
+        self.status: Optional[str] = None
+        self.status_text: Optional[str] = None
+        self.wait_reason: Optional[str] = None
+        self.percent: Optional[int] = None
+        self.queued: Optional[float] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.web_url: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.state in ('finished', 'removed', 'timed out')
+
+    @property
+    def succeeded(self) -> bool:
+        return self.state == 'finished' and self.status == 'SUCCESS'
+
+    def update(self, data: Dict) -> List[str]:
+        """Apply a status response; returns the transitions worth reporting"""
+        transitions = []
+        state = data.get('state', self.state)
+        if state != self.state:
+            transitions.append(state)
+        elif state == 'queued' and data.get('waitReason') and data.get('waitReason') != self.wait_reason:
+            transitions.append('waiting')
+        self.state = state
+        self.build_type = data.get('buildTypeId', self.build_type)
+        self.status = data.get('status', self.status)
+        self.status_text = data.get('statusText', self.status_text)
+        self.wait_reason = data.get('waitReason')
+        self.percent = data.get('percentageComplete')
+        self.queued = parse_date(data.get('queuedDate')) or self.queued
+        self.started = parse_date(data.get('startDate')) or self.started
+        self.finished = parse_date(data.get('finishDate')) or self.finished
+        self.web_url = data.get('webUrl', self.web_url)
+        return transitions
+
+    def remaining(self, now: float) -> Optional[float]:
+        """Estimated seconds until a running build finishes, from its progress so far"""
+        if self.state != 'running' or not self.started or not self.percent:
+            return None
+        elapsed = now - self.started
+        return max(0.0, elapsed * (100 - self.percent) / self.percent)
+
+    def describe(self, transition: str) -> str:
+        if transition == 'queued' or transition == 'waiting':
+            return f"⏳ {self.build_type} #{self.id} queued: {self.wait_reason or 'waiting for an agent'}"
+        if transition == 'running':
+            return f"🏃 {self.build_type} #{self.id} started"
+        if transition == 'finished':
+            symbol = '✅' if self.status == 'SUCCESS' else '❌'
+            text = f": {self.status_text}" if self.status_text else ''
+            return (f"{symbol} {self.build_type} #{self.id} finished {self.status}{text} "
+                    f"({format_duration(self.run_time)})")
+        return f"⚠️  {self.build_type} #{self.id} {transition}"
+
+    @property
+    def queue_time(self) -> Optional[float]:
+        if self.queued is None:
+            return None
+        return (self.started or self.finished or time.time()) - self.queued
+
+    @property
+    def run_time(self) -> Optional[float]:
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+    def as_dict(self) -> Dict:
+        return {'id': self.id, 'buildType': self.build_type, 'state': self.state, 'status': self.status,
+                'statusText': self.status_text, 'queueSeconds': self.queue_time, 'runSeconds': self.run_time,
+                'webUrl': self.web_url}
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return '-'
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m{seconds:02d}s" if minutes else f"{seconds}s"
+
+
+async def trigger_builds(async_api: AsyncTeamCityAPI, build_types: Sequence[str], branch: Optional[str],
+                         comment: Optional[str]) -> List[TrackedBuild]:
+    """Queue one build per configuration concurrently; failures are reported and left out"""
+
+    async def trigger(build_type: str) -> Optional[TrackedBuild]:
+        payload: Dict = {'buildType': {'id': build_type}}
+        if branch:
+            payload['branchName'] = branch
+        if comment:
+            payload['comment'] = {'text': comment}
+        try:
+            response = await async_api.post('buildQueue', payload)
+        except (requests.RequestException, CircuitOpenError) as e:
+            print(f"   ❌ {build_type}: {e}")
+            return None
+        if response.status_code not in (200, 201):
+            print(f"   ❌ {build_type}: HTTP {response.status_code} {response.text.strip()[:200]}")
+            return None
+        data = response.json()
+        build = TrackedBuild(data['id'], data.get('buildTypeId', build_type))
+        build.update(data)
+        print(f"   {build.describe('queued')}", flush=True)
+        return build
+
+    return [build for build in await asyncio.gather(*(trigger(bt) for bt in build_types)) if build is not None]
+
+
+def items_locator(build_ids: Sequence[int]) -> str:
+    """One locator matching several builds, e.g. ``item:(id:1),item:(id:2)``"""
+    return ','.join(f"item:(id:{build_id})" for build_id in build_ids)
+
+
+def poll(api: TeamCityAPI, builds: List[TrackedBuild]) -> List[str]:
+    """Refresh every unfinished build, at most MAX_BUILDS_PER_QUERY per request; returns the transition lines
+
+    If a batch is rejected because one of its builds no longer exists
+    (removed from the queue), its builds are looked up one by one once to
+    find and drop the missing ones.
+    """
+    lines = []
+    by_id = {build.id: build for build in builds}
+    pending = [build.id for build in builds if not build.done]
+    for start in range(0, len(pending), MAX_BUILDS_PER_QUERY):
+        batch = pending[start:start + MAX_BUILDS_PER_QUERY]
+        response = api.query('builds', items_locator(batch), TRACK_FIELDS, max_age=0)
+        if response.status_code == 404:
+            found = []
+            for build_id in batch:
+                single = api.query(f'builds/id:{build_id}', fields=TRACK_FIELDS['build'], max_age=0)
+                if single.status_code == 404:
+                    by_id[build_id].state = 'removed'
+                    lines.append(by_id[build_id].describe('removed from the queue'))
+                else:
+                    single.raise_for_status()
+                    found.append(single.json())
+            items = found
+        else:
+            response.raise_for_status()
+            items = response.json().get('build', [])
+        for data in items:
+            build = by_id.get(data['id'])
+            if build is None:
+                continue
+            lines.extend(build.describe(transition) for transition in build.update(data))
+    return lines
+
+
+class PollInterval:
+    """Poll quickly while things change and back off while nothing does
+
+    The interval resets to the minimum on any transition and grows by half
+    after each quiet poll, but never sleeps past the estimated finish of the
+    soonest running build.
+    """
+
+    def __init__(self, minimum: float = DEFAULT_MIN_INTERVAL, maximum: float = DEFAULT_MAX_INTERVAL):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.current = minimum
+
+    def next(self, changed: bool, builds: Sequence[TrackedBuild]) -> float:
+        self.current = self.minimum if changed else min(self.maximum, self.current * 1.5)
+        now = time.time()
+        estimates = [remaining for remaining in (build.remaining(now) for build in builds) if remaining is not None]
+        if estimates:
+            return max(self.minimum, min(self.current, min(estimates)))
+        return self.current
+
+
+def track(api: TeamCityAPI, builds: List[TrackedBuild], timeout: float, interval: PollInterval) -> int:
+    """Poll until every build is done or ``timeout`` passes; returns the number of polls"""
+    deadline = time.monotonic() + timeout
+    polls = 0
+    while True:
+        lines = poll(api, builds)
+        polls += 1
+        for line in lines:
+            print(f"   {line}", flush=True)
+        pending = [build for build in builds if not build.done]
+        if not pending:
+            return polls
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            for build in pending:
+                build.state = 'timed out'
+            print(f"   ⏰ Gave up on {len(pending)} builds after {timeout:.0f}s")
+            return polls
+        # The last poll lands on the deadline so nothing finishing just before it is missed
+        time.sleep(min(interval.next(bool(lines), pending), remaining))
+
+
+def print_summary(builds: List[TrackedBuild]):
+    print("📋 Summary:")
+    width = max([len(build.build_type) for build in builds] + [len('Configuration')])
+    print(f"   {'Configuration':<{width}} {'Build':>9} {'Result':<10} {'Queued':>8} {'Ran':>8}  Details")
+    for build in sorted(builds, key=lambda b: (b.succeeded, b.build_type)):
+        result = build.status if build.state == 'finished' else build.state
+        details = build.status_text or build.wait_reason or ''
+        print(f"   {build.build_type:<{width}} {build.id:>9} {result or '-':<10} "
+              f"{format_duration(build.queue_time):>8} {format_duration(build.run_time):>8}  {details}")
+    succeeded = sum(1 for build in builds if build.succeeded)
+    print(f"   {succeeded}/{len(builds)} succeeded")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Trigger TeamCity builds and track them until they finish")
+    parser.add_argument('build_types', nargs='*', help="Build configuration ids to trigger")
+    parser.add_argument('--url', help=f"TeamCity URL (default: $TEAMCITY_URL or {DEFAULT_URL})")
+    parser.add_argument('--project', help="Also trigger every configuration under this project")
+    parser.add_argument('--track', type=int, nargs='+', default=[], metavar='BUILD_ID',
+                        help="Track builds that are already queued instead of (or as well as) triggering")
+    parser.add_argument('--branch', help="Branch to build (default: the configuration's default branch)")
+    parser.add_argument('--comment', default="Verification build", help="Comment on the queued builds")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help=f"Seconds to wait for all builds (default: {DEFAULT_TIMEOUT})")
+    parser.add_argument('--min-interval', type=float, default=DEFAULT_MIN_INTERVAL,
+                        help=f"Shortest pause between polls (default: {DEFAULT_MIN_INTERVAL:g}s)")
+    parser.add_argument('--max-interval', type=float, default=DEFAULT_MAX_INTERVAL,
+                        help=f"Longest pause between polls (default: {DEFAULT_MAX_INTERVAL:g}s)")
+    parser.add_argument('--json', type=Path, help="Write the final state of every build as JSON")
+    add_transport_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    print("🚦 TeamCity Build Trigger & Track")
+    print("================================")
+    print()
+
+    load_environment()
+    teamcity_url = args.url or os.getenv('TEAMCITY_URL', DEFAULT_URL)
+    admin_token = os.getenv('TEAMCITY_ADMIN_TOKEN')
+    if not admin_token:
+        print("❌ ERROR: TEAMCITY_ADMIN_TOKEN environment variable not set")
+        sys.exit(1)
+
+    api = TeamCityAPI(teamcity_url, admin_token, transport=transport_from_args(args))
+    build_types = list(dict.fromkeys(args.build_types))
+    try:
+        if args.project:
+            locator = {'affectedProject': {'id': args.project}} if args.project != ROOT_PROJECT_ID else None
+            for build_type in api.iter_build_types(locator, fields={'buildType': ['id']}, page_size=1000):
+                if build_type['id'] not in build_types:
+                    build_types.append(build_type['id'])
+    except requests.HTTPError as e:
+        print(f"❌ Failed to list configurations of {args.project} (HTTP {e.response.status_code})")
+        sys.exit(1)
+    if not build_types and not args.track:
+        print("❌ ERROR: Nothing to do; give build configuration ids, --project or --track")
+        sys.exit(1)
+
+    # State unknown until the first poll, which reports whatever they are doing now
+    builds = [TrackedBuild(build_id, '?', state=None) for build_id in args.track]
+    if build_types:
+        print(f"🚀 Queueing {len(build_types)} builds...")
+        async_api = AsyncTeamCityAPI(api, DEFAULT_CONCURRENCY)
+        try:
+            builds += asyncio.run(trigger_builds(async_api, build_types, args.branch, args.comment))
+        finally:
+            async_api.close()
+    if not builds:
+        print("❌ No builds were queued")
+        sys.exit(1)
+
+    print(f"👀 Tracking {len(builds)} builds...")
+    started = time.monotonic()
+    try:
+        polls = track(api, builds, args.timeout, PollInterval(args.min_interval, args.max_interval))
+    except requests.HTTPError as e:
+        print(f"❌ Failed to read build status (HTTP {e.response.status_code})")
+        sys.exit(1)
+    except (requests.RequestException, CircuitOpenError) as e:
+        print(f"❌ Error talking to TeamCity: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print()
+        print("⏹️  Stopped tracking; the builds keep running")
+        sys.exit(130)
+
+    print()
+    print_summary(builds)
+    print(f"⏱️  {time.monotonic() - started:.1f}s, {polls} polls")
+    print(f"📊 API usage: {api.stats.summary()}")
+    if args.json:
+        args.json.write_text(json.dumps([build.as_dict() for build in builds], indent=2) + '\n')
+    sys.exit(0 if all(build.succeeded for build in builds) else 1)
+
+
+if __name__ == "__main__":
+    main()
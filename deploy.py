@@ -7,61 +7,48 @@ Deploys TeamCity Configuration as Code using REST API
 import os
 import sys
 import json
-import base64
-import requests
 import time
+import argparse
 from pathlib import Path
 from typing import Dict, List, Optional
 
-# Disable SSL warnings for self-signed certificates
-requests.packages.urllib3.disable_warnings()
+import requests
 
-class TeamCityAPI:
-    def __init__(self, url: str, token: str):
-        self.url = url.rstrip('/')
-        self.token = token
-        self.session = requests.Session()
-        
-        # Set up Basic authentication
-        auth_string = f":{token}"
-        auth_bytes = auth_string.encode('ascii')
-        auth_b64 = base64.b64encode(auth_bytes).decode('ascii')
-        
-        self.session.headers.update({
-            'Authorization': f'Basic {auth_b64}',
-            'Accept': 'application/json',
-            'Content-Type': 'application/json'
-        })
-        
-        # Disable SSL verification for development
-        self.session.verify = False
-    
-    def get(self, endpoint: str) -> requests.Response:
-        """Make GET request to TeamCity API"""
-        url = f"{self.url}/app/rest/{endpoint.lstrip('/')}"
-        return self.session.get(url)
-    
-    def post(self, endpoint: str, data: Dict) -> requests.Response:
-        """Make POST request to TeamCity API"""
-        url = f"{self.url}/app/rest/{endpoint.lstrip('/')}"
-        return self.session.post(url, json=data)
-    
-    def put(self, endpoint: str, data: Dict) -> requests.Response:
-        """Make PUT request to TeamCity API"""
-        url = f"{self.url}/app/rest/{endpoint.lstrip('/')}"
-        return self.session.put(url, json=data)
-    
-    def delete(self, endpoint: str) -> requests.Response:
-        """Make DELETE request to TeamCity API"""
-        url = f"{self.url}/app/rest/{endpoint.lstrip('/')}"
-        return self.session.delete(url)
+from teamcity_api import (
+    TeamCityAPI, build_locator, DEFAULT_PAGE_SIZE,
+    PROJECT_FEATURE_FIELDS,
+)
+from teamcity_cache import ResponseCache
+from teamcity_model import Project, ProjectTree, property_dict
+from teamcity_metrics import (
+    Instrumentation, add_instrumentation_arguments, instrumentation_from_args, phase, report_instrumentation,
+)
+from teamcity_fleet import DEFAULT_MAX_PARALLEL, FleetTarget, load_inventory, print_fleet_summary, run_fleet
+from teamcity_transport import Transport, add_transport_arguments, transport_from_args
+from teamcity_plan import (
+    Plan, ServerSnapshot, DesiredState, VCS_ROOT_ID, VERSIONED_SETTINGS_PROPERTIES,
+    apply_plan, build_plan, default_desired_state, property_list,
+)
+from teamcity_sync import SETTINGS_PATH, SyncWaiter, ProjectsExistProbe, expected_projects_from_settings
+from teamcity_syncprobe import LatencyResults, ProbeError, SettingsRepo, add_probe_arguments, print_report, probe_once
 
 class TeamCityDeployer:
-    def __init__(self, teamcity_url: str, admin_token: str, repo_url: str):
-        self.api = TeamCityAPI(teamcity_url, admin_token)
+    def __init__(self, teamcity_url: str, admin_token: str, repo_url: str,
+                 page_size: int = DEFAULT_PAGE_SIZE, cache: Optional[ResponseCache] = None,
+                 settings_path: Path = SETTINGS_PATH, transport: Optional[Transport] = None,
+                 instrumentation: Optional[Instrumentation] = None):
+        self.api = TeamCityAPI(teamcity_url, admin_token, cache, transport)
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            instrumentation.attach(self.api)
         self.repo_url = repo_url
         self.teamcity_url = teamcity_url
+        self.page_size = page_size
+        self.expected_projects = expected_projects_from_settings(settings_path)
+        self.desired_state: DesiredState = default_desired_state(repo_url)
+        self.sync_triggered_at: Optional[float] = None
         
+    @phase('connection test')
     def test_connection(self) -> bool:
         """Test connection to TeamCity server"""
         print("🔗 Testing TeamCity connection...")
@@ -79,59 +66,44 @@ class TeamCityDeployer:
             print(f"❌ Connection error: {e}")
             return False
     
-    def list_projects(self) -> List[Dict]:
-        """List all projects"""
+    def list_projects(self) -> ProjectTree:
+        """List all projects, indexing them as they stream in"""
         print("📋 Current TeamCity projects:")
+        tree = ProjectTree()
         try:
-            response = self.api.get('projects')
-            if response.status_code == 200:
-                projects = response.json().get('project', [])
-                for project in projects:
-                    print(f"  - {project['name']} (ID: {project['id']})")
-                return projects
-            else:
-                print(f"❌ Failed to list projects (HTTP {response.status_code})")
-                return []
+            for data in self.api.iter_projects(page_size=self.page_size):
+                project = Project.from_json(data)
+                print(f"  - {project.name} (ID: {project.id})")
+                tree.add_project(project)
+        except requests.HTTPError as e:
+            print(f"❌ Failed to list projects (HTTP {e.response.status_code})")
         except Exception as e:
             print(f"❌ Error listing projects: {e}")
-            return []
+        return tree
     
     def get_vcs_roots(self) -> List[Dict]:
         """List all VCS roots"""
         try:
-            response = self.api.get('vcs-roots')
-            if response.status_code == 200:
-                return response.json().get('vcs-root', [])
-            return []
+            return list(self.api.iter_vcs_roots(page_size=self.page_size))
         except Exception as e:
             print(f"❌ Error getting VCS roots: {e}")
             return []
     
+    @phase('vcs root')
     def create_vcs_root(self) -> bool:
         """Create VCS root for the GitHub repository"""
         print("📂 Creating VCS Root...")
         
-        # Check if VCS root already exists
-        existing_roots = self.get_vcs_roots()
-        for root in existing_roots:
-            if root.get('name') == 'TeamCity Configurations GitHub Repository':
-                print("   ⚠️  VCS Root already exists, skipping creation")
-                return True
+        # Check if VCS root already exists, stopping at the first match
+        try:
+            for root in self.api.iter_vcs_roots(fields={'vcs-root': ['id', 'name']}, page_size=self.page_size):
+                if root.get('name') == self.desired_state.vcs_roots[0].name:
+                    print("   ⚠️  VCS Root already exists, skipping creation")
+                    return True
+        except Exception as e:
+            print(f"❌ Error getting VCS roots: {e}")
         
-        vcs_root_data = {
-            "id": "TeamcityConfigurations_GitHubRepo",
-            "name": "TeamCity Configurations GitHub Repository",
-            "vcsName": "jetbrains.git",
-            "project": {"id": "_Root"},
-            "properties": {
-                "property": [
-                    {"name": "branch", "value": "refs/heads/main"},
-                    {"name": "url", "value": self.repo_url},
-                    {"name": "authMethod", "value": "PRIVATE_KEY_DEFAULT"},
-                    {"name": "ignoreKnownHosts", "value": "true"}
-                ]
-            }
-        }
+        vcs_root_data = self.desired_state.vcs_roots[0].create_payload()
         
         try:
             response = self.api.post('vcs-roots', vcs_root_data)
@@ -150,24 +122,20 @@ class TeamCityDeployer:
         """Get versioned settings status"""
         print("🔍 Checking versioned settings status...")
         try:
-            response = self.api.get('projects/id:_Root/projectFeatures')
+            # One query returns the feature together with its properties
+            response = self.api.query('projects/id:_Root/projectFeatures',
+                                      locator=build_locator(type='versionedSettings'),
+                                      fields=PROJECT_FEATURE_FIELDS)
             if response.status_code == 200:
                 features = response.json().get('projectFeature', [])
                 for feature in features:
-                    if feature.get('type') == 'versionedSettings':
-                        print(f"   📋 Found versioned settings feature (ID: {feature['id']})")
-                        
-                        # Get detailed feature info
-                        detail_response = self.api.get(f'projects/id:_Root/projectFeatures/id:{feature["id"]}')
-                        if detail_response.status_code == 200:
-                            detail = detail_response.json()
-                            properties = {prop['name']: prop['value'] for prop in detail.get('properties', {}).get('property', [])}
-                            print(f"   - Enabled: {properties.get('enabled', 'unknown')}")
-                            print(f"   - VCS Root: {properties.get('rootId', 'unknown')}")
-                            print(f"   - Build Settings: {properties.get('buildSettings', 'unknown')}")
-                            print(f"   - Import Settings: {properties.get('importSettings', 'unknown')}")
-                            return detail
-                        return feature
+                    print(f"   📋 Found versioned settings feature (ID: {feature['id']})")
+                    properties = property_dict(feature)
+                    print(f"   - Enabled: {properties.get('enabled', 'unknown')}")
+                    print(f"   - VCS Root: {properties.get('rootId', 'unknown')}")
+                    print(f"   - Build Settings: {properties.get('buildSettings', 'unknown')}")
+                    print(f"   - Import Settings: {properties.get('importSettings', 'unknown')}")
+                    return feature
                 print("   ⚠️  No versioned settings feature found")
                 return None
             else:
@@ -177,9 +145,11 @@ class TeamCityDeployer:
             print(f"   ❌ Error checking versioned settings: {e}")
             return None
 
+    @phase('sync')
     def force_sync_from_vcs(self) -> bool:
         """Force synchronization from VCS by making a sync request"""
         print("🔄 Forcing synchronization from VCS...")
+        self.sync_triggered_at = time.monotonic()
         try:
             # Try to trigger sync using the versioned settings sync endpoint
             response = self.api.post('projects/id:_Root/versionedSettings/commitCurrentSettings', {})
@@ -202,6 +172,7 @@ class TeamCityDeployer:
             print(f"   ❌ Error forcing sync: {e}")
             return False
     
+    @phase('versioned settings')
     def configure_versioned_settings(self) -> bool:
         """Configure versioned settings for the Root project"""
         print("⚙️  Configuring versioned settings...")
@@ -210,10 +181,10 @@ class TeamCityDeployer:
         current_settings = self.get_versioned_settings_status()
         if current_settings:
             print("   ✅ Versioned settings already exist, checking configuration...")
-            properties = {prop['name']: prop['value'] for prop in current_settings.get('properties', {}).get('property', [])}
+            properties = property_dict(current_settings)
             
             # Check if it's pointing to the correct VCS root
-            if properties.get('rootId') == 'TeamcityConfigurations_GitHubRepo':
+            if properties.get('rootId') == VCS_ROOT_ID:
                 print("   ✅ Already pointing to correct VCS root")
                 return True
             else:
@@ -223,16 +194,7 @@ class TeamCityDeployer:
         
         versioned_settings_data = {
             "type": "versionedSettings",
-            "properties": {
-                "property": [
-                    {"name": "credentialsStorageType", "value": "credentialsJSON"},
-                    {"name": "enabled", "value": "true"},
-                    {"name": "rootId", "value": "TeamcityConfigurations_GitHubRepo"},
-                    {"name": "showChanges", "value": "true"},
-                    {"name": "buildSettings", "value": "PREFER_VCS"},
-                    {"name": "importSettings", "value": "true"}
-                ]
-            }
+            "properties": property_list(VERSIONED_SETTINGS_PROPERTIES)
         }
         
         try:
@@ -252,16 +214,7 @@ class TeamCityDeployer:
         """Update existing versioned settings"""
         versioned_settings_data = {
             "type": "versionedSettings",
-            "properties": {
-                "property": [
-                    {"name": "credentialsStorageType", "value": "credentialsJSON"},
-                    {"name": "enabled", "value": "true"},
-                    {"name": "rootId", "value": "TeamcityConfigurations_GitHubRepo"},
-                    {"name": "showChanges", "value": "true"},
-                    {"name": "buildSettings", "value": "PREFER_VCS"},
-                    {"name": "importSettings", "value": "true"}
-                ]
-            }
+            "properties": property_list(VERSIONED_SETTINGS_PROPERTIES)
         }
         
         try:
@@ -276,36 +229,15 @@ class TeamCityDeployer:
             print(f"   ❌ Error updating versioned settings: {e}")
             return False
     
+    @phase('sync')
     def trigger_sync(self) -> bool:
         """Trigger synchronization from VCS"""
         print("🔄 Triggering project synchronization...")
+        self.sync_triggered_at = time.monotonic()
         try:
-            # Get the versioned settings feature
-            features = self.get_project_features("_Root")
-            vs_feature = None
-            for feature in features:
-                if feature.get('type') == 'versionedSettings':
-                    vs_feature = feature
-                    break
-            
-            if not vs_feature:
-                print("   ❌ No versioned settings feature found")
-                return False
-            
-            # Trigger sync by updating the feature (this forces a refresh)
-            feature_id = vs_feature['id']
-            
-            # First, get current feature data
-            response = self.api.get(f'projects/id:_Root/projectFeatures/id:{feature_id}')
-            if response.status_code != 200:
-                print(f"   ❌ Failed to get feature data (HTTP {response.status_code})")
-                return False
-            
-            feature_data = response.json()
-            
-            # Update with force sync
-            response = self.api.put(f'projects/id:_Root/projectFeatures/id:{feature_id}', feature_data)
-            if response.status_code == 200:
+            # Ask the server to check the settings VCS root for changes
+            response = self.api.post('projects/id:_Root/versionedSettings/checkForChanges', {})
+            if response.status_code in [200, 202, 204]:
                 print("   ✅ Synchronization triggered")
                 return True
             else:
@@ -316,40 +248,63 @@ class TeamCityDeployer:
             print(f"   ❌ Error triggering sync: {e}")
             return False
     
-    def wait_for_sync(self, timeout: int = 120) -> bool:
-        """Wait for synchronization to complete"""
+    @phase('plan')
+    def plan(self) -> Optional[Plan]:
+        """Diff the desired state against one snapshot of the server"""
+        print("🔍 Reading server state...")
+        try:
+            snapshot = ServerSnapshot.fetch(self.api, self.desired_state.project_ids())
+        except requests.HTTPError as e:
+            print(f"   ❌ Failed to read project state (HTTP {e.response.status_code})")
+            return None
+        except Exception as e:
+            print(f"   ❌ Error reading project state: {e}")
+            return None
+        plan = build_plan(self.desired_state, snapshot)
+        plan.print()
+        return plan
+    
+    @phase('apply')
+    def apply(self, plan: Plan) -> bool:
+        """Execute a plan; a plan without changes issues no writes"""
+        if not plan.has_changes:
+            print("✅ Server already matches the desired state, nothing to apply")
+            return True
+        try:
+            return apply_plan(self.api, plan)
+        except Exception as e:
+            print(f"   ❌ Error applying plan: {e}")
+            return False
+    
+    @phase('wait')
+    def wait_for_sync(self, timeout: int = 120, predicates: Optional[List] = None) -> bool:
+        """Wait for synchronization to complete
+        
+        By default waits until every project registered in settings.kts exists;
+        pass predicates (see teamcity_sync) to wait for something else.
+        """
         print("⏳ Waiting for synchronization to complete...")
-        start_time = time.time()
+        if predicates is None:
+            predicates = [ProjectsExistProbe(self.expected_projects)]
         
-        while time.time() - start_time < timeout:
-            projects = self.list_projects()
-            
-            # Check if TestBusinessProject exists
-            for project in projects:
-                if project['id'] == 'TestBusinessProject':
-                    print("   ✅ TestBusinessProject found - synchronization successful!")
-                    return True
-            
-            print("   🔄 Still synchronizing... (waiting 10 seconds)")
-            time.sleep(10)
+        result = SyncWaiter(self.api, predicates).wait(timeout, started_at=self.sync_triggered_at)
+        if result.completed:
+            print(f"   ✅ Synchronization complete in {result.elapsed:.1f}s ({result.attempts} checks)")
+            return True
         
-        print(f"   ⏰ Timeout after {timeout} seconds")
+        print(f"   ⏰ Timeout after {timeout} seconds, still waiting on: {', '.join(result.pending)}")
         return False
     
+    @phase('validate')
     def validate_configuration(self) -> bool:
         """Validate that the configuration was imported correctly"""
         print("🔍 Validating configuration import...")
         
-        projects = self.list_projects()
-        project_names = [p['name'] for p in projects]
-        
-        expected_projects = [
-            'TestBusinessProject'
-        ]
+        tree = self.list_projects()
         
         success = True
-        for expected in expected_projects:
-            if expected in project_names:
+        for expected in self.expected_projects:
+            if expected in tree:
                 print(f"   ✅ {expected} found")
             else:
                 print(f"   ❌ {expected} missing")
@@ -368,7 +323,156 @@ def load_environment():
                     key, value = line.split('=', 1)
                     os.environ[key] = value
 
+def print_usage(deployer: TeamCityDeployer, include_transport: bool = True):
+    """Print request, transport and cache statistics for the run"""
+    print()
+    print(f"📊 API usage: {deployer.api.stats.summary()}")
+    if include_transport:
+        print(f"🔁 Transport: {deployer.api.transport.summary()}")
+    if deployer.api.cache is not None:
+        print(f"📦 Response cache: {deployer.api.cache.stats.summary()}")
+
+def sync_and_validate(deployer: TeamCityDeployer) -> bool:
+    """Force a sync from VCS, wait for it and validate the imported projects"""
+    # Force synchronization
+    print("🔄 Attempting to force synchronization...")
+    deployer.force_sync_from_vcs()
+    print()
+    
+    # Wait for sync and validate
+    if deployer.wait_for_sync():
+        if deployer.validate_configuration():
+            print("🎉 Deployment completed successfully!")
+            print()
+            print(f"🔗 Check your TeamCity instance: {deployer.teamcity_url}")
+            print(f"   - Go to Projects to see {', '.join(deployer.expected_projects)}")
+            print("   - Check Administration → Versioned Settings for sync status")
+            return True
+        else:
+            print("⚠️  Deployment completed but validation failed")
+            print("   Please check TeamCity manually for any issues")
+    else:
+        print("❌ Synchronization did not complete within timeout")
+        print("   Please check TeamCity manually:")
+        print(f"   - Go to {deployer.teamcity_url}")
+        print("   - Check Administration → Versioned Settings")
+        print("   - Look for any error messages")
+    return False
+
+def reconcile(deployer: TeamCityDeployer, plan_only: bool = False) -> bool:
+    """One snapshot read, then only the writes the diff requires; sync only if something changed"""
+    plan = deployer.plan()
+    if plan is None:
+        return False
+    print()
+    if plan_only or not plan.has_changes:
+        return plan_only or deployer.apply(plan)
+    if not deployer.apply(plan):
+        print("❌ Failed to apply plan")
+        return False
+    print()
+    return sync_and_validate(deployer)
+
+def probe_sync_latency(deployer: TeamCityDeployer, args: argparse.Namespace) -> bool:
+    """Time --probe marker commits from landing in VCS until the server has converged on them"""
+    try:
+        repo = SettingsRepo(SETTINGS_PATH, args.probe_remote, args.probe_branch, push=not args.no_push)
+        repo.check()
+    except ProbeError as e:
+        print(f"❌ Cannot probe: {e}")
+        return False
+    results = LatencyResults(args.probe_results, deployer.teamcity_url)
+    # The regression check compares this session with the runs recorded before it
+    previous = results.end_to_end_samples()
+    target = 'committed locally' if args.no_push else f"pushed to {repo.remote}/{repo.branch}"
+    print(f"🔬 Probing sync latency: {args.probe} runs, markers {target}")
+    print()
+
+    session = []
+    for index in range(1, args.probe + 1):
+        try:
+            run = probe_once(deployer.api, repo, deployer.trigger_sync, deployer.expected_projects,
+                             args.probe_timeout, args.probe_interval)
+        except ProbeError as e:
+            print(f"❌ Run {index}/{args.probe}: {e}")
+            break
+        except KeyboardInterrupt:
+            print()
+            print("⏹️  Probe stopped; completed runs are saved")
+            break
+        session.append(run)
+        results.record(run)
+        results.save()
+        if run.outcome == 'converged':
+            print(f"   ✅ Run {index}/{args.probe} ({run.commit}): {run.describe()}")
+        elif run.outcome == 'timed out':
+            print(f"   ⏰ Run {index}/{args.probe} ({run.commit}): no convergence in {args.probe_timeout:g}s, "
+                  f"still waiting on {', '.join(run.pending)}")
+        else:
+            print(f"   ❌ Run {index}/{args.probe} ({run.commit}): {run.outcome}")
+        print()
+
+    print_report(session, results, previous)
+    print(f"💾 Results saved to {args.probe_results}")
+    return len(session) == args.probe and all(run.outcome == 'converged' for run in session)
+
+def run_fleet_mode(args: argparse.Namespace, repo_url: str):
+    """Reconcile every server in the inventory in parallel"""
+    try:
+        targets = load_inventory(args.fleet)
+    except (OSError, ValueError) as e:
+        print(f"❌ ERROR: Cannot load inventory {args.fleet}: {e}")
+        sys.exit(1)
+    
+    print(f"📋 Fleet: {len(targets)} targets, up to {args.max_parallel} in parallel")
+    for target in targets:
+        print(f"  - {target.name}: {target.url}")
+    print()
+    
+    transport = transport_from_args(args)
+    # One instrumentation for the whole fleet: metrics aggregate across targets
+    instrumentation = instrumentation_from_args(args)
+    
+    def deploy_target(target: FleetTarget) -> bool:
+        deployer = TeamCityDeployer(target.url, target.token, target.options.get('repo_url', repo_url),
+                                    cache=ResponseCache() if args.cache else None,
+                                    transport=transport, instrumentation=instrumentation)
+        try:
+            return reconcile(deployer, plan_only=args.plan)
+        finally:
+            # The transport is shared by all targets, so it is reported once below
+            print_usage(deployer, include_transport=False)
+    
+    started = time.monotonic()
+    results = run_fleet(targets, deploy_target, args.max_parallel)
+    print()
+    print_fleet_summary(results, time.monotonic() - started)
+    print(f"🔁 Transport: {transport.summary()}")
+    report_instrumentation(instrumentation, args)
+    if not all(result.success for result in results):
+        sys.exit(1)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Deploy TeamCity Configuration as Code")
+    parser.add_argument('--cache', action='store_true',
+                        help="Cache GET responses for the duration of the run")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--plan', action='store_true',
+                      help="Show the writes needed to reach the desired state and exit")
+    mode.add_argument('--apply', action='store_true',
+                      help="Apply only the writes needed, then sync if anything changed")
+    parser.add_argument('--fleet', type=Path, metavar='INVENTORY',
+                        help="Reconcile every server in a JSON inventory (implies --apply unless --plan)")
+    parser.add_argument('--max-parallel', type=int, default=DEFAULT_MAX_PARALLEL,
+                        help=f"Servers deployed at once in fleet mode (default: {DEFAULT_MAX_PARALLEL})")
+    add_probe_arguments(parser)
+    add_transport_arguments(parser)
+    add_instrumentation_arguments(parser)
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    
     print("🚀 TeamCity Configuration Deployment Script (Python)")
     print("===================================================")
     print()
@@ -377,10 +481,14 @@ def main():
     load_environment()
     
     # Configuration
-    teamcity_url = "https://teamcity.devinfra.ru"
+    teamcity_url = os.getenv('TEAMCITY_URL', "https://teamcity.devinfra.ru")
     repo_url = "git@github.com:muratslavich/teamcity-configurations.git"
     admin_token = os.getenv('TEAMCITY_ADMIN_TOKEN')
     
+    if args.fleet:
+        run_fleet_mode(args, repo_url)
+        return
+    
     if not admin_token:
         print("❌ ERROR: TEAMCITY_ADMIN_TOKEN environment variable not set")
         print("Please set your TeamCity admin token:")
@@ -396,7 +504,31 @@ def main():
     print()
     
     # Initialize deployer
-    deployer = TeamCityDeployer(teamcity_url, admin_token, repo_url)
+    instrumentation = instrumentation_from_args(args)
+    deployer = TeamCityDeployer(teamcity_url, admin_token, repo_url,
+                                cache=ResponseCache() if args.cache else None,
+                                transport=transport_from_args(args),
+                                instrumentation=instrumentation)
+    try:
+        run(deployer, args)
+    finally:
+        report_instrumentation(instrumentation, args)
+
+def run(deployer: TeamCityDeployer, args: argparse.Namespace):
+    """Reconcile with --plan/--apply, probe with --probe, otherwise the full create-configure-sync flow"""
+    if args.probe:
+        success = probe_sync_latency(deployer, args)
+        print_usage(deployer)
+        if not success:
+            sys.exit(1)
+        return
+    
+    if args.plan or args.apply:
+        success = reconcile(deployer, plan_only=args.plan)
+        print_usage(deployer)
+        if not success:
+            sys.exit(1)
+        return
     
     # Test connection
     if not deployer.test_connection():
@@ -418,28 +550,8 @@ def main():
         print("⚠️  Versioned settings configuration had issues, but continuing...")
     print()
     
-    # Force synchronization
-    print("🔄 Attempting to force synchronization...")
-    deployer.force_sync_from_vcs()
-    print()
-    
-    # Wait for sync and validate
-    if deployer.wait_for_sync():
-        if deployer.validate_configuration():
-            print("🎉 Deployment completed successfully!")
-            print()
-            print(f"🔗 Check your TeamCity instance: {teamcity_url}")
-            print("   - Go to Projects to see TestBusinessProject")
-            print("   - Check Administration → Versioned Settings for sync status")
-        else:
-            print("⚠️  Deployment completed but validation failed")
-            print("   Please check TeamCity manually for any issues")
-    else:
-        print("❌ Synchronization did not complete within timeout")
-        print("   Please check TeamCity manually:")
-        print(f"   - Go to {teamcity_url}")
-        print("   - Check Administration → Versioned Settings")
-        print("   - Look for any error messages")
+    sync_and_validate(deployer)
+    print_usage(deployer)
 
 if __name__ == "__main__":
     main()
@@ -7,37 +7,21 @@ Checks current versioned settings configuration
 import os
 import sys
 import json
-import base64
-import requests
+import argparse
 from pathlib import Path
+from typing import Optional
 
-# Disable SSL warnings for self-signed certificates
-requests.packages.urllib3.disable_warnings()
+import requests
 
-class TeamCityAPI:
-    def __init__(self, url: str, token: str):
-        self.url = url.rstrip('/')
-        self.token = token
-        self.session = requests.Session()
-        
-        # Set up Basic authentication
-        auth_string = f":{token}"
-        auth_bytes = auth_string.encode('ascii')
-        auth_b64 = base64.b64encode(auth_bytes).decode('ascii')
-        
-        self.session.headers.update({
-            'Authorization': f'Basic {auth_b64}',
-            'Accept': 'application/json',
-            'Content-Type': 'application/json'
-        })
-        
-        # Disable SSL verification for development
-        self.session.verify = False
-    
-    def get(self, endpoint: str) -> requests.Response:
-        """Make GET request to TeamCity API"""
-        url = f"{self.url}/app/rest/{endpoint.lstrip('/')}"
-        return self.session.get(url)
+from teamcity_api import (
+    TeamCityAPI, AsyncTeamCityAPI, DEFAULT_CONCURRENCY, DEFAULT_PAGE_SIZE,
+    VCS_ROOT_FIELDS, PROJECT_FEATURE_FIELDS, PROJECT_FIELDS, BUILD_TYPE_FIELDS,
+)
+from teamcity_metrics import (
+    Instrumentation, add_instrumentation_arguments, instrumentation_from_args, maybe_span, report_instrumentation,
+)
+from teamcity_model import Feature, VcsRoot
+from teamcity_transport import add_transport_arguments, transport_from_args
 
 def load_environment():
     """Load environment variables from .env file"""
@@ -50,92 +34,108 @@ def load_environment():
                     key, value = line.split('=', 1)
                     os.environ[key] = value
 
-def main():
-    print("🔍 TeamCity Configuration Diagnostic")
-    print("====================================")
-    print()
-    
-    # Load environment
-    load_environment()
-    
-    # Configuration
-    teamcity_url = "https://teamcity.devinfra.ru"
-    admin_token = os.getenv('TEAMCITY_ADMIN_TOKEN')
-    
-    if not admin_token:
-        print("❌ ERROR: TEAMCITY_ADMIN_TOKEN environment variable not set")
-        sys.exit(1)
-    
-    api = TeamCityAPI(teamcity_url, admin_token)
-    
+def parse_args():
+    parser = argparse.ArgumentParser(description="TeamCity configuration diagnostic")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Maximum concurrent page requests (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                        help=f"Items per page when listing collections (default: {DEFAULT_PAGE_SIZE})")
+    add_transport_arguments(parser)
+    add_instrumentation_arguments(parser)
+    return parser.parse_args()
+
+def print_diagnosis(api: TeamCityAPI, async_api: AsyncTeamCityAPI, page_size: int = DEFAULT_PAGE_SIZE,
+                    instrumentation: Optional[Instrumentation] = None):
+    """Print VCS roots, root project features, projects and build configurations"""
     # Check VCS roots
     print("📂 VCS Roots:")
-    response = api.get('vcs-roots')
-    if response.status_code == 200:
-        vcs_roots = response.json().get('vcs-root', [])
-        for root in vcs_roots:
-            print(f"  - {root['name']} (ID: {root['id']})")
-            
-            # Get details
-            detail_response = api.get(f'vcs-roots/id:{root["id"]}')
-            if detail_response.status_code == 200:
-                details = detail_response.json()
-                properties = {prop['name']: prop['value'] for prop in details.get('properties', {}).get('property', [])}
-                print(f"    URL: {properties.get('url', 'unknown')}")
-                print(f"    Branch: {properties.get('branch', 'unknown')}")
-                print(f"    Auth Method: {properties.get('authMethod', 'unknown')}")
-    else:
-        print(f"❌ Failed to get VCS roots (HTTP {response.status_code})")
+    with maybe_span(instrumentation, 'vcs roots'):
+        try:
+            for data in async_api.iter_collection('vcs-roots', 'vcs-root', fields=VCS_ROOT_FIELDS,
+                                                  page_size=page_size):
+                root = VcsRoot.from_json(data)
+                print(f"  - {root.name} (ID: {root.id})")
+                print(f"    URL: {root.properties.get('url', 'unknown')}")
+                print(f"    Branch: {root.properties.get('branch', 'unknown')}")
+                print(f"    Auth Method: {root.properties.get('authMethod', 'unknown')}")
+        except requests.HTTPError as e:
+            print(f"❌ Failed to get VCS roots (HTTP {e.response.status_code})")
     
     print()
     
     # Check project features
     print("⚙️  Root Project Features:")
-    response = api.get('projects/id:_Root/projectFeatures')
-    if response.status_code == 200:
-        features = response.json().get('projectFeature', [])
-        for feature in features:
-            print(f"  - {feature['type']} (ID: {feature['id']})")
+    with maybe_span(instrumentation, 'project features'):
+        response = api.query('projects/id:_Root/projectFeatures', fields=PROJECT_FEATURE_FIELDS)
+        if response.status_code == 200:
+            features = [Feature.from_json(data) for data in response.json().get('projectFeature', [])]
+            for feature in features:
+                print(f"  - {feature.type} (ID: {feature.id})")
             
-            if feature['type'] == 'versionedSettings':
-                # Get detailed feature info
-                detail_response = api.get(f'projects/id:_Root/projectFeatures/id:{feature["id"]}')
-                if detail_response.status_code == 200:
-                    detail = detail_response.json()
-                    properties = {prop['name']: prop['value'] for prop in detail.get('properties', {}).get('property', [])}
+                if feature.type == 'versionedSettings':
+                    properties = feature.properties
                     print(f"    Enabled: {properties.get('enabled', 'unknown')}")
                     print(f"    VCS Root ID: {properties.get('rootId', 'unknown')}")
                     print(f"    Build Settings: {properties.get('buildSettings', 'unknown')}")
                     print(f"    Import Settings: {properties.get('importSettings', 'unknown')}")
                     print(f"    Credentials Storage: {properties.get('credentialsStorageType', 'unknown')}")
                     print(f"    Show Changes: {properties.get('showChanges', 'unknown')}")
-    else:
-        print(f"❌ Failed to get project features (HTTP {response.status_code})")
+        else:
+            print(f"❌ Failed to get project features (HTTP {response.status_code})")
     
     print()
     
     # Check current projects
     print("📋 Current Projects:")
-    response = api.get('projects')
-    if response.status_code == 200:
-        projects = response.json().get('project', [])
-        for project in projects:
-            print(f"  - {project['name']} (ID: {project['id']})")
-    else:
-        print(f"❌ Failed to get projects (HTTP {response.status_code})")
+    with maybe_span(instrumentation, 'projects'):
+        try:
+            for project in async_api.iter_collection('projects', 'project', fields=PROJECT_FIELDS,
+                                                     page_size=page_size):
+                print(f"  - {project['name']} (ID: {project['id']})")
+        except requests.HTTPError as e:
+            print(f"❌ Failed to get projects (HTTP {e.response.status_code})")
     
     print()
     
     # Check build configurations
     print("🔧 Build Configurations:")
-    response = api.get('buildTypes')
-    if response.status_code == 200:
-        build_types = response.json().get('buildType', [])
-        for bt in build_types:
-            print(f"  - {bt['name']} (ID: {bt['id']}) - Project: {bt.get('projectName', 'unknown')}")
-    else:
-        print(f"❌ Failed to get build types (HTTP {response.status_code})")
+    with maybe_span(instrumentation, 'build types'):
+        try:
+            for bt in async_api.iter_collection('buildTypes', 'buildType', fields=BUILD_TYPE_FIELDS,
+                                                page_size=page_size):
+                print(f"  - {bt['name']} (ID: {bt['id']}) - Project: {bt.get('projectName', 'unknown')}")
+        except requests.HTTPError as e:
+            print(f"❌ Failed to get build types (HTTP {e.response.status_code})")
+
+def main():
+    args = parse_args()
+    
+    print("🔍 TeamCity Configuration Diagnostic")
+    print("====================================")
+    print()
+    
+    # Load environment
+    load_environment()
     
+    # Configuration
+    teamcity_url = os.getenv('TEAMCITY_URL', "https://teamcity.devinfra.ru")
+    admin_token = os.getenv('TEAMCITY_ADMIN_TOKEN')
+    
+    if not admin_token:
+        print("❌ ERROR: TEAMCITY_ADMIN_TOKEN environment variable not set")
+        sys.exit(1)
+    
+    api = TeamCityAPI(teamcity_url, admin_token, transport=transport_from_args(args))
+    async_api = AsyncTeamCityAPI(api, args.concurrency)
+    instrumentation = instrumentation_from_args(args)
+    if instrumentation is not None:
+        instrumentation.attach(api)
+    
+    print_diagnosis(api, async_api, args.page_size, instrumentation)
+    print()
+    print(f"📊 API usage: {api.stats.summary()}")
+    print(f"🔁 Transport: {api.transport.summary()}")
+    report_instrumentation(instrumentation, args)
     print()
     print("🎯 Next Steps:")
     print("1. If VCS root exists but versioned settings aren't working:")
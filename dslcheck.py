@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+"""
+TeamCity Kotlin DSL Structural Check
+Catches common settings.kts mistakes in milliseconds and remembers which .teamcity trees already passed
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_DIR = Path('.teamcity')
+CACHE_FILE = Path('.teamcity-check-cache.json')
+# Bump when the checks change so trees that passed an older checker are checked again
+CHECKER_VERSION = 1
+SKIP_DIRS = {'target', '.idea', '.mvn', 'out'}
+
+# Call that registers an object -> kind the object has to be
+REGISTRATIONS = {
+    'subProject': 'Project',
+    'buildType': 'BuildType',
+    'template': 'Template',
+    'vcsRoot': 'VcsRoot',
+}
+# Calls that refer to other objects from inside a configuration
+REFERENCES = {
+    'snapshot': 'BuildType',
+    'artifacts': 'BuildType',
+    'dependency': 'BuildType',
+    'root': 'VcsRoot',
+    'templates': 'Template',
+}
+# Kotlin receivers that look like object references but are provided by the DSL
+BUILTIN_RECEIVERS = {'DslContext', 'RelativeId', 'AbsoluteId'}
+ID_NAMESPACES = {'Project': 'project', 'BuildType': 'build configuration', 'Template': 'build configuration',
+                 'VcsRoot': 'VCS root'}
+OPENING = {'(': ')', '{': '}', '[': ']'}
+CLOSING = {v: k for k, v in OPENING.items()}
+
+
+class Token:
+    __slots__ = ('kind', 'value', 'line')
+
+    def __init__(self, kind: str, value: str, line: int):
+        self.kind = kind
+        self.value = value
+        self.line = line
+
+    def __repr__(self) -> str:
+        return f"Token({self.kind}, {self.value!r}, {self.line})"
+
+
+class Issue:
+    __slots__ = ('level', 'path', 'line', 'message')
+
+    def __init__(self, level: str, path: Path, line: int, message: str):
+        self.level = level
+        self.path = path
+        self.line = line
+        self.message = message
+
+    def __str__(self) -> str:
+        icon = '❌' if self.level == 'error' else '⚠️ '
+        return f"{icon} {self.path}:{self.line}: {self.message}"
+
+
+def kind_of(supertype: str) -> Optional[str]:
+    """Map an object's supertype to the kind registrations check against"""
+    if supertype.endswith('VcsRoot'):
+        return 'VcsRoot'
+    if supertype in ('Project', 'BuildType', 'Template'):
+        return supertype
+    return None
+
+
+def tokenize(text: str) -> Iterator[Token]:
+    """Yield identifiers, string literals and punctuation; comments and whitespace are dropped
+
+    String templates (``"${...}"``) and raw strings are consumed whole so the
+    braces and quotes inside them never reach the bracket matcher.
+    """
+    i, line, n = 0, 1, len(text)
+    while i < n:
+        char = text[i]
+        if char == '\n':
+            line += 1
+            i += 1
+        elif char.isspace():
+            i += 1
+        elif text.startswith('//', i):
+            end = text.find('\n', i)
+            i = n if end < 0 else end
+        elif text.startswith('/*', i):
+            # Kotlin block comments nest
+            depth, j = 1, i + 2
+            while j < n and depth:
+                if text.startswith('/*', j):
+                    depth, j = depth + 1, j + 2
+                elif text.startswith('*/', j):
+                    depth, j = depth - 1, j + 2
+                else:
+                    j += 1
+            line += text.count('\n', i, j)
+            i = j
+        elif text.startswith('"""', i):
+            end = text.find('"""', i + 3)
+            end = n if end < 0 else end + 3
+            while end < n and text[end] == '"':
+                end += 1
+            yield Token('string', text[i + 3:end - 3], line)
+            line += text.count('\n', i, end)
+            i = end
+        elif char == '"':
+            j, depth = i + 1, 0
+            while j < n:
+                c = text[j]
+                if c == '\\':
+                    j += 2
+                    continue
+                if text.startswith('${', j):
+                    depth += 1
+                    j += 2
+                    continue
+                if depth and c == '"':
+                    # A string literal inside a template expression
+                    j += 1
+                    while j < n and text[j] not in '"\n':
+                        j += 2 if text[j] == '\\' else 1
+                elif depth and c == '{':
+                    depth += 1
+                elif depth and c == '}':
+                    depth -= 1
+                elif not depth and c in '"\n':
+                    break
+                j += 1
+            yield Token('string', text[i + 1:j], line)
+            i = j + 1
+        elif char == "'":
+            end = text.find("'", i + 2 if text[i + 1:i + 2] == '\\' else i + 1)
+            i = n if end < 0 else end + 1
+        elif char.isalpha() or char == '_' or char == '`':
+            j = i + 1
+            if char == '`':
+                j = text.find('`', j) + 1 or n
+            else:
+                while j < n and (text[j].isalnum() or text[j] == '_'):
+                    j += 1
+            yield Token('ident', text[i:j].strip('`'), line)
+            i = j
+        elif char.isdigit():
+            j = i + 1
+            while j < n and (text[j].isalnum() or text[j] in '._'):
+                j += 1
+            yield Token('number', text[i:j], line)
+            i = j
+        else:
+            yield Token('punct', char, line)
+            i += 1
+
+
+class Declaration:
+    __slots__ = ('name', 'supertype', 'kind', 'path', 'line', 'explicit_id', 'display_name')
+
+    def __init__(self, name: str, supertype: str, path: Path, line: int):
+        self.name = name
+        self.supertype = supertype
+        self.kind = kind_of(supertype)
+        self.path = path
+        self.line = line
+        self.explicit_id: Optional[str] = None
+        self.display_name: Optional[str] = None
+
+    @property
+    def id(self) -> str:
+        return self.explicit_id or self.name
+
+
+class Reference:
+    __slots__ = ('call', 'name', 'owner', 'path', 'line')
+
+    def __init__(self, call: str, name: str, owner: str, path: Path, line: int):
+        self.call = call
+        self.name = name
+        self.owner = owner
+        self.path = path
+        self.line = line
+
+
+class Frame:
+    """One open bracket while walking the tokens"""
+
+    __slots__ = ('bracket', 'line', 'label', 'owner', 'declares', 'is_body', 'feature', 'feature_id', 'in_features')
+
+    def __init__(self, bracket: str, line: int, label: Optional[str], owner: Optional[str]):
+        self.bracket = bracket
+        self.line = line
+        self.label = label
+        # Object (or '<root>') whose definition this bracket is part of
+        self.owner = owner
+        # The ( right after ``object X : Project``
+        self.declares = False
+        # The lambda directly holding the owner's properties, e.g. the { of Project({
+        self.is_body = False
+        # Set on the block of a project feature, e.g. buildReportTab { ... }
+        self.feature: Optional[str] = None
+        self.feature_id: Optional[str] = None
+        self.in_features = False
+
+
+class SettingsModel:
+    """Declarations, registrations and references collected from every DSL file"""
+
+    def __init__(self):
+        self.declarations: Dict[str, Declaration] = {}
+        self.registrations: List[Reference] = []
+        self.references: List[Reference] = []
+        self.root_project: Optional[Tuple[Path, int]] = None
+        self.features: List[Tuple[str, str, Optional[str], Path, int]] = []
+        self.issues: List[Issue] = []
+        self.has_version = False
+
+    def error(self, path: Path, line: int, message: str):
+        self.issues.append(Issue('error', path, line, message))
+
+    def warning(self, path: Path, line: int, message: str):
+        self.issues.append(Issue('warning', path, line, message))
+
+    def owner_kind(self, owner: Optional[str]) -> Optional[str]:
+        if owner == '<root>':
+            return 'Project'
+        declaration = self.declarations.get(owner or '')
+        return declaration.kind if declaration else None
+
+    def parse(self, path: Path, text: str):
+        tokens = list(tokenize(text))
+        stack: List[Frame] = []
+        pending_object: Optional[Declaration] = None
+
+        def value(index: int) -> Optional[str]:
+            return tokens[index].value if 0 <= index < len(tokens) else None
+
+        def dotted(index: int) -> Tuple[Optional[str], int]:
+            """Read ``A.B.C`` starting at ``index``; returns (name, index after it)"""
+            if index >= len(tokens) or tokens[index].kind != 'ident':
+                return None, index
+            parts = [tokens[index].value]
+            index += 1
+            while value(index) == '.' and index + 1 < len(tokens) and tokens[index + 1].kind == 'ident':
+                parts.append(tokens[index + 1].value)
+                index += 2
+            return '.'.join(parts), index
+
+        for index, token in enumerate(tokens):
+            top = stack[-1] if stack else None
+            owner = top.owner if top else None
+
+            if token.kind == 'punct' and token.value in OPENING:
+                previous = tokens[index - 1] if index else None
+                label = previous.value if previous is not None and previous.kind == 'ident' else None
+                frame = Frame(token.value, token.line, label, owner)
+                if pending_object is not None and token.value == '(':
+                    frame.owner, frame.declares = pending_object.name, True
+                    pending_object = None
+                elif top is not None and top.declares and token.value == '{':
+                    frame.is_body = True
+                elif not stack and label == 'project' and token.value == '{':
+                    frame.owner, frame.is_body = '<root>', True
+                    self.set_root(path, token.line)
+                if token.value == '{' and top is not None:
+                    if label == 'features' and (top.is_body and self.owner_kind(top.owner) == 'Project'):
+                        frame.in_features = True
+                    elif top.in_features and label is not None:
+                        frame.feature = label
+                stack.append(frame)
+                continue
+
+            if token.kind == 'punct' and token.value in CLOSING:
+                if not stack or stack[-1].bracket != CLOSING[token.value]:
+                    expected = f"'{OPENING[stack[-1].bracket]}' for line {stack[-1].line}" if stack else 'nothing'
+                    self.error(path, token.line, f"Unbalanced '{token.value}', expected {expected}")
+                    return
+                frame = stack.pop()
+                if frame.feature is not None:
+                    self.features.append((frame.owner, frame.feature, frame.feature_id, path, frame.line))
+                continue
+
+            if token.kind != 'ident':
+                continue
+            name = token.value
+
+            if name == 'object' and index + 3 < len(tokens) and tokens[index + 1].kind == 'ident' \
+                    and value(index + 2) == ':':
+                supertype, after = dotted(index + 3)
+                if supertype is not None:
+                    declaration = Declaration(tokens[index + 1].value, supertype.split('.')[-1], path, token.line)
+                    self.declare(declaration)
+                    if value(after) == '(':
+                        pending_object = declaration
+                continue
+
+            if not stack and name == 'version' and value(index + 1) == '=':
+                self.has_version = True
+            elif not stack and name == 'project' and value(index + 1) == '(':
+                target, after = dotted(index + 2)
+                if target is not None and value(after) == ')':
+                    self.set_root(path, token.line)
+                    self.references.append(Reference('project', target, '<root>', path, token.line))
+
+            if top is None:
+                continue
+            if top.is_body and value(index + 1) == '=' and index + 2 < len(tokens):
+                assigned = tokens[index + 2]
+                if name == 'id' and top.owner in self.declarations:
+                    explicit = assigned.value if assigned.kind == 'string' else None
+                    if assigned.value in ('RelativeId', 'AbsoluteId') and value(index + 3) == '(':
+                        explicit = value(index + 4)
+                    self.declarations[top.owner].explicit_id = explicit
+                elif name == 'name' and assigned.kind == 'string' and top.owner in self.declarations:
+                    self.declarations[top.owner].display_name = assigned.value
+            elif top.is_body and name == 'id' and value(index + 1) == '(' and index + 2 < len(tokens) \
+                    and tokens[index + 2].kind == 'string' and top.owner in self.declarations:
+                self.declarations[top.owner].explicit_id = tokens[index + 2].value
+            elif top.feature is not None and name == 'id' and value(index + 1) == '=':
+                if index + 2 < len(tokens) and tokens[index + 2].kind == 'string':
+                    top.feature_id = tokens[index + 2].value
+
+            if name in REGISTRATIONS or name in REFERENCES:
+                if value(index + 1) != '(' or (index and value(index - 1) == '.'):
+                    continue
+                # Arguments that are plain (possibly dotted) names; lambdas and calls are inline definitions
+                position = index + 2
+                while True:
+                    target, after = dotted(position)
+                    if target is None or value(after) not in (',', ')'):
+                        break
+                    reference = Reference(name, target, owner or '<root>', path, token.line)
+                    (self.registrations if name in REGISTRATIONS else self.references).append(reference)
+                    if value(after) == ')':
+                        break
+                    position = after + 1
+
+        if stack:
+            self.error(path, stack[-1].line, f"Unclosed '{stack[-1].bracket}'")
+
+    def declare(self, declaration: Declaration):
+        existing = self.declarations.get(declaration.name)
+        if existing is not None:
+            self.error(declaration.path, declaration.line,
+                       f"object {declaration.name} is already declared at {existing.path}:{existing.line}")
+            return
+        self.declarations[declaration.name] = declaration
+
+    def set_root(self, path: Path, line: int):
+        if self.root_project is not None:
+            self.error(path, line, f"Second project definition (first at {self.root_project[0]}:{self.root_project[1]})")
+        else:
+            self.root_project = (path, line)
+
+    def resolve(self, reference: Reference) -> Optional[Declaration]:
+        """Find the object a reference names, or None for DSL-provided receivers"""
+        parts = reference.name.split('.')
+        if parts[0] in BUILTIN_RECEIVERS:
+            return None
+        declaration = self.declarations.get(parts[-1])
+        if declaration is None:
+            kind = REGISTRATIONS.get(reference.call) or REFERENCES.get(reference.call) or 'object'
+            self.error(reference.path, reference.line,
+                       f"{reference.call}({reference.name}) refers to an undeclared {kind}")
+        return declaration
+
+    def check(self, settings_path: Path):
+        if self.root_project is None:
+            self.error(settings_path, 1, "No project { ... } or project(...) definition")
+        if not self.has_version:
+            self.warning(settings_path, 1, 'No version = "..." line; TeamCity needs the DSL API version')
+
+        registered_in: Dict[str, Reference] = {}
+        for registration in self.registrations:
+            declaration = self.resolve(registration)
+            if declaration is None:
+                continue
+            expected = REGISTRATIONS[registration.call]
+            if declaration.kind is not None and declaration.kind != expected:
+                self.error(registration.path, registration.line,
+                           f"{registration.call}({registration.name}) expects a {expected} "
+                           f"but {declaration.name} is a {declaration.supertype}")
+            if self.owner_kind(registration.owner) not in (None, 'Project'):
+                self.error(registration.path, registration.line,
+                           f"{registration.call}({registration.name}) is inside {registration.owner}, "
+                           f"which is not a project")
+            previous = registered_in.get(declaration.name)
+            if previous is not None:
+                where = 'twice in the same project' if previous.owner == registration.owner \
+                    else f"in both {previous.owner} and {registration.owner}"
+                self.error(registration.path, registration.line,
+                           f"{declaration.name} is registered {where} (first at {previous.path}:{previous.line})")
+            else:
+                registered_in[declaration.name] = registration
+
+        for reference in self.references:
+            declaration = self.resolve(reference)
+            if declaration is None:
+                continue
+            expected = 'Project' if reference.call == 'project' else REFERENCES[reference.call]
+            if declaration.kind is not None and declaration.kind != expected:
+                self.error(reference.path, reference.line,
+                           f"{reference.call}({reference.name}) expects a {expected} "
+                           f"but {declaration.name} is a {declaration.supertype}")
+            registered_in.setdefault(declaration.name, reference)
+
+        ids: Dict[Tuple[str, str], Declaration] = {}
+        for declaration in self.declarations.values():
+            if declaration.kind is None:
+                continue
+            namespace = ID_NAMESPACES[declaration.kind]
+            other = ids.get((namespace, declaration.id))
+            if other is not None:
+                self.error(declaration.path, declaration.line,
+                           f"{namespace} id '{declaration.id}' of {declaration.name} is also used by "
+                           f"{other.name} ({other.path}:{other.line})")
+            else:
+                ids[(namespace, declaration.id)] = declaration
+            if declaration.name not in registered_in and declaration.kind != 'Template':
+                self.warning(declaration.path, declaration.line,
+                             f"{declaration.supertype} {declaration.name} is declared but never registered")
+
+        feature_ids: Dict[Tuple[str, str], Tuple[Path, int]] = {}
+        for owner, feature, feature_id, path, line in self.features:
+            project = 'the root project' if owner == '<root>' else owner
+            if not feature_id:
+                self.error(path, line, f"Project feature {feature} in {project} has no id; TeamCity assigns "
+                                       f"a new PROJECT_EXT_* id on every import")
+                continue
+            other = feature_ids.get((owner, feature_id))
+            if other is not None:
+                self.error(path, line, f"Project feature id '{feature_id}' is used twice in {project} "
+                                       f"(first at {other[0]}:{other[1]})")
+            else:
+                feature_ids[(owner, feature_id)] = (path, line)
+
+
+def dsl_files(directory: Path) -> List[Path]:
+    """Every .kt/.kts file under the DSL directory, skipping build output"""
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+        files.extend(Path(root) / name for name in sorted(names) if name.endswith(('.kt', '.kts')))
+    return files
+
+
+def tree_hash(directory: Path) -> str:
+    """SHA-256 over the relative path and content of every file in the tree"""
+    digest = hashlib.sha256()
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+        for name in sorted(names):
+            path = Path(root) / name
+            digest.update(str(path.relative_to(directory)).encode('utf-8') + b'\0')
+            digest.update(path.read_bytes())
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def check_tree(directory: Path) -> List[Issue]:
+    model = SettingsModel()
+    settings_path = directory / 'settings.kts'
+    if not settings_path.exists():
+        return [Issue('error', settings_path, 1, "settings.kts not found")]
+    for path in dsl_files(directory):
+        model.parse(path, path.read_text(encoding='utf-8'))
+    if not any(issue.message.startswith(('Unbalanced', 'Unclosed')) for issue in model.issues):
+        model.check(settings_path)
+    return sorted(model.issues, key=lambda issue: (str(issue.path), issue.line))
+
+
+class CheckCache:
+    """Tree hash each stage last passed with, e.g. {'structure': ..., 'maven': ...}"""
+
+    def __init__(self, path: Path = CACHE_FILE):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.entries: Dict[str, str] = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def passed(self, stage: str, digest: str) -> bool:
+        return self.entries.get(stage) == digest
+
+    def record(self, stage: str, digest: str):
+        self.entries[stage] = digest
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        tmp.write_text(json.dumps(self.entries, indent=2) + '\n')
+        os.replace(tmp, self.path)
+
+
+def structure_key(digest: str) -> str:
+    return f"{digest}:v{CHECKER_VERSION}"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check the structure of the TeamCity Kotlin DSL")
+    parser.add_argument('--dir', type=Path, default=DEFAULT_DIR, help=f"DSL directory (default: {DEFAULT_DIR})")
+    parser.add_argument('--cache', type=Path, default=CACHE_FILE, help=f"Result cache (default: {CACHE_FILE})")
+    parser.add_argument('--no-cache', action='store_true', help="Check even if the tree already passed")
+    parser.add_argument('--strict', action='store_true', help="Treat warnings as errors")
+    stage = parser.add_mutually_exclusive_group()
+    stage.add_argument('--is-clean', metavar='STAGE',
+                       help="Exit 0 if the tree is unchanged since STAGE (e.g. maven) last passed, 1 otherwise")
+    stage.add_argument('--mark-clean', metavar='STAGE', help="Record that STAGE passed for the current tree")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not args.dir.is_dir():
+        print(f"❌ ERROR: {args.dir} is not a directory")
+        sys.exit(1)
+    digest = tree_hash(args.dir)
+    cache = CheckCache(args.cache)
+
+    if args.is_clean:
+        sys.exit(0 if cache.passed(args.is_clean, digest) else 1)
+    if args.mark_clean:
+        cache.record(args.mark_clean, digest)
+        return
+
+    key = structure_key(digest)
+    if not args.no_cache and cache.passed('structure', key):
+        print(f"✅ {args.dir} unchanged since it last passed the structural check")
+        return
+
+    issues = check_tree(args.dir)
+    for issue in issues:
+        print(issue)
+    errors = [issue for issue in issues if issue.level == 'error' or args.strict]
+    if errors:
+        print(f"❌ {len(errors)} problem(s) in {args.dir}")
+        sys.exit(1)
+    warnings = len(issues)
+    print(f"✅ {args.dir} structure OK" + (f" ({warnings} warning(s))" if warnings else ""))
+    cache.record('structure', key)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,856 @@
+#!/usr/bin/env python3
+"""
+Fake TeamCity REST Server
+Local stand-in for the subset of /app/rest used by the deployment scripts, for benchmarks and dry runs
+"""
+
+import argparse
+import calendar
+import hashlib
+import heapq
+import io
+import json
+import random
+import re
+import subprocess
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+DEFAULT_PORT = 8111
+STATS_PATH = '/__fake/stats'
+AGENT_POOLS = ('Default', 'Heavy')
+
+
+def parse_locator(locator: str) -> Dict[str, str]:
+    """Split ``a:1,b:(c:2,d:3)`` into top-level dimensions, keeping nested values as text"""
+    dimensions = {}
+    depth = 0
+    current = ''
+    for char in locator + ',':
+        if char == ',' and depth == 0:
+            if current:
+                name, _, value = current.partition(':')
+                dimensions[name] = value[1:-1] if value.startswith('(') and value.endswith(')') else value
+            current = ''
+            continue
+        depth += char == '('
+        depth -= char == ')'
+        current += char
+    return dimensions
+
+
+def locator_items(locator: str) -> List[str]:
+    """The ``item:(...)`` dimensions of a multi-item locator, which parse_locator would collapse into one"""
+    items, depth, current = [], 0, ''
+    for char in locator + ',':
+        if char == ',' and depth == 0:
+            if current.startswith('item:('):
+                items.append(current[len('item:('):-1])
+            current = ''
+            continue
+        depth += char == '('
+        depth -= char == ')'
+        current += char
+    return items
+
+
+class RawBody:
+    """A non-JSON response body with its own headers, e.g. artifact content"""
+
+    def __init__(self, data: bytes, content_type: str = 'application/octet-stream',
+                 headers: Optional[Dict[str, str]] = None):
+        self.data = data
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+class FakeConfig:
+    def __init__(self, projects: int = 10, build_types: int = 10, vcs_roots: int = 1,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 sync_delay: float = 2.0, imported_projects: Tuple[str, ...] = ('TestBusiness', 'AIChatter'),
+                 seed: Optional[int] = None, builds_per_type: int = 0, agents: int = 4, capacity: int = 0,
+                 build_duration: float = 5.0, artifact_size: float = 4.0, artifact_ranges: bool = True,
+                 sync_pickup: float = 0.0, sync_jitter: float = 0.0, settings_repo: Optional[str] = None):
+        self.projects = projects
+        self.build_types = build_types
+        self.vcs_roots = vcs_roots
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.sync_delay = sync_delay
+        self.imported_projects = imported_projects
+        self.seed = seed
+        self.builds_per_type = builds_per_type
+        self.agents = agents
+        # Requests served at full speed at once; 0 means unlimited
+        self.capacity = capacity
+        # Typical seconds a build triggered through buildQueue takes to run
+        self.build_duration = build_duration
+        # MB of the binary artifact every build has, and whether artifact content honours Range
+        self.artifact_size = artifact_size
+        self.artifact_ranges = artifact_ranges
+        # Seconds before a sync trigger shows up in the versioned-settings status, and +/- around sync_delay
+        self.sync_pickup = sync_pickup
+        self.sync_jitter = sync_jitter
+        # Git working tree whose committed .teamcity/settings.kts params are loaded into _Root on every sync
+        self.settings_repo = settings_repo
+
+
+class FakeTeamCity:
+    """In-memory server state; every method is called with the lock held"""
+
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.random = random.Random(config.seed)
+        self.projects: Dict[str, Dict] = {'_Root': {'id': '_Root', 'name': '<Root project>'}}
+        self.build_types: Dict[str, Dict] = {}
+        self.vcs_roots: Dict[str, Dict] = {}
+        self.features: Dict[str, List[Dict]] = {'_Root': []}
+        self.sync_status = {'type': 'info', 'message': 'Settings are up to date', 'timestamp': self.now()}
+        self.next_feature = 1
+        self.audit: List[Dict] = []
+        self.requests = 0
+        self.by_method: Dict[str, int] = {}
+        self.errors_injected = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.overloaded = 0
+
+        # A shallow tree: every tenth project is a parent for the next nine
+        parent = '_Root'
+        for index in range(config.projects):
+            project_id = f"Project{index}"
+            self.add_project(project_id, f"Project {index}", parent if index % 10 else '_Root')
+            if index % 10 == 0:
+                parent = project_id
+        project_ids = [p for p in self.projects if p != '_Root'] or ['_Root']
+        stride = len(project_ids)
+        for index in range(config.build_types):
+            project_id = project_ids[index % stride]
+            # Build types of one project form a chain; every fifth also takes artifacts from two links back
+            snapshot = [f"Build{index - stride}"] if index >= stride else []
+            artifacts = [f"Build{index - 2 * stride}"] if index >= 2 * stride and index % 5 == 0 else []
+            self.build_types[f"Build{index}"] = {
+                'id': f"Build{index}", 'name': f"Build {index}",
+                'projectId': project_id, 'projectName': self.projects[project_id]['name'],
+                'snapshot-dependencies': {'count': len(snapshot), 'snapshot-dependency': [
+                    {'id': dep, 'type': 'snapshot_dependency', 'source-buildType': {'id': dep}} for dep in snapshot]},
+                'artifact-dependencies': {'count': len(artifacts), 'artifact-dependency': [
+                    {'id': f"ARTIFACT_DEPENDENCY_{dep}", 'type': 'artifact_dependency',
+                     'source-buildType': {'id': dep}} for dep in artifacts]},
+            }
+        self.builds = self.generate_builds()
+        self.triggered: Dict[int, Dict] = {}
+        self._artifacts: Optional[Dict[str, bytes]] = None
+        self.next_build_id = len(self.builds) + 1
+        for index in range(config.vcs_roots):
+            root_id = f"VcsRoot{index}"
+            self.vcs_roots[root_id] = {
+                'id': root_id, 'name': f"VCS root {index}", 'vcsName': 'jetbrains.git', 'project': {'id': '_Root'},
+                'properties': {'property': [{'name': 'url', 'value': f"git@example.com:repo{index}.git"},
+                                            {'name': 'branch', 'value': 'refs/heads/main'}]},
+            }
+
+    def generate_builds(self) -> List[Tuple]:
+        """Finished builds over the last week as (id, buildTypeId, queued, started, finished, status, agent)
+
+        Builds are placed first-come-first-served on the earliest free
+        compatible agent, so queue waits and pool utilization follow from
+        the agent count the way they would on a real server.
+        """
+        requests = []
+        now = time.time()
+        horizon = now - 7 * 86400
+        for build_type in self.build_types:
+            # Each configuration has its own typical duration so percentiles differ between them
+            typical = self.random.uniform(30, 1800)
+            for _ in range(self.config.builds_per_type):
+                queued = horizon + self.random.uniform(0, 7 * 86400 - 2 * 3600)
+                requests.append((queued, build_type, typical * self.random.lognormvariate(0, 0.3)))
+        requests.sort()
+
+        free_at = {pool_id: [(horizon, index) for index in range(pool_id, self.config.agents, len(AGENT_POOLS))]
+                   for pool_id in range(len(AGENT_POOLS))}
+        builds = []
+        for queued, build_type, duration in requests:
+            pools = [heap for pool_id, heap in free_at.items() if heap and self.compatible(pool_id, build_type)]
+            if not pools:
+                continue
+            heap = min(pools, key=lambda heap: heap[0])
+            free, agent = heap[0]
+            started = max(queued, free) + self.random.uniform(1, 15)
+            finished = started + duration
+            if finished > now:
+                # Still queued or running on an overloaded layout
+                continue
+            heapq.heapreplace(heap, (finished, agent))
+            status = 'SUCCESS' if self.random.random() < 0.9 else 'FAILURE'
+            builds.append((build_type, queued, started, finished, status, agent))
+        return [(index + 1,) + build for index, build in enumerate(builds)]
+
+    def compatible(self, pool_id: int, build_type: str) -> bool:
+        # Every 97th configuration fits no agent; every 7th needs the Heavy pool; created ones fit anywhere
+        suffix = build_type[len('Build'):]
+        if not (build_type.startswith('Build') and suffix.isdigit()):
+            return True
+        index = int(suffix)
+        if index % 97 == 0:
+            return False
+        return pool_id == 1 or index % 7 != 0
+
+    def incompatible_build_types(self) -> List[str]:
+        return [build_type for build_type in self.build_types
+                if not any(self.compatible(pool_id, build_type) for pool_id in range(len(AGENT_POOLS)))]
+
+    def agent_view(self, index: int, fields: str) -> Dict:
+        pool_id = index % len(AGENT_POOLS)
+        agent = {'id': index + 1, 'name': f"agent-{index + 1}", 'connected': True, 'enabled': True,
+                 'authorized': True, 'pool': {'id': pool_id, 'name': AGENT_POOLS[pool_id]}}
+        if 'compatibleBuildTypes' in fields:
+            compatible = [{'id': build_type} for build_type in self.build_types if self.compatible(pool_id, build_type)]
+            agent['compatibleBuildTypes'] = {'count': len(compatible), 'buildType': compatible}
+        return agent
+
+    @staticmethod
+    def date(timestamp: float) -> str:
+        return time.strftime('%Y%m%dT%H%M%S+0000', time.gmtime(timestamp))
+
+    @staticmethod
+    def parse_date(value: str) -> float:
+        return calendar.timegm(time.strptime(value[:15], '%Y%m%dT%H%M%S'))
+
+    def trigger_build(self, request: Dict) -> Tuple[int, Any]:
+        build_type = request.get('buildType', {}).get('id')
+        if build_type not in self.build_types:
+            return 404, f"No build configuration '{build_type}'"
+        now = time.time()
+        duration = self.config.build_duration
+        runnable = any(self.compatible(pool_id, build_type) for pool_id in range(len(AGENT_POOLS)))
+        started = now + self.random.uniform(0.1, 0.5) * duration if runnable else None
+        build = {
+            'id': self.next_build_id, 'buildTypeId': build_type, 'queued': now, 'started': started,
+            'finished': started + duration * self.random.lognormvariate(0, 0.4) if runnable else None,
+            'status': 'SUCCESS' if self.random.random() < 0.9 else 'FAILURE',
+            'branchName': request.get('branchName'),
+        }
+        self.triggered[build['id']] = build
+        self.next_build_id += 1
+        return 200, self.triggered_view(build, now)
+
+    def triggered_view(self, build: Dict, now: float) -> Dict:
+        """A triggered build as the server would show it at ``now``: queued, running or finished"""
+        view = {'id': build['id'], 'buildTypeId': build['buildTypeId'], 'queuedDate': self.date(build['queued']),
+                'webUrl': f"http://fake/viewLog.html?buildId={build['id']}"}
+        if build['branchName']:
+            view['branchName'] = build['branchName']
+        if build['started'] is None or now < build['started']:
+            view.update(state='queued', waitReason='Waiting for a compatible agent' if build['started']
+                        else 'There are no compatible agents')
+        elif now < build['finished']:
+            progress = (now - build['started']) / (build['finished'] - build['started'])
+            view.update(state='running', status='SUCCESS', startDate=self.date(build['started']),
+                        percentageComplete=int(progress * 100))
+        else:
+            view.update(state='finished', status=build['status'], startDate=self.date(build['started']),
+                        finishDate=self.date(build['finished']),
+                        statusText='Tests passed' if build['status'] == 'SUCCESS' else 'Tests failed: 3')
+        return view
+
+    def find_build(self, build_id: int, now: float) -> Optional[Dict]:
+        if build_id in self.triggered:
+            return self.triggered_view(self.triggered[build_id], now)
+        if 0 < build_id <= len(self.builds):
+            return self.build_view(self.builds[build_id - 1])
+        return None
+
+    @property
+    def artifacts(self) -> Dict[str, bytes]:
+        """Artifacts every build has, generated on first use: a coverage report zip and a binary with its checksum"""
+        if self._artifacts is None:
+            generator = random.Random(self.config.seed)
+            binary = generator.randbytes(int(self.config.artifact_size * 1024 * 1024))
+            report = io.BytesIO()
+            with zipfile.ZipFile(report, 'w', zipfile.ZIP_DEFLATED) as archive:
+                rows = ''.join(f"<tr><td>com/example/Class{i}.java</td><td>{generator.randint(0, 100)}%</td></tr>\n"
+                               for i in range(500))
+                archive.writestr('index.html', f"<html><body><h1>Coverage</h1><table>\n{rows}</table></body></html>\n")
+                archive.writestr('css/coverage.css', 'td { font-family: monospace; }\n')
+                # Incompressible per-file data makes the archive large, like a real report with sources
+                archive.writestr('data/sources.bin', binary[:len(binary) // 2], zipfile.ZIP_STORED)
+            self._artifacts = {
+                'coverage.zip': report.getvalue(),
+                'dist/app.bin': binary,
+                'dist/app.bin.sha256': f"{hashlib.sha256(binary).hexdigest()}  app.bin\n".encode('ascii'),
+            }
+        return self._artifacts
+
+    def handle_artifacts(self, rest: List[str], headers: Dict[str, str]) -> Tuple[int, Any]:
+        kind, path = rest[0], '/'.join(rest[1:])
+        if kind == 'children':
+            prefix = f"{path}/" if path else ''
+            names: Dict[str, Dict] = {}
+            for name, data in self.artifacts.items():
+                if not name.startswith(prefix):
+                    continue
+                head, _, tail = name[len(prefix):].partition('/')
+                if tail:
+                    names[head] = {'name': head, 'children': {'href': f"artifacts/children/{prefix}{head}"}}
+                else:
+                    names[head] = {'name': head, 'size': len(data), 'modificationTime': '20250101T000000+0000'}
+                    if head.endswith('.zip'):
+                        names[head]['children'] = {'href': f"artifacts/children/{prefix}{head}"}
+            if not names:
+                return 404, f"No artifacts under '{path}'"
+            return 200, {'count': len(names), 'file': list(names.values())}
+        if kind != 'content':
+            return 404, None
+
+        archive, _, member = path.partition('!/')
+        data = self.artifacts.get(archive)
+        if data is None:
+            return 404, f"No artifact '{path}'"
+        if member:
+            try:
+                data = zipfile.ZipFile(io.BytesIO(data)).read(member)
+            except KeyError:
+                return 404, f"No '{member}' in '{archive}'"
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', headers.get('Range', ''))
+        if not (match and self.config.artifact_ranges):
+            return 200, RawBody(data, headers={'Accept-Ranges': 'bytes' if self.config.artifact_ranges else 'none'})
+        first, last = match.groups()
+        start = int(first) if first else max(0, len(data) - int(last))
+        end = min(int(last), len(data) - 1) if first and last else len(data) - 1
+        if start >= len(data):
+            return 416, RawBody(b'', headers={'Content-Range': f"bytes */{len(data)}"})
+        return 206, RawBody(data[start:end + 1], headers={'Content-Range': f"bytes {start}-{end}/{len(data)}",
+                                                          'Accept-Ranges': 'bytes'})
+
+    def build_view(self, build: Tuple) -> Dict:
+        build_id, build_type, queued, started, finished, status, agent = build
+        return {
+            'id': build_id, 'buildTypeId': build_type, 'number': str(build_id), 'state': 'finished',
+            'status': status, 'queuedDate': self.date(queued), 'startDate': self.date(started),
+            'finishDate': self.date(finished), 'agent': {'id': agent + 1, 'name': f"agent-{agent + 1}"},
+        }
+
+    def handle_builds(self, locator: Dict[str, str]) -> Tuple[int, Any]:
+        build_type = locator.get('buildType', '')
+        build_type = parse_locator(build_type).get('id', build_type) if build_type else None
+        since_build = locator.get('sinceBuild', '')
+        since_build = int(parse_locator(since_build).get('id', since_build)) if since_build else 0
+        since_date = self.parse_date(locator['sinceDate']) if 'sinceDate' in locator else None
+        # Like the real server, only finished builds unless state (or running) says otherwise
+        state = 'running' if locator.get('running') == 'true' else locator.get('state', 'finished')
+        items: List[Any] = []
+        if state in ('finished', 'any'):
+            items = [build for build in self.builds
+                     if (build_type is None or build[1] == build_type) and build[0] > since_build
+                     and (since_date is None or build[2] >= since_date)
+                     and locator.get('status', build[5]) == build[5]]
+        now = time.time()
+        items += [view for view in (self.triggered_view(build, now) for build in self.triggered.values())
+                  if state in ('any', view['state']) and (build_type is None or view['buildTypeId'] == build_type)
+                  and view['id'] > since_build
+                  and (since_date is None or self.parse_date(view['queuedDate']) >= since_date)
+                  and locator.get('status', view.get('status')) == view.get('status')]
+        # Newest first, like the real server
+        items.sort(key=lambda item: item['id'] if isinstance(item, dict) else item[0], reverse=True)
+        page = self.page('builds', 'build', items, locator)
+        page['build'] = [item if isinstance(item, dict) else self.build_view(item) for item in page['build']]
+        return 200, page
+
+    @staticmethod
+    def now() -> str:
+        return time.strftime('%Y%m%dT%H%M%S', time.localtime()) + f".{int(time.time() * 1000) % 1000:03d}"
+
+    def add_project(self, project_id: str, name: str, parent_id: str = '_Root'):
+        self.projects[project_id] = {'id': project_id, 'name': name, 'parentProjectId': parent_id}
+        self.features.setdefault(project_id, [])
+
+    def record_audit(self, action: str, entity_type: str, entity_id: str):
+        """Log a configuration change; GET audit lists the events newest first"""
+        self.audit.append({'id': len(self.audit) + 1, 'timestamp': self.date(time.time()), 'action': {'id': action},
+                           'relatedEntities': {'count': 1, 'entity': [
+                               {'type': entity_type, entity_type: {'id': entity_id}}]}})
+
+    def delete_project(self, project_id: str):
+        """Remove a project with its subprojects, build configurations and VCS roots"""
+        doomed = {project_id} | {p for p in self.projects if self.is_descendant(p, project_id)}
+        for doomed_id in doomed:
+            del self.projects[doomed_id]
+            self.features.pop(doomed_id, None)
+        self.build_types = {k: v for k, v in self.build_types.items() if v['projectId'] not in doomed}
+        self.vcs_roots = {k: v for k, v in self.vcs_roots.items() if v['project']['id'] not in doomed}
+        self.record_audit('project_delete', 'project', project_id)
+
+    def committed_params(self) -> Dict[str, str]:
+        """param("name", "value") pairs of the settings.kts committed at HEAD of the settings repo"""
+        if not self.config.settings_repo:
+            return {}
+        result = subprocess.run(['git', '-C', self.config.settings_repo, 'show', 'HEAD:.teamcity/settings.kts'],
+                                capture_output=True, text=True)
+        return dict(re.findall(r'\bparam\(\s*"([^"]+)"\s*,\s*"([^"]*)"\s*\)', result.stdout))
+
+    def start_sync(self):
+        with self.lock:
+            self.sync_status = {'type': 'info', 'message': 'Running DSL...', 'timestamp': self.sync_status['timestamp']}
+
+    def finish_sync(self):
+        params = self.committed_params()
+        with self.lock:
+            for project_id in self.config.imported_projects:
+                if project_id not in self.projects:
+                    self.add_project(project_id, project_id)
+                    self.record_audit('project_create', 'project', project_id)
+            for name, value in params.items():
+                self.set_property(self.projects['_Root'], name, value, 'parameters')
+            if params:
+                self.record_audit('project_edit', 'project', '_Root')
+            self.sync_status = {'type': 'info', 'message': 'Settings were successfully loaded', 'timestamp': self.now()}
+
+    def schedule_sync(self):
+        pickup = self.config.sync_pickup
+        delay = max(0.0, self.config.sync_delay + self.random.uniform(-1, 1) * self.config.sync_jitter)
+        if pickup > 0:
+            timer = threading.Timer(pickup, self.start_sync)
+            timer.daemon = True
+            timer.start()
+        else:
+            self.sync_status = {'type': 'info', 'message': 'Running DSL...', 'timestamp': self.sync_status['timestamp']}
+        timer = threading.Timer(pickup + delay, self.finish_sync)
+        timer.daemon = True
+        timer.start()
+
+    # --- views -------------------------------------------------------------
+
+    def project_view(self, project_id: str, fields: str) -> Dict:
+        project = dict(self.projects[project_id])
+        if 'vcsRoots' in fields:
+            roots = [r for r in self.vcs_roots.values() if r['project']['id'] == project_id]
+            project['vcsRoots'] = {'count': len(roots), 'vcs-root': roots}
+        if 'projectFeatures' in fields:
+            features = self.features.get(project_id, [])
+            project['projectFeatures'] = {'count': len(features), 'projectFeature': features}
+        return project
+
+    @staticmethod
+    def page(path: str, key: str, items: List[Dict], locator: Dict[str, str]) -> Dict:
+        count = int(locator.get('count', 100))
+        start = int(locator.get('start', 0))
+        page = items[start:start + count]
+        body: Dict[str, Any] = {'count': len(page), key: page}
+        if start + count < len(items):
+            rest = {k: v for k, v in locator.items() if k not in ('count', 'start')}
+            next_locator = ','.join([f"{k}:({v})" if ':' in v else f"{k}:{v}" for k, v in rest.items()]
+                                    + [f"count:{count}", f"start:{start + count}"])
+            body['nextHref'] = f"/app/rest/{path}?locator={quote(next_locator, safe='(),:')}"
+        return body
+
+    # --- routing -----------------------------------------------------------
+
+    def handle(self, method: str, path: str, query: Dict[str, str], body: bytes,
+               headers: Optional[Dict[str, str]] = None) -> Tuple[int, Any]:
+        locator = parse_locator(query.get('locator', ''))
+        fields = query.get('fields', '')
+        segments = path.split('/')
+
+        if path == 'server':
+            return 200, {'version': '2025.07 (fake)', 'buildNumber': '999999', 'webUrl': 'http://fake'}
+
+        if segments[0] == 'projects':
+            if len(segments) == 1:
+                if method == 'GET':
+                    page = self.page(path, 'project', list(self.projects), locator)
+                    page['project'] = [self.project_view(project_id, fields) for project_id in page['project']]
+                    return 200, page
+                if method == 'POST':
+                    project = json.loads(body or b'{}')
+                    parent_id = parse_locator(project.get('parentProject', {}).get('locator', 'id:_Root')).get('id')
+                    if project.get('id') in self.projects:
+                        return 400, f"Project with id '{project['id']}' already exists"
+                    if parent_id not in self.projects:
+                        return 404, f"No parent project '{parent_id}'"
+                    self.add_project(project['id'], project.get('name', project['id']), parent_id)
+                    self.record_audit('project_create', 'project', project['id'])
+                    return 200, self.projects[project['id']]
+                return 405, None
+            project_id = parse_locator(segments[1]).get('id')
+            if project_id not in self.projects:
+                return 404, f"No project found by locator '{segments[1]}'"
+            if len(segments) == 2 and method == 'DELETE':
+                if project_id == '_Root':
+                    return 400, "The root project cannot be deleted"
+                self.delete_project(project_id)
+                return 204, None
+            if len(segments) == 2:
+                return 200, self.project_view(project_id, fields)
+            if segments[2] in ('name', 'parameters') and method == 'PUT':
+                self.record_audit('project_edit', 'project', project_id)
+                return self.update_entity(self.projects[project_id], segments[2:], body)
+            if segments[2] == 'parameters' and len(segments) == 4 and method == 'GET':
+                for prop in self.projects[project_id].get('parameters', {}).get('property', []):
+                    if prop['name'] == segments[3]:
+                        return 200, prop
+                return 404, f"No parameter '{segments[3]}' in project '{project_id}'"
+            if segments[2] == 'projectFeatures':
+                return self.handle_features(method, project_id, segments[3:], locator, body)
+            if segments[2] == 'versionedSettings' and len(segments) == 4:
+                if segments[3] == 'status' and method == 'GET':
+                    return 200, dict(self.sync_status)
+                if segments[3] in ('checkForChanges', 'commitCurrentSettings', 'reloadSettingsFromVcs') \
+                        and method == 'POST':
+                    self.schedule_sync()
+                    return 200, {}
+            return 404, f"Unsupported project path '{path}'"
+
+        if segments[0] == 'vcs-roots':
+            return self.handle_vcs_roots(method, segments[1:], locator, body)
+
+        if path == 'audit' and method == 'GET':
+            return 200, self.page(path, 'auditEvent', self.audit[::-1], locator)
+
+        if segments[0] == 'builds' and len(segments) == 1 and method == 'GET':
+            items = locator_items(query.get('locator', ''))
+            if items or 'id' in locator:
+                now = time.time()
+                ids = [int(parse_locator(item).get('id', 0)) for item in items] or [int(locator['id'])]
+                builds = [self.find_build(build_id, now) for build_id in ids]
+                if None in builds:
+                    return 404, f"No build found by locator 'id:{ids[builds.index(None)]}'"
+                return 200, {'count': len(builds), 'build': builds}
+            return self.handle_builds(locator)
+
+        if segments[0] == 'builds' and len(segments) > 3 and segments[2] == 'artifacts' and method == 'GET':
+            if self.find_build(int(parse_locator(segments[1]).get('id', 0)), time.time()) is None:
+                return 404, f"No build found by locator '{segments[1]}'"
+            return self.handle_artifacts(segments[3:], headers or {})
+
+        if segments[0] == 'builds' and len(segments) == 2 and method == 'GET':
+            build = self.find_build(int(parse_locator(segments[1]).get('id', 0)), time.time())
+            return (200, build) if build else (404, f"No build found by locator '{segments[1]}'")
+
+        if segments[0] == 'agents' and len(segments) == 1 and method == 'GET':
+            return 200, self.page(path, 'agent', [self.agent_view(index, fields) for index in range(self.config.agents)],
+                                  locator)
+
+        if segments[0] == 'agentPools' and len(segments) == 1 and method == 'GET':
+            pools = [{'id': pool_id, 'name': name,
+                      'agents': {'count': len(range(pool_id, self.config.agents, len(AGENT_POOLS)))}}
+                     for pool_id, name in enumerate(AGENT_POOLS)]
+            return 200, {'count': len(pools), 'agentPool': pools}
+
+        if segments[0] == 'buildQueue' and len(segments) == 1 and method == 'POST':
+            return self.trigger_build(json.loads(body or b'{}'))
+
+        if segments[0] == 'buildQueue' and len(segments) == 1 and method == 'GET':
+            now = time.time()
+            queued = [{'id': 1_000_000 + index, 'buildTypeId': build_type, 'state': 'queued',
+                       'queuedDate': self.date(now - 600), 'waitReason': 'There are no compatible agents'}
+                      for index, build_type in enumerate(self.incompatible_build_types()[:5])]
+            queued += [view for view in (self.triggered_view(build, now) for build in self.triggered.values())
+                       if view['state'] == 'queued']
+            return 200, self.page(path, 'build', queued, locator)
+
+        if segments[0] == 'buildTypes' and len(segments) == 1 and method == 'POST':
+            build_type = json.loads(body or b'{}')
+            project_id = build_type.get('project', {}).get('id')
+            if build_type.get('id') in self.build_types:
+                return 400, f"Build configuration with id '{build_type['id']}' already exists"
+            if project_id not in self.projects:
+                return 404, f"No project '{project_id}'"
+            missing = [entry['id'] for entry in build_type.get('vcs-root-entries', {}).get('vcs-root-entry', [])
+                       if entry['id'] not in self.vcs_roots]
+            if missing:
+                return 404, f"No VCS root '{missing[0]}'"
+            build_type.pop('project')
+            build_type.update(projectId=project_id, projectName=self.projects[project_id]['name'])
+            self.build_types[build_type['id']] = build_type
+            self.record_audit('buildType_create', 'buildType', build_type['id'])
+            return 200, build_type
+
+        if segments[0] == 'buildTypes' and len(segments) == 2 and method in ('GET', 'DELETE'):
+            build_type_id = parse_locator(segments[1]).get('id')
+            if build_type_id not in self.build_types:
+                return 404, f"No build configuration found by locator '{segments[1]}'"
+            if method == 'GET':
+                return 200, self.build_types[build_type_id]
+            del self.build_types[build_type_id]
+            self.record_audit('buildType_delete', 'buildType', build_type_id)
+            return 204, None
+
+        if segments[0] == 'buildTypes' and len(segments) > 2 and method in ('PUT', 'POST'):
+            build_type = self.build_types.get(parse_locator(segments[1]).get('id'))
+            if build_type is None:
+                return 404, f"No build configuration '{segments[1]}'"
+            self.record_audit('buildType_edit', 'buildType', build_type['id'])
+            if segments[2] == 'vcs-root-entries' and method == 'POST':
+                entry = json.loads(body or b'{}')
+                if entry.get('id') not in self.vcs_roots:
+                    return 404, f"No VCS root '{entry.get('id')}'"
+                build_type.setdefault('vcs-root-entries', {}).setdefault('vcs-root-entry', []).append(entry)
+                return 200, entry
+            if segments[2] in ('name', 'parameters') and method == 'PUT':
+                return self.update_entity(build_type, segments[2:], body)
+
+        if segments[0] == 'buildTypes' and len(segments) == 1:
+            items = list(self.build_types.values())
+            affected = parse_locator(locator.get('affectedProject', '')).get('id')
+            if affected:
+                scope = {affected} | {p for p in self.projects if self.is_descendant(p, affected)}
+                items = [bt for bt in items if bt['projectId'] in scope]
+            if fields == 'count':
+                return 200, {'count': len(items)}
+            return 200, self.page(path, 'buildType', items, locator)
+
+        return 404, f"Unsupported path '{path}'"
+
+    def is_descendant(self, project_id: str, ancestor: str) -> bool:
+        parent = self.projects.get(project_id, {}).get('parentProjectId')
+        while parent:
+            if parent == ancestor:
+                return True
+            parent = self.projects.get(parent, {}).get('parentProjectId')
+        return False
+
+    def update_entity(self, entity: Dict, rest: List[str], body: bytes) -> Tuple[int, Any]:
+        """PUT .../name or .../parameters/NAME on a project or build configuration"""
+        value = body.decode('utf-8')
+        if rest == ['name']:
+            entity['name'] = value
+            return 200, value
+        if len(rest) == 2 and rest[0] == 'parameters':
+            self.set_property(entity, rest[1], value, 'parameters')
+            return 200, value
+        return 404, None
+
+    @staticmethod
+    def set_property(entity: Dict, name: str, value: str, key: str = 'properties'):
+        properties = entity.setdefault(key, {}).setdefault('property', [])
+        for prop in properties:
+            if prop['name'] == name:
+                prop['value'] = value
+                return
+        properties.append({'name': name, 'value': value})
+
+    def handle_features(self, method: str, project_id: str, rest: List[str], locator: Dict[str, str],
+                        body: bytes) -> Tuple[int, Any]:
+        features = self.features[project_id]
+        if method != 'GET':
+            self.record_audit('project_edit', 'project', project_id)
+        if not rest:
+            if method == 'GET':
+                items = [f for f in features if 'type' not in locator or f['type'] == locator['type']]
+                return 200, {'count': len(items), 'projectFeature': items}
+            if method == 'POST':
+                feature = json.loads(body or b'{}')
+                feature.setdefault('id', f"PROJECT_EXT_{self.next_feature}")
+                self.next_feature += 1
+                features.append(feature)
+                return 200, feature
+            return 405, None
+        feature_id = parse_locator(rest[0]).get('id')
+        feature = next((f for f in features if f['id'] == feature_id), None)
+        if feature is None:
+            return 404, f"No feature '{rest[0]}'"
+        if len(rest) == 1 and method == 'GET':
+            return 200, feature
+        if len(rest) == 1 and method == 'PUT':
+            feature.update(json.loads(body or b'{}'), id=feature_id)
+            return 200, feature
+        if len(rest) == 3 and rest[1] == 'properties' and method == 'PUT':
+            self.set_property(feature, rest[2], body.decode('utf-8'))
+            return 200, body.decode('utf-8')
+        return 404, None
+
+    def handle_vcs_roots(self, method: str, rest: List[str], locator: Dict[str, str],
+                         body: bytes) -> Tuple[int, Any]:
+        if not rest:
+            if method == 'GET':
+                return 200, self.page('vcs-roots', 'vcs-root', list(self.vcs_roots.values()), locator)
+            if method == 'POST':
+                root = json.loads(body or b'{}')
+                if root.get('id') in self.vcs_roots:
+                    return 400, f"VCS root with id '{root['id']}' already exists"
+                root.setdefault('project', {'id': '_Root'})
+                self.vcs_roots[root['id']] = root
+                self.record_audit('vcsRoot_create', 'vcsRoot', root['id'])
+                return 200, root
+            return 405, None
+        root = self.vcs_roots.get(parse_locator(rest[0]).get('id'))
+        if root is None:
+            return 404, f"No VCS root '{rest[0]}'"
+        if len(rest) == 1 and method == 'GET':
+            return 200, root
+        if method != 'GET':
+            self.record_audit('vcsRoot_edit', 'vcsRoot', root['id'])
+        if len(rest) == 2 and rest[1] == 'name' and method == 'PUT':
+            root['name'] = body.decode('utf-8')
+            return 200, root['name']
+        if len(rest) == 3 and rest[1] == 'properties' and method == 'PUT':
+            self.set_property(root, rest[2], body.decode('utf-8'))
+            return 200, body.decode('utf-8')
+        return 404, None
+
+
+def make_handler(state: FakeTeamCity):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out as separate writes; without this, Nagle plus delayed ACKs add
+        # 40ms to every request after the first on a keep-alive connection
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def send(self, status: int, payload: Any):
+            headers = {}
+            if isinstance(payload, RawBody):
+                data, content_type, headers = payload.data, payload.content_type, payload.headers
+            elif isinstance(payload, (dict, list)):
+                data, content_type = json.dumps(payload).encode('utf-8'), 'application/json'
+            else:
+                data, content_type = str(payload or '').encode('utf-8'), 'text/plain'
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def dispatch(self, method: str):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            url = urlsplit(self.path)
+
+            if url.path == STATS_PATH:
+                with state.lock:
+                    if method == 'DELETE':
+                        state.requests, state.by_method, state.errors_injected = 0, {}, 0
+                        state.peak_in_flight, state.overloaded = 0, 0
+                    self.send(200, {'requests': state.requests, 'by_method': state.by_method,
+                                    'errors_injected': state.errors_injected,
+                                    'peak_in_flight': state.peak_in_flight, 'overloaded': state.overloaded})
+                return
+
+            config = state.config
+            with state.lock:
+                state.in_flight += 1
+                state.peak_in_flight = max(state.peak_in_flight, state.in_flight)
+                in_flight = state.in_flight
+            try:
+                # Past its capacity the server slows down sharply, and sheds load at twice it
+                if config.capacity and in_flight > 2 * config.capacity:
+                    with state.lock:
+                        state.overloaded += 1
+                    self.send(503, 'Server is overloaded')
+                    return
+                slowdown = max(1.0, in_flight / config.capacity) ** 2 if config.capacity else 1.0
+                if config.latency or config.jitter:
+                    time.sleep(slowdown * max(0.0, config.latency + random.uniform(-config.jitter, config.jitter)))
+                self.respond(method, url, body)
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+        def respond(self, method: str, url, body: bytes):
+            config = state.config
+            with state.lock:
+                state.requests += 1
+                state.by_method[method] = state.by_method.get(method, 0) + 1
+                if config.error_rate and state.random.random() < config.error_rate:
+                    state.errors_injected += 1
+                    status, payload = 503, 'Injected failure'
+                elif not url.path.startswith('/app/rest/'):
+                    status, payload = 404, 'Not found'
+                else:
+                    query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                    status, payload = state.handle(method, unquote(url.path[len('/app/rest/'):]).strip('/'),
+                                                   query, body, dict(self.headers))
+            self.send(status, payload)
+
+        def do_GET(self):
+            self.dispatch('GET')
+
+        def do_POST(self):
+            self.dispatch('POST')
+
+        def do_PUT(self):
+            self.dispatch('PUT')
+
+        def do_DELETE(self):
+            self.dispatch('DELETE')
+
+    return Handler
+
+
+def serve(config: FakeConfig, host: str = '127.0.0.1', port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """Create the server (port 0 picks a free one); call serve_forever() on it or run it in a thread"""
+    server = ThreadingHTTPServer((host, port), make_handler(FakeTeamCity(config)))
+    server.daemon_threads = True
+    return server
+
+
+def add_fake_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('fake server')
+    group.add_argument('--projects', type=int, default=10, help="Projects under _Root (default: 10)")
+    group.add_argument('--build-types', type=int, default=10, help="Build configurations (default: 10)")
+    group.add_argument('--vcs-roots', type=int, default=1, help="VCS roots (default: 1)")
+    group.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+    group.add_argument('--jitter', type=float, default=0.0, help="Uniform +/- seconds around --latency")
+    group.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 503")
+    group.add_argument('--sync-delay', type=float, default=2.0,
+                       help="Seconds between a sync trigger and the imported projects appearing (default: 2)")
+    group.add_argument('--sync-pickup', type=float, default=0.0,
+                       help="Seconds before a sync trigger shows in the versioned-settings status (default: 0)")
+    group.add_argument('--sync-jitter', type=float, default=0.0, help="Uniform +/- seconds around --sync-delay")
+    group.add_argument('--settings-repo', metavar='DIR',
+                       help="Git working tree whose committed .teamcity/settings.kts params are loaded on each sync")
+    group.add_argument('--builds-per-type', type=int, default=0, help="Finished builds of history per build type")
+    group.add_argument('--agents', type=int, default=4, help="Agents the build history is spread over (default: 4)")
+    group.add_argument('--capacity', type=int, default=0,
+                       help="Concurrent requests served at full speed; beyond it responses slow down, "
+                            "and past twice it they get 503 (default: unlimited)")
+    group.add_argument('--build-duration', type=float, default=5.0,
+                       help="Typical seconds a build triggered through buildQueue runs (default: 5)")
+    group.add_argument('--artifact-size', type=float, default=4.0,
+                       help="MB of the binary artifact every build has; the coverage zip is half that (default: 4)")
+    group.add_argument('--no-ranges', action='store_true',
+                       help="Ignore Range headers on artifact content, like a server behind a proxy that strips them")
+    group.add_argument('--seed', type=int, help="Seed for error injection and generated history")
+
+
+def config_from_args(args: argparse.Namespace) -> FakeConfig:
+    return FakeConfig(args.projects, args.build_types, args.vcs_roots, args.latency, args.jitter,
+                      args.error_rate, args.sync_delay, seed=args.seed, builds_per_type=args.builds_per_type,
+                      agents=args.agents, capacity=args.capacity, build_duration=args.build_duration,
+                      artifact_size=args.artifact_size, artifact_ranges=not args.no_ranges,
+                      sync_pickup=args.sync_pickup, sync_jitter=args.sync_jitter, settings_repo=args.settings_repo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake TeamCity REST API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT}, 0 for any)")
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+
+    server = serve(config_from_args(args), args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"🧪 Fake TeamCity on http://{host}:{port} "
+          f"({args.projects} projects, {args.build_types} build types, {args.vcs_roots} VCS roots)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ set -e
 TEAMCITY_SERVER="teamcity.devinfra.ru"
 TEAMCITY_URL="https://${TEAMCITY_SERVER}"
 TOKEN_FILE="teamcity-token.txt"
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 
 # Colors for output
 RED='\033[0;31m'
@@ -80,7 +81,8 @@ get_super_user_token() {
     echo "======================================="
     echo ""
     echo "📋 Method 1: From Docker container on the server"
-    echo "  ssh node5 \"sudo docker exec teamcity_teamcity_1 grep -o 'Super user authentication token: [0-9]*' /opt/teamcity/logs/teamcity-server.log | tail -1 | cut -d' ' -f5\""
+    echo "  python3 supertoken.py            # scans the log in the container from the end, caches the token"
+    echo "  python3 supertoken.py --refresh  # ignore the cached token"
     echo ""
     echo "📋 Method 2: From TeamCity Web UI"
     echo "  1. Open ${TEAMCITY_URL}"
@@ -93,7 +95,8 @@ get_super_user_token() {
     
     # Try to get token automatically
     print_status "Attempting automatic token extraction..."
-    TOKEN=$(ssh node5 "sudo docker exec teamcity_teamcity_1 grep -o 'Super user authentication token: [0-9]*' /opt/teamcity/logs/teamcity-server.log | tail -1 | cut -d' ' -f5" 2>/dev/null || echo "")
+    # Reads the log backwards from EOF and reuses the cached token while the server accepts it
+    TOKEN=$(python3 "$SCRIPT_DIR/supertoken.py" --url "$TEAMCITY_URL" || echo "")
     
     if [ -n "$TOKEN" ] && [ "$TOKEN" != "" ]; then
         print_success "Token found: $TOKEN"
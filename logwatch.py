@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+TeamCity Log Watcher
+Streams server log lines through a single precompiled classifier
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+from itertools import accumulate
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_LOG_NODE = 'node5'
+DEFAULT_CONTAINER = 'teamcity_teamcity_1'
+DEFAULT_BUFFER_LINES = 100_000
+READ_CHUNK = 1 << 16
+
+# Categories are tried in order, so a line mentioning both an error and a sync is an error
+PATTERN_SETS: Dict[str, Dict[str, List[str]]] = {
+    'default': {
+        'error': [r'error', r'exception', r'failed'],
+        'warn': [r'warn(?:ing)?'],
+        'dsl': [r'dsl', r'settings\.kts', r'kotlin'],
+        'vcs': [r'vcs', r'commit'],
+        'sync': [r'sync', r'configuration', r'versioned settings'],
+    },
+    'sync-events': {
+        'sync-error': [r'error.*sync', r'failed.*configuration'],
+        'sync-warn': [r'warning.*sync'],
+        'sync-event': [r'vcs.*sync', r'configuration.*loaded', r'dsl.*processed'],
+    },
+}
+
+COLORS = {
+    'error': '\033[0;31m', 'sync-error': '\033[0;31m',
+    'warn': '\033[1;33m', 'sync-warn': '\033[1;33m',
+    'sync': '\033[0;32m', 'vcs': '\033[0;32m', 'dsl': '\033[0;32m', 'sync-event': '\033[0;32m',
+}
+NO_COLOR = '\033[0m'
+
+
+class LineMatcher:
+    """Classify lines against ordered categories; the first category with a matching pattern wins
+
+    Every pattern is compiled once, up front. Lines are classified a chunk
+    at a time: the chunk is lower-cased and joined, and each pattern scans
+    it in one pass. Python's regex engine has no multi-literal search, so a
+    single alternation of all patterns is retried at every character
+    (~15us per line on server logs); one scan per literal-led pattern uses
+    the engine's substring search instead (~0.1us per line per pattern).
+    Patterns are matched per line and should not span newlines.
+    """
+
+    def __init__(self, categories: Dict[str, Sequence[str]], ignore_case: bool = True):
+        self.categories = list(categories)
+        self.ignore_case = ignore_case
+        self._patterns = [(priority, self._compile(pattern))
+                          for priority, patterns in enumerate(categories.values()) for pattern in patterns]
+
+    def _compile(self, pattern: str) -> 're.Pattern':
+        if not self.ignore_case:
+            return re.compile(pattern, re.MULTILINE)
+        if '\\' not in pattern:
+            # The text is lower-cased already; IGNORECASE would disable the fast literal search
+            return re.compile(pattern.lower(), re.MULTILINE)
+        return re.compile(pattern, re.MULTILINE | re.IGNORECASE)
+
+    def classify_chunk(self, lines: List[str]) -> List[Optional[str]]:
+        if self.ignore_case:
+            lines = [line.lower() for line in lines]
+        starts = list(accumulate((len(line) + 1 for line in lines[:-1]), initial=0))
+        text = '\n'.join(lines)
+        best: List[Optional[int]] = [None] * len(lines)
+        for priority, regex in self._patterns:
+            for match in regex.finditer(text):
+                index = bisect_right(starts, match.start()) - 1
+                current = best[index]
+                if current is None or priority < current:
+                    best[index] = priority
+        categories = self.categories
+        return [None if priority is None else categories[priority] for priority in best]
+
+    def classify(self, line: str) -> Optional[str]:
+        return self.classify_chunk([line])[0]
+
+
+def load_pattern_set(name: str, patterns_file: Optional[Path] = None,
+                     extra: Sequence[str] = ()) -> Dict[str, List[str]]:
+    """Start from a built-in set or a JSON ``{category: [regex, ...]}`` file, then add CATEGORY=REGEX extras
+
+    Raises ValueError for unknown sets, malformed extras and invalid regexes.
+    """
+    if patterns_file is not None:
+        with open(patterns_file) as f:
+            categories = {str(k): list(v) for k, v in json.load(f).items()}
+    elif name in PATTERN_SETS:
+        categories = {k: list(v) for k, v in PATTERN_SETS[name].items()}
+    else:
+        raise ValueError(f"unknown pattern set '{name}' (choose from {', '.join(PATTERN_SETS)})")
+
+    for item in extra:
+        category, sep, pattern = item.partition('=')
+        if not sep or not category or not pattern:
+            raise ValueError(f"pattern '{item}' must look like CATEGORY=REGEX")
+        categories.setdefault(category, []).append(pattern)
+
+    for category, patterns in categories.items():
+        for pattern in patterns:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"invalid pattern for {category}: {pattern!r} ({e})")
+    return categories
+
+
+class WatchStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.lines = 0
+        self.dropped = 0
+        self.by_category: Dict[str, int] = {}
+
+    def summary(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        categories = ', '.join(f"{k} {v}" for k, v in sorted(self.by_category.items()))
+        return (f"{self.lines} lines in {elapsed:.1f}s ({self.lines / elapsed:,.0f} lines/s), "
+                f"{self.dropped} dropped{f' ({categories})' if categories else ''}")
+
+
+class BoundedBuffer:
+    """Line buffer between the reader thread and the classifier
+
+    For live sources, when the consumer falls behind by more than
+    ``capacity`` lines the oldest chunks are discarded and counted so the
+    watcher stays current. With ``block`` set (finite files) the reader
+    waits for room instead, so nothing is lost.
+    """
+
+    def __init__(self, capacity: int, stats: WatchStats, block: bool = False):
+        self.capacity = capacity
+        self.stats = stats
+        self.block = block
+        self._chunks = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def put(self, lines: List[str]):
+        with self._cond:
+            while self.block and self._size >= self.capacity:
+                self._cond.wait()
+            self._chunks.append(lines)
+            self._size += len(lines)
+            while not self.block and self._size > self.capacity and len(self._chunks) > 1:
+                dropped = self._chunks.popleft()
+                self._size -= len(dropped)
+                self.stats.dropped += len(dropped)
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[List[str]]:
+        """Next chunk, [] on timeout, None once the source is exhausted"""
+        with self._cond:
+            if not self._chunks and not self._closed:
+                self._cond.wait(timeout)
+            if self._chunks:
+                lines = self._chunks.popleft()
+                self._size -= len(lines)
+                self._cond.notify_all()
+                return lines
+            return None if self._closed else []
+
+
+def read_chunks(fd: int, follow: bool = False, poll_interval: float = 0.2) -> Iterator[List[str]]:
+    """Yield complete lines as they become available, decoding once per read"""
+    pending = b''
+    while True:
+        data = os.read(fd, READ_CHUNK)
+        if not data:
+            if follow:
+                time.sleep(poll_interval)
+                continue
+            break
+        data = pending + data
+        end = data.rfind(b'\n')
+        if end < 0:
+            pending = data
+            continue
+        pending = data[end + 1:]
+        yield data[:end].decode('utf-8', 'replace').replace('\r', '').split('\n')
+    if pending:
+        yield [pending.decode('utf-8', 'replace')]
+
+
+class LogSource:
+    """Where lines come from: stdin, a local file or a command such as ssh ... docker logs -f"""
+
+    def __init__(self, fd: int, description: str, follow: bool = False,
+                 process: Optional[subprocess.Popen] = None, file=None):
+        self.fd = fd
+        self.description = description
+        self.follow = follow
+        self.process = process
+        self._file = file
+
+    @classmethod
+    def stdin(cls) -> 'LogSource':
+        return cls(sys.stdin.fileno(), 'stdin')
+
+    @classmethod
+    def path(cls, path: Path, follow: bool = False) -> 'LogSource':
+        f = open(path, 'rb')
+        return cls(f.fileno(), str(path), follow, file=f)
+
+    @classmethod
+    def command(cls, argv: Sequence[str]) -> 'LogSource':
+        process = subprocess.Popen(list(argv), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   stdin=subprocess.DEVNULL)
+        return cls(process.stdout.fileno(), ' '.join(argv), process=process)
+
+    @classmethod
+    def docker_logs(cls, node: str, container: str, tail: int) -> 'LogSource':
+        return cls.command(['ssh', node, f"sudo docker logs --tail {tail} -f {container} 2>&1"])
+
+    def chunks(self) -> Iterator[List[str]]:
+        return read_chunks(self.fd, self.follow)
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self._file is not None:
+            self._file.close()
+
+
+def buffered_chunks(source: LogSource, buffer: BoundedBuffer,
+                    deadline: Optional[float] = None) -> Iterator[List[str]]:
+    """Read the source on a background thread and yield its chunks of lines until EOF or the deadline"""
+
+    def pump():
+        try:
+            for lines in source.chunks():
+                buffer.put(lines)
+        except OSError:
+            pass
+        finally:
+            buffer.close()
+
+    threading.Thread(target=pump, name='logwatch-reader', daemon=True).start()
+    while True:
+        timeout = None if deadline is None else deadline - time.monotonic()
+        if timeout is not None and timeout <= 0:
+            return
+        lines = buffer.get(timeout)
+        if lines is None:
+            return
+        if lines:
+            yield lines
+
+
+def classified(chunks: Iterator[List[str]], matcher: LineMatcher,
+               stats: WatchStats) -> Iterator[Tuple[Optional[str], str]]:
+    counts = stats.by_category
+    for lines in chunks:
+        categories = matcher.classify_chunk(lines)
+        stats.lines += len(lines)
+        for category in categories:
+            if category is not None:
+                counts[category] = counts.get(category, 0) + 1
+        yield from zip(categories, lines)
+
+
+def render(events: Iterator[Tuple[Optional[str], str]], show: Optional[set], stop_on: set,
+           color: bool, out=sys.stdout) -> Optional[str]:
+    """Print matching lines with a timestamp; returns the category that stopped the watch, if any"""
+    last_second = None
+    stamp = ''
+    for category, line in events:
+        if show is not None and category not in show:
+            if category in stop_on:
+                return category
+            continue
+        now = int(time.time())
+        if now != last_second:
+            last_second = now
+            stamp = time.strftime('%H:%M:%S', time.localtime(now))
+        if color:
+            out.write(f"{COLORS.get(category, NO_COLOR)}[{stamp}]{NO_COLOR} {line}\n")
+        else:
+            out.write(f"[{stamp}] {category or '-'}: {line}\n")
+        if category in stop_on:
+            out.flush()
+            return category
+    return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Watch TeamCity server logs and classify lines")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--file', type=Path, help="Read a local log file instead of the server container")
+    source.add_argument('--stdin', action='store_true', help="Read log lines from stdin")
+    source.add_argument('--command', help="Read the output of a shell command")
+    parser.add_argument('--follow', action='store_true', help="Keep reading --file as it grows")
+    parser.add_argument('--node', default=DEFAULT_LOG_NODE, help=f"SSH host running the server (default: {DEFAULT_LOG_NODE})")
+    parser.add_argument('--container', default=DEFAULT_CONTAINER, help=f"Server container (default: {DEFAULT_CONTAINER})")
+    parser.add_argument('--tail', type=int, default=50, help="Lines of history to start from (default: 50)")
+    parser.add_argument('--pattern-set', default='default', help=f"Built-in patterns: {', '.join(PATTERN_SETS)}")
+    parser.add_argument('--patterns', type=Path, help="JSON file of {category: [regex, ...]} replacing the pattern set")
+    parser.add_argument('--pattern', action='append', default=[], metavar='CATEGORY=REGEX',
+                        help="Add a pattern to a category (repeatable)")
+    parser.add_argument('--only', help="Comma-separated categories to print (default: every line)")
+    parser.add_argument('--stop-on', default='', help="Comma-separated categories that end the watch with exit code 1")
+    parser.add_argument('--timeout', type=float, help="Stop after this many seconds")
+    parser.add_argument('--buffer-lines', type=int, default=DEFAULT_BUFFER_LINES,
+                        help=f"Lines buffered before the oldest are dropped (default: {DEFAULT_BUFFER_LINES})")
+    parser.add_argument('--no-color', action='store_true', help="Plain output with the category name")
+    parser.add_argument('--quiet', action='store_true', help="Print nothing but the summary (for benchmarking)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    try:
+        matcher = LineMatcher(load_pattern_set(args.pattern_set, args.patterns, args.pattern))
+    except (OSError, ValueError) as e:
+        print(f"❌ ERROR: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    if args.stdin:
+        source = LogSource.stdin()
+    elif args.file:
+        source = LogSource.path(args.file, args.follow)
+    elif args.command:
+        source = LogSource.command(['/bin/sh', '-c', args.command])
+    else:
+        source = LogSource.docker_logs(args.node, args.container, args.tail)
+
+    stats = WatchStats()
+    buffer = BoundedBuffer(args.buffer_lines, stats, block=bool(args.file) and not args.follow)
+    deadline = time.monotonic() + args.timeout if args.timeout else None
+    show = set() if args.quiet else ({c.strip() for c in args.only.split(',') if c.strip()} if args.only else None)
+    stop_on = {c.strip() for c in args.stop_on.split(',') if c.strip()}
+
+    stopped_by = None
+    try:
+        events = classified(buffered_chunks(source, buffer, deadline), matcher, stats)
+        stopped_by = render(events, show, stop_on, color=not args.no_color and sys.stdout.isatty())
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        # Reader went away (e.g. piped into head); silence the flush at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        source.close()
+        print(f"📊 {source.description}: {stats.summary()}", file=sys.stderr)
+    if stopped_by:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
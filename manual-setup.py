@@ -111,6 +111,7 @@ def main():
     print("   - Go to Administration → Diagnostics → Internal Properties")
     print("   - Look for versioned settings related logs")
     print("   - Check server logs: /opt/teamcity/logs/teamcity-server.log")
+    print("   - Summarize sync attempts: python3 serverlog.py sessions --since 'YYYY-MM-DD HH:MM'")
     print()
     
     print("✨ **Expected Result:**")
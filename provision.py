@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+TeamCity Bulk Provisioning
+Creates and updates projects, VCS roots, build configurations and features from a manifest, concurrently and resumably
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import requests
+
+from deploy import load_environment
+from teamcity_api import AsyncTeamCityAPI, TeamCityAPI, DEFAULT_CONCURRENCY
+from teamcity_model import ROOT_PROJECT_ID
+from teamcity_plan import (
+    BuildTypeSpec, DesiredState, FeatureSpec, PlanAction, ProjectSpec, ServerSnapshot, VcsRootSpec,
+    build_plan,
+)
+from teamcity_transport import CircuitOpenError, add_transport_arguments, transport_from_args
+
+DEFAULT_URL = "https://teamcity.devinfra.ru"
+DEFAULT_CHECKPOINT = Path('.teamcity-provision-checkpoint.json')
+SNAPSHOT_PAGE_SIZE = 1000
+VCS_ROOT_DEFAULTS = {'branch': 'refs/heads/main', 'authMethod': 'PRIVATE_KEY_DEFAULT', 'ignoreKnownHosts': 'true'}
+
+
+class ManifestItem:
+    """One manifest entry: its spec, a stable key, and the keys of the manifest items it needs first"""
+
+    def __init__(self, key: str, spec, depends_on: Sequence[str] = ()):
+        self.key = key
+        self.spec = spec
+        self.depends_on = list(depends_on)
+        self.digest = hashlib.sha256(json.dumps(vars(spec), sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def load_manifest(path: Path) -> List[ManifestItem]:
+    """Read a JSON manifest of projects, VCS roots, build configurations and project features::
+
+        {"defaults": {"vcs_root": {"branch": "refs/heads/main"}},
+         "projects": [{"id": "Acme", "name": "Acme", "parent": "_Root", "parameters": {"env.TEAM": "acme"}}],
+         "vcs_roots": [{"id": "Acme_Api", "name": "acme/api", "project": "Acme",
+                        "url": "git@github.com:acme/api.git"}],
+         "build_types": [{"id": "Acme_Api_Build", "name": "Build", "project": "Acme", "vcs_roots": ["Acme_Api"]}],
+         "features": [{"project": "Acme", "type": "versionedSettings", "properties": {"rootId": "Acme_Api"}}]}
+
+    VCS root properties are ``defaults.vcs_root`` overlaid with ``url``,
+    ``branch`` and ``properties`` of the entry. Items are returned in
+    dependency order with their dependencies on other manifest items.
+
+    Raises ValueError for malformed entries or duplicate ids.
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    root_defaults = {**VCS_ROOT_DEFAULTS, **manifest.get('defaults', {}).get('vcs_root', {})}
+
+    def require(entry: Dict, kind: str, *names: str):
+        missing = [name for name in names if not entry.get(name)]
+        if missing:
+            raise ValueError(f"{kind} entry {entry.get('id') or entry} has no {', '.join(missing)}")
+
+    projects, roots, build_types, features = [], [], [], []
+    for entry in manifest.get('projects', []):
+        require(entry, 'project', 'id')
+        projects.append(ProjectSpec(entry['id'], entry.get('name', entry['id']), entry.get('parent', ROOT_PROJECT_ID),
+                                    entry.get('parameters')))
+    for entry in manifest.get('vcs_roots', []):
+        require(entry, 'vcs_root', 'id', 'url')
+        properties = {**root_defaults, 'url': entry['url'], **entry.get('properties', {})}
+        if entry.get('branch'):
+            properties['branch'] = entry['branch']
+        roots.append(VcsRootSpec(entry['id'], entry.get('name', entry['id']), properties,
+                                 entry.get('vcs', 'jetbrains.git'), entry.get('project', ROOT_PROJECT_ID)))
+    for entry in manifest.get('build_types', []):
+        require(entry, 'build_type', 'id', 'project')
+        build_types.append(BuildTypeSpec(entry['id'], entry.get('name', entry['id']), entry['project'],
+                                         entry.get('vcs_roots', []), entry.get('parameters')))
+    for entry in manifest.get('features', []):
+        require(entry, 'feature', 'type')
+        features.append(FeatureSpec(entry['type'], entry.get('properties', {}), entry.get('project', ROOT_PROJECT_ID),
+                                    entry.get('id')))
+
+    for kind, specs in (('project', projects), ('VCS root', roots), ('build configuration', build_types)):
+        ids = [spec.id for spec in specs]
+        duplicates = sorted({id for id in ids if ids.count(id) > 1})
+        if duplicates:
+            raise ValueError(f"duplicate {kind} ids: {', '.join(duplicates)}")
+
+    # Dependencies on other manifest items; anything else is expected to exist on the server already
+    project_keys = {spec.id: f"project:{spec.id}" for spec in projects}
+    root_keys = {spec.id: f"vcs-root:{spec.id}" for spec in roots}
+    items = [ManifestItem(project_keys[spec.id], spec,
+                          [project_keys[spec.parent_id]] if spec.parent_id in project_keys else [])
+             for spec in projects]
+    items += [ManifestItem(root_keys[spec.id], spec,
+                           [project_keys[spec.project_id]] if spec.project_id in project_keys else [])
+              for spec in roots]
+    for spec in build_types:
+        depends_on = [project_keys[spec.project_id]] if spec.project_id in project_keys else []
+        depends_on += [root_keys[root_id] for root_id in spec.vcs_root_ids if root_id in root_keys]
+        items.append(ManifestItem(f"build-type:{spec.id}", spec, depends_on))
+    for spec in features:
+        # Features name their VCS root in a property, e.g. versionedSettings' rootId
+        depends_on = [project_keys[spec.project_id]] if spec.project_id in project_keys else []
+        depends_on += [root_keys[value] for value in spec.properties.values() if value in root_keys]
+        items.append(ManifestItem(f"feature:{spec.project_id}/{spec.id or spec.type}", spec, depends_on))
+
+    keys = [item.key for item in items]
+    duplicates = sorted({key for key in keys if keys.count(key) > 1})
+    if duplicates:
+        raise ValueError(f"duplicate features (give them an id): {', '.join(duplicates)}")
+    return items
+
+
+class Checkpoint:
+    """Items applied so far, keyed by manifest key with the digest of the spec that was applied
+
+    Written after every completed item, atomically, so a rerun after a crash
+    or failure skips exactly what is already on the server. Editing an
+    entry changes its digest and makes it run again.
+    """
+
+    def __init__(self, path: Path, server_url: str, manifest: Path):
+        self.path = path
+        self.server_url = server_url
+        self.manifest = str(manifest)
+        self.completed: Dict[str, str] = {}
+        self.resumed = False
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get('server_url') == server_url and data.get('manifest') == self.manifest:
+                self.completed = data.get('completed', {})
+                self.resumed = bool(self.completed)
+        except (OSError, ValueError):
+            pass
+
+    def is_done(self, item: ManifestItem) -> bool:
+        return self.completed.get(item.key) == item.digest
+
+    def record(self, item: ManifestItem):
+        self.completed[item.key] = item.digest
+        self.save()
+
+    def save(self):
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'server_url': self.server_url, 'manifest': self.manifest, 'completed': self.completed}, f)
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class ItemResult:
+    SYMBOLS = {'created': '➕', 'updated': '🔄', 'unchanged': '✅', 'checkpointed': '⏭️ ', 'failed': '❌',
+               'skipped': '⚠️ '}
+
+    def __init__(self, item: ManifestItem, outcome: str, writes: int = 0, duration: float = 0.0,
+                 error: Optional[str] = None):
+        self.item = item
+        self.outcome = outcome
+        self.writes = writes
+        self.duration = duration
+        self.error = error
+
+    def as_dict(self) -> Dict:
+        return {'key': self.item.key, 'outcome': self.outcome, 'writes': self.writes,
+                'duration': round(self.duration, 3), 'error': self.error}
+
+
+OUTCOMES = {'create': 'created', 'update': 'updated', 'noop': 'unchanged'}
+
+
+async def apply_item(async_api: AsyncTeamCityAPI, item: ManifestItem, action: PlanAction) -> ItemResult:
+    """Run one item's writes in order; they build on each other (create, then parameters)"""
+    started = time.perf_counter()
+    for done, (method, endpoint, data) in enumerate(action.writes):
+        try:
+            response = await (async_api.post(endpoint, data) if method == 'POST' else async_api.put(endpoint, data))
+        except (requests.RequestException, CircuitOpenError) as e:
+            return ItemResult(item, 'failed', done, time.perf_counter() - started, f"{method} {endpoint}: {e}")
+        if response.status_code not in (200, 201, 204):
+            error = f"{method} {endpoint}: HTTP {response.status_code} {response.text.strip()[:200]}"
+            return ItemResult(item, 'failed', done, time.perf_counter() - started, error)
+    return ItemResult(item, OUTCOMES[action.kind], len(action.writes), time.perf_counter() - started)
+
+
+async def apply_items(async_api: AsyncTeamCityAPI, items: List[ManifestItem], actions: Dict[str, PlanAction],
+                      checkpoint: Checkpoint) -> List[ItemResult]:
+    """Apply every pending item as soon as the items it depends on have succeeded
+
+    Independent items run concurrently up to the client's concurrency
+    limit, so a batch of repositories onboards in parallel while a project
+    is still always created before its roots and configurations. An item
+    whose dependency failed is skipped rather than attempted.
+    """
+    outcomes: Dict[str, asyncio.Future] = {item.key: asyncio.get_running_loop().create_future() for item in items}
+
+    async def run(item: ManifestItem) -> ItemResult:
+        blockers = []
+        for key in item.depends_on:
+            if key in outcomes and not await outcomes[key]:
+                blockers.append(key)
+        if blockers:
+            result = ItemResult(item, 'skipped', error=f"depends on failed {', '.join(blockers)}")
+        elif item.key not in actions:
+            result = ItemResult(item, 'checkpointed')
+        else:
+            result = await apply_item(async_api, item, actions[item.key])
+            if result.outcome != 'failed':
+                checkpoint.record(item)
+        outcomes[item.key].set_result(result.outcome not in ('failed', 'skipped'))
+        symbol = ItemResult.SYMBOLS[result.outcome]
+        detail = f": {result.error}" if result.error else ''
+        if result.outcome != 'checkpointed':
+            print(f"   {symbol} {result.outcome:<9} {item.key}{detail}", flush=True)
+        return result
+
+    return list(await asyncio.gather(*(run(item) for item in items)))
+
+
+def print_report(results: List[ItemResult], wall_time: float):
+    counts: Dict[str, int] = {}
+    for result in results:
+        counts[result.outcome] = counts.get(result.outcome, 0) + 1
+    print("📋 Provisioning report:")
+    for outcome in ('created', 'updated', 'unchanged', 'checkpointed', 'skipped', 'failed'):
+        if counts.get(outcome):
+            print(f"   {ItemResult.SYMBOLS[outcome]} {outcome:<12} {counts[outcome]}")
+    writes = sum(result.writes for result in results)
+    print(f"   {len(results)} items, {writes} writes in {wall_time:.1f}s")
+
+
+def write_report(path: Path, results: List[ItemResult], server_url: str, wall_time: float):
+    report = {'server_url': server_url, 'wall_time': round(wall_time, 3),
+              'items': [result.as_dict() for result in results]}
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Provision TeamCity projects, VCS roots and configurations from a manifest")
+    parser.add_argument('manifest', type=Path, help="JSON manifest (see load_manifest for the format)")
+    parser.add_argument('--url', help=f"TeamCity URL (default: $TEAMCITY_URL or {DEFAULT_URL})")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Writes in flight at once (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument('--checkpoint', type=Path, default=DEFAULT_CHECKPOINT,
+                        help=f"Progress file for resuming (default: {DEFAULT_CHECKPOINT})")
+    parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and re-check every item")
+    parser.add_argument('--plan', action='store_true', help="Show what would change and exit without writing")
+    parser.add_argument('--report', type=Path, help="Write the per-item results as JSON")
+    add_transport_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    print("🏗️  TeamCity Bulk Provisioning")
+    print("=============================")
+    print()
+
+    load_environment()
+    teamcity_url = args.url or os.getenv('TEAMCITY_URL', DEFAULT_URL)
+    admin_token = os.getenv('TEAMCITY_ADMIN_TOKEN')
+    if not admin_token:
+        print("❌ ERROR: TEAMCITY_ADMIN_TOKEN environment variable not set")
+        sys.exit(1)
+    if args.concurrency < 1:
+        print("❌ ERROR: --concurrency must be at least 1")
+        sys.exit(1)
+
+    try:
+        items = load_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        print(f"❌ ERROR: Invalid manifest {args.manifest}: {e}")
+        sys.exit(1)
+
+    checkpoint = Checkpoint(args.checkpoint, teamcity_url, args.manifest.resolve())
+    if args.restart:
+        checkpoint.completed = {}
+    pending = [item for item in items if not checkpoint.is_done(item)]
+    print(f"📦 {len(items)} items in {args.manifest}"
+          + (f", {len(items) - len(pending)} already done per {args.checkpoint}" if checkpoint.resumed else ''))
+
+    api = TeamCityAPI(teamcity_url, admin_token, transport=transport_from_args(args))
+    actions: Dict[str, PlanAction] = {}
+    if pending:
+        print("🔍 Reading existing projects, VCS roots and configurations...")
+        try:
+            snapshot = ServerSnapshot.fetch_all(api, SNAPSHOT_PAGE_SIZE)
+        except requests.HTTPError as e:
+            print(f"❌ Failed to read the server state (HTTP {e.response.status_code})")
+            sys.exit(1)
+        except (requests.RequestException, CircuitOpenError) as e:
+            print(f"❌ Error talking to TeamCity: {e}")
+            sys.exit(1)
+        desired = DesiredState(
+            projects=[item.spec for item in pending if isinstance(item.spec, ProjectSpec)],
+            vcs_roots=[item.spec for item in pending if isinstance(item.spec, VcsRootSpec)],
+            build_types=[item.spec for item in pending if isinstance(item.spec, BuildTypeSpec)],
+            features=[item.spec for item in pending if isinstance(item.spec, FeatureSpec)],
+        )
+        plan = build_plan(desired, snapshot)
+        keys = {id(item.spec): item.key for item in pending}
+        actions = {keys[id(action.spec)]: action for action in plan.actions}
+        print(f"   {len(snapshot.projects)} projects, {len(snapshot.build_types)} configurations on the server")
+        print()
+        if args.plan:
+            plan.print()
+            return
+
+    write_count = sum(len(action.writes) for action in actions.values())
+    if write_count:
+        print(f"🚧 Applying {write_count} writes, up to {args.concurrency} at a time...")
+    else:
+        print("✅ Nothing to change")
+    started = time.perf_counter()
+    async_api = AsyncTeamCityAPI(api, args.concurrency)
+    try:
+        results = asyncio.run(apply_items(async_api, items, actions, checkpoint))
+    finally:
+        async_api.close()
+    wall_time = time.perf_counter() - started
+
+    print()
+    print_report(results, wall_time)
+    if args.report:
+        write_report(args.report, results, teamcity_url, wall_time)
+        print(f"📝 Report written to {args.report}")
+    print(f"📊 API usage: {api.stats.summary()}")
+
+    failed = [result for result in results if result.outcome in ('failed', 'skipped')]
+    if failed:
+        print()
+        print(f"❌ {len(failed)} items did not complete; rerun to resume from {args.checkpoint}")
+        sys.exit(1)
+    checkpoint.remove()
+    print("🎉 All items provisioned")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+TeamCity Server Log Analyzer
+Memory-mapped parsing, time index and sync session extraction for teamcity-server.log
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import sys
+from bisect import bisect_right
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_LOG = Path('/opt/teamcity/logs/teamcity-server.log')
+INDEX_VERSION = 1
+INDEX_INTERVAL = 256 * 1024  # bytes between index points
+
+# [2026-10-17 10:00:00,123]   INFO -  jetbrains.buildServer.SERVER - message
+HEADER_RE = re.compile(
+    rb'^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),(\d{3})\]\s+([A-Z]+)\s+-\s+(\S+)\s+-\s?(.*?)\r?$', re.MULTILINE)
+
+# Lines worth parsing when looking for sync sessions, found with plain substring scans (the
+# leading letter is dropped so both "Versioned" and "versioned" match); the rest is never parsed
+SYNC_KEYWORDS = (b'ersionedSettings', b'ersioned settings', b'ersioned-settings', b'settings.kts', b'DSL')
+SESSION_START_RE = re.compile(
+    r'(?i)start(?:ed|ing)? (?:loading|synchroni[sz]|updating|checking)|loading (?:project )?settings from vcs'
+    r'|checking for changes|running dsl')
+SESSION_END_RE = re.compile(
+    r'(?i)settings (?:were |have been )?(?:successfully )?(?:loaded|applied|updated|generated)'
+    r'|finished (?:loading|synchroni[sz]ing|updating)|no changes (?:found|detected)')
+SESSION_ERROR_LEVELS = frozenset({'ERROR', 'WARN', 'FATAL'})
+
+_epoch_cache: Dict[bytes, float] = {}
+
+
+def parse_timestamp(value: bytes) -> float:
+    """Local-time epoch seconds of a ``YYYY-MM-DD HH:MM:SS`` log timestamp"""
+    epoch = _epoch_cache.get(value)
+    if epoch is None:
+        if len(_epoch_cache) > 100_000:
+            _epoch_cache.clear()
+        epoch = datetime.strptime(value.decode('ascii'), '%Y-%m-%d %H:%M:%S').timestamp()
+        _epoch_cache[value] = epoch
+    return epoch
+
+
+def parse_time_argument(value: str) -> float:
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"invalid time '{value}' (use YYYY-MM-DD[ HH:MM[:SS]])")
+
+
+def format_time(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+
+class LogRecord:
+    __slots__ = ('timestamp', 'level', 'category', 'message', 'trace', 'offset')
+
+    def __init__(self, timestamp: float, level: str, category: str, message: str, trace: str, offset: int):
+        self.timestamp = timestamp
+        self.level = level
+        self.category = category
+        self.message = message
+        self.trace = trace
+        self.offset = offset
+
+    def format(self, with_trace: bool = False) -> str:
+        line = f"{format_time(self.timestamp)} {self.level:<5} {self.category} - {self.message}"
+        if with_trace and self.trace:
+            line += '\n' + self.trace
+        return line
+
+
+def _record(match: 're.Match', trace: bytes) -> LogRecord:
+    return LogRecord(
+        parse_timestamp(match.group(1)) + int(match.group(2)) / 1000,
+        match.group(3).decode('ascii'),
+        match.group(4).decode('utf-8', 'replace'),
+        match.group(5).decode('utf-8', 'replace'),
+        trace.decode('utf-8', 'replace').rstrip('\r\n'),
+        match.start(),
+    )
+
+
+def iter_records(mm, start: int = 0) -> Iterator[LogRecord]:
+    """Yield records from ``start`` (a line start); lines without a header belong to the previous record"""
+    previous = None
+    for match in HEADER_RE.finditer(mm, start):
+        if previous is not None:
+            yield _record(previous, mm[previous.end() + 1:match.start()])
+        previous = match
+    if previous is not None:
+        yield _record(previous, mm[previous.end() + 1:])
+
+
+def record_at(mm, offset: int) -> Optional[LogRecord]:
+    """The record whose header line starts at ``offset``, with its stack trace"""
+    match = HEADER_RE.match(mm, offset)
+    if match is None:
+        return None
+    following = HEADER_RE.search(mm, match.end())
+    return _record(match, mm[match.end() + 1:following.start() if following else len(mm)])
+
+
+def line_start(mm, offset: int) -> int:
+    """Offset of the first line starting at or after ``offset``"""
+    if offset <= 0:
+        return 0
+    if mm[offset - 1:offset] == b'\n':
+        return offset
+    newline = mm.find(b'\n', offset)
+    return len(mm) if newline < 0 else newline + 1
+
+
+class TimeIndex:
+    """Sampled (timestamp, offset) points, one per ``INDEX_INTERVAL`` bytes
+
+    Building it reads one header per interval rather than the whole file.
+    The sidecar is keyed by a hash of the file's first line, so it follows
+    the file through log rotation (teamcity-server.log -> .1 -> .2).
+    """
+
+    def __init__(self, identity: str, size: int = 0, points: Optional[List[Tuple[float, int]]] = None):
+        self.identity = identity
+        self.size = size
+        self.points = points or []
+
+    @staticmethod
+    def identity_of(mm) -> Optional[str]:
+        first_newline = mm.find(b'\n')
+        if first_newline < 0:
+            return None
+        return hashlib.sha1(mm[:first_newline]).hexdigest()
+
+    @classmethod
+    def load(cls, path: Path, identity: str) -> Optional['TimeIndex']:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != INDEX_VERSION or data.get('identity') != identity:
+            return None
+        return cls(identity, data['size'], [tuple(p) for p in data['points']])
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'identity': self.identity, 'size': self.size,
+                       'points': self.points}, f)
+        os.replace(tmp, path)
+
+    def extend(self, mm) -> int:
+        """Index the bytes appended since the last run; returns the number of new points"""
+        if len(mm) < self.size:
+            self.points, self.size = [], 0
+        added = 0
+        position = self.points[-1][1] + INDEX_INTERVAL if self.points else 0
+        while position < len(mm):
+            match = HEADER_RE.search(mm, line_start(mm, position))
+            if match is None:
+                break
+            timestamp = parse_timestamp(match.group(1)) + int(match.group(2)) / 1000
+            if not self.points or match.start() > self.points[-1][1]:
+                self.points.append((timestamp, match.start()))
+                added += 1
+            position = match.start() + INDEX_INTERVAL
+        self.size = len(mm)
+        return added
+
+    def offset_before(self, timestamp: float) -> int:
+        """An offset at or before the first record at ``timestamp``"""
+        index = bisect_right([p[0] for p in self.points], timestamp) - 1
+        return self.points[max(index - 1, 0)][1] if index > 0 else 0
+
+    @property
+    def first_timestamp(self) -> Optional[float]:
+        return self.points[0][0] if self.points else None
+
+
+class LogFile:
+    def __init__(self, path: Path, index_dir: Path):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self.mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        identity = TimeIndex.identity_of(self.mm) or ''
+        self.index_path = index_dir / f"{identity}.json"
+        self.index = TimeIndex.load(self.index_path, identity) or TimeIndex(identity)
+
+    def update_index(self) -> Tuple[int, bool]:
+        """Returns (new points, resumed from a previous run)"""
+        resumed = self.index.size > 0
+        added = self.index.extend(self.mm)
+        if self.index.identity:
+            self.index.save(self.index_path)
+        return added, resumed
+
+    def records(self, since: Optional[float] = None, until: Optional[float] = None) -> Iterator[LogRecord]:
+        start = self.index.offset_before(since) if since is not None else 0
+        for record in iter_records(self.mm, start):
+            if since is not None and record.timestamp < since:
+                continue
+            if until is not None and record.timestamp > until:
+                return
+            yield record
+
+    def keyword_records(self, since: Optional[float] = None) -> Iterator[LogRecord]:
+        """Records whose header line mentions versioned settings or the DSL, in file order"""
+        start = self.index.offset_before(since) if since is not None else 0
+        line_starts = set()
+        for keyword in SYNC_KEYWORDS:
+            position = self.mm.find(keyword, start)
+            while position >= 0:
+                line_starts.add(self.mm.rfind(b'\n', 0, position) + 1)
+                next_line = self.mm.find(b'\n', position)
+                position = self.mm.find(keyword, next_line) if next_line >= 0 else -1
+        for offset in sorted(line_starts):
+            record = record_at(self.mm, offset)
+            if record is None:
+                continue  # a stack trace line
+            if since is None or record.timestamp >= since:
+                yield record
+
+    def close(self):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+        self._file.close()
+
+
+def rotated_files(path: Path) -> List[Path]:
+    """The log and its numbered rotations, oldest first (compressed rotations are skipped)"""
+    rotations = []
+    for candidate in path.parent.glob(path.name + '.*'):
+        suffix = candidate.name[len(path.name) + 1:]
+        if suffix.isdigit():
+            rotations.append((int(suffix), candidate))
+    return [p for _, p in sorted(rotations, reverse=True)] + ([path] if path.exists() else [])
+
+
+def default_index_dir(log_path: Path) -> Path:
+    index_dir = log_path.parent / '.logindex'
+    if os.access(log_path.parent, os.W_OK) or os.access(index_dir, os.W_OK):
+        return index_dir
+    return Path.home() / '.cache' / 'teamcity-logindex'
+
+
+def open_logs(path: Path, include_rotated: bool, index_dir: Optional[Path]) -> List[LogFile]:
+    paths = rotated_files(path) if include_rotated else [path]
+    if not paths:
+        raise FileNotFoundError(f"{path} not found")
+    index_dir = index_dir or default_index_dir(path)
+    logs = [LogFile(p, index_dir) for p in paths]
+    for log in logs:
+        log.update_index()
+    return logs
+
+
+def select_logs(logs: Sequence[LogFile], since: Optional[float]) -> List[LogFile]:
+    """Skip rotated files that end before ``since``: a file ends where the next one starts"""
+    if since is None:
+        return list(logs)
+    selected = []
+    for log, newer in zip(logs, list(logs[1:]) + [None]):
+        newer_start = newer.index.first_timestamp if newer is not None else None
+        if newer_start is None or newer_start > since:
+            selected.append(log)
+    return selected
+
+
+class SyncSession:
+    def __init__(self, start: LogRecord):
+        self.start = start
+        self.end: Optional[LogRecord] = None
+        self.errors: List[LogRecord] = []
+
+    @property
+    def status(self) -> str:
+        if self.end is None:
+            return 'incomplete'
+        return 'failed' if any(e.level in ('ERROR', 'FATAL') for e in self.errors) else 'ok'
+
+    @property
+    def duration(self) -> Optional[float]:
+        return self.end.timestamp - self.start.timestamp if self.end else None
+
+
+def extract_sessions(records: Iterator[LogRecord]) -> List[SyncSession]:
+    """Group versioned-settings records into sessions between a start and an end message
+
+    A start while a session is open closes it as incomplete; warnings and
+    errors logged inside a session are attached to it.
+    """
+    sessions = []
+    current: Optional[SyncSession] = None
+    for record in records:
+        if SESSION_START_RE.search(record.message):
+            current = SyncSession(record)
+            sessions.append(current)
+        elif current is not None and SESSION_END_RE.search(record.message):
+            current.end = record
+            current = None
+        elif record.level in SESSION_ERROR_LEVELS:
+            if current is None:
+                current = SyncSession(record)
+                sessions.append(current)
+            current.errors.append(record)
+    return sessions
+
+
+def print_sessions(sessions: Sequence[SyncSession], max_errors: int = 3):
+    print(f"🔄 Versioned settings sync sessions: {len(sessions)}")
+    symbols = {'ok': '✅', 'failed': '❌', 'incomplete': '⏳'}
+    for session in sessions:
+        duration = f"{session.duration:.1f}s" if session.duration is not None else '-'
+        end = format_time(session.end.timestamp) if session.end else 'no end message'
+        print(f"  {symbols[session.status]} {format_time(session.start.timestamp)} → {end} "
+              f"({duration}, {len(session.errors)} warnings/errors)")
+        for error in session.errors[:max_errors]:
+            print(f"     {error.level}: {error.message}")
+            if error.trace:
+                print(f"       {error.trace.splitlines()[0]}")
+        if len(session.errors) > max_errors:
+            print(f"     ... {len(session.errors) - max_errors} more")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Analyze teamcity-server.log without grepping gigabytes")
+    parser.add_argument('command', choices=['index', 'query', 'sessions'],
+                        help="index: build/extend the time index; query: records in a time range; "
+                             "sessions: versioned settings sync sessions")
+    parser.add_argument('--log', type=Path, default=DEFAULT_LOG, help=f"Server log (default: {DEFAULT_LOG})")
+    parser.add_argument('--no-rotated', action='store_true', help="Ignore rotated files (LOG.1, LOG.2, ...)")
+    parser.add_argument('--index-dir', type=Path,
+                        help="Where sidecar indexes live (default: .logindex next to the log, or ~/.cache)")
+    parser.add_argument('--since', type=parse_time_argument, help="Start time, YYYY-MM-DD[ HH:MM[:SS]]")
+    parser.add_argument('--until', type=parse_time_argument, help="End time, YYYY-MM-DD[ HH:MM[:SS]]")
+    parser.add_argument('--level', help="Comma-separated levels to show, e.g. ERROR,WARN")
+    parser.add_argument('--category', help="Only categories containing this text")
+    parser.add_argument('--grep', type=re.compile, help="Only messages matching this regex")
+    parser.add_argument('--traces', action='store_true', help="Print stack traces under their records")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    try:
+        logs = open_logs(args.log, not args.no_rotated, args.index_dir)
+    except OSError as e:
+        print(f"❌ ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        if args.command == 'index':
+            for log in logs:
+                if not log.index.identity:
+                    print(f"🗂️  {log.path}: empty")
+                    continue
+                print(f"🗂️  {log.path}: {len(log.index.points)} index points over "
+                      f"{log.index.size / 1024 / 1024:.1f} MiB ({log.index_path})")
+        elif args.command == 'query':
+            levels = {l.strip().upper() for l in args.level.split(',')} if args.level else None
+            for log in select_logs(logs, args.since):
+                for record in log.records(args.since, args.until):
+                    if levels is not None and record.level not in levels:
+                        continue
+                    if args.category and args.category not in record.category:
+                        continue
+                    if args.grep and not args.grep.search(record.message):
+                        continue
+                    print(record.format(args.traces))
+        else:
+            records = (record for log in select_logs(logs, args.since)
+                       for record in log.keyword_records(args.since)
+                       if args.until is None or record.timestamp <= args.until)
+            print_sessions(extract_sessions(records))
+    except BrokenPipeError:
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        for log in logs:
+            log.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+"""
+TeamCity Configuration Snapshot
+Persists server configuration into a local SQLite file and inspects it offline
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Set
+
+import requests
+
+from teamcity_api import TeamCityAPI, DEFAULT_PAGE_SIZE, PROPERTY_FIELDS, PROJECT_FEATURE_FIELDS
+from teamcity_model import format_date, parse_date
+from teamcity_plan import VCS_ROOT_ID, VERSIONED_SETTINGS_PROPERTIES
+from teamcity_sync import expected_projects_from_settings
+from teamcity_transport import add_transport_arguments, transport_from_args
+
+DEFAULT_DB = Path('teamcity-snapshot.db')
+# Audit events re-read from before the last refresh, for clock skew between this machine and the server
+AUDIT_OVERLAP = 300
+AUDIT_FIELDS = {'auditEvent': ['id', 'timestamp', {'relatedEntities': {'entity': [
+    'type', {'project': ['id']}, {'buildType': ['id']}, {'vcsRoot': ['id']}]}}]}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT,
+    parent_id TEXT,
+    content_hash TEXT NOT NULL,
+    data TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (kind, id)
+);
+CREATE INDEX IF NOT EXISTS idx_entities_parent ON entities (kind, parent_id);
+CREATE INDEX IF NOT EXISTS idx_entities_name ON entities (kind, name);
+CREATE TABLE IF NOT EXISTS properties (
+    kind TEXT NOT NULL,
+    entity_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (kind, entity_id, name)
+);
+CREATE INDEX IF NOT EXISTS idx_properties_name ON properties (kind, name, value);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class Collection:
+    """A server collection mirrored into the snapshot
+
+    ``audit_type`` is the audit log's name for its items; collections
+    without one are always re-listed. With ``embeds_parent`` the items
+    carry their parent project's name, so a change to the project
+    refetches them too.
+    """
+
+    def __init__(self, kind: str, endpoint: str, item_key: str, fields, parent_key: Optional[str],
+                 paged: bool = True, audit_type: Optional[str] = None, embeds_parent: bool = False):
+        self.kind = kind
+        self.endpoint = endpoint
+        self.item_key = item_key
+        self.fields = fields
+        self.parent_key = parent_key
+        self.paged = paged
+        self.audit_type = audit_type
+        self.embeds_parent = embeds_parent
+
+    def parent_of(self, item: Dict) -> Optional[str]:
+        if self.parent_key is None:
+            return None
+        value = item.get(self.parent_key)
+        return value.get('id') if isinstance(value, dict) else value
+
+
+# Projects first, so rows under a project that is gone can be dropped without asking the server
+COLLECTIONS = [
+    Collection('project', 'projects', 'project',
+               {'project': ['id', 'name', 'parentProjectId', 'description', 'archived']}, 'parentProjectId',
+               audit_type='project'),
+    Collection('vcs-root', 'vcs-roots', 'vcs-root',
+               {'vcs-root': ['id', 'name', 'vcsName', {'project': ['id']}, PROPERTY_FIELDS]}, 'project',
+               audit_type='vcsRoot'),
+    Collection('feature', 'projects/id:_Root/projectFeatures', 'projectFeature',
+               PROJECT_FEATURE_FIELDS, None, paged=False),
+    Collection('buildType', 'buildTypes', 'buildType',
+               {'buildType': ['id', 'name', 'projectId', 'projectName', 'description', 'paused']}, 'projectId',
+               audit_type='buildType', embeds_parent=True),
+]
+COLLECTION_KINDS = [c.kind for c in COLLECTIONS]
+
+
+def content_hash(item: Dict) -> str:
+    return hashlib.sha256(json.dumps(item, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class RefreshCounts:
+    def __init__(self):
+        self.fetched = 0
+        self.added = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.removed = 0
+
+    def summary(self) -> str:
+        return (f"{self.fetched} fetched: {self.added} added, {self.updated} updated, "
+                f"{self.unchanged} unchanged, {self.removed} removed")
+
+
+class SnapshotStore:
+    """SQLite store of server entities, one row per (kind, id) plus an index of their properties"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def hashes(self, kind: str) -> Dict[str, str]:
+        rows = self.db.execute("SELECT id, content_hash FROM entities WHERE kind = ?", (kind,))
+        return {row['id']: row['content_hash'] for row in rows}
+
+    def upsert(self, kind: str, item: Dict, parent_id: Optional[str], digest: str):
+        self.db.execute(
+            "INSERT OR REPLACE INTO entities (kind, id, name, parent_id, content_hash, data, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (kind, item['id'], item.get('name'), parent_id, digest, json.dumps(item), time.time()),
+        )
+        self.db.execute("DELETE FROM properties WHERE kind = ? AND entity_id = ?", (kind, item['id']))
+        self.db.executemany(
+            "INSERT INTO properties (kind, entity_id, name, value) VALUES (?, ?, ?, ?)",
+            [(kind, item['id'], prop['name'], prop.get('value'))
+             for prop in item.get('properties', {}).get('property', [])],
+        )
+
+    def remove(self, kind: str, entity_ids: Sequence[str]):
+        for entity_id in entity_ids:
+            self.db.execute("DELETE FROM entities WHERE kind = ? AND id = ?", (kind, entity_id))
+            self.db.execute("DELETE FROM properties WHERE kind = ? AND entity_id = ?", (kind, entity_id))
+
+    def set_meta(self, key: str, value: str):
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def meta(self, key: str) -> Optional[str]:
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else None
+
+    def entities(self, kind: str, parent_id: Optional[str] = None) -> List[Dict]:
+        if parent_id is None:
+            rows = self.db.execute("SELECT data FROM entities WHERE kind = ? ORDER BY rowid", (kind,))
+        else:
+            rows = self.db.execute("SELECT data FROM entities WHERE kind = ? AND parent_id = ? ORDER BY rowid",
+                                   (kind, parent_id))
+        return [json.loads(row['data']) for row in rows]
+
+    def entity(self, kind: str, entity_id: str) -> Optional[Dict]:
+        row = self.db.execute("SELECT data FROM entities WHERE kind = ? AND id = ?", (kind, entity_id)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def properties(self, kind: str, entity_id: str) -> Dict[str, str]:
+        rows = self.db.execute("SELECT name, value FROM properties WHERE kind = ? AND entity_id = ?",
+                               (kind, entity_id))
+        return {row['name']: row['value'] for row in rows}
+
+    def count(self, kind: str) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM entities WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def children(self, kind: str, parent_ids: Set[str]) -> Set[str]:
+        rows = self.db.execute("SELECT id, parent_id FROM entities WHERE kind = ? AND parent_id IS NOT NULL",
+                               (kind,))
+        return {row['id'] for row in rows if row['parent_id'] in parent_ids}
+
+    def orphans(self, kind: str) -> List[str]:
+        """Rows whose parent project is no longer in the snapshot"""
+        rows = self.db.execute(
+            "SELECT id FROM entities WHERE kind = ? AND parent_id IS NOT NULL "
+            "AND parent_id NOT IN (SELECT id FROM entities WHERE kind = 'project')", (kind,))
+        return [row['id'] for row in rows]
+
+
+def fetch_items(api: TeamCityAPI, collection: Collection, page_size: int) -> Iterator[Dict]:
+    if collection.paged:
+        yield from api.iter_collection(collection.endpoint, collection.item_key,
+                                       fields=collection.fields, page_size=page_size)
+        return
+    response = api.query(collection.endpoint, fields=collection.fields)
+    response.raise_for_status()
+    yield from response.json().get(collection.item_key, [])
+
+
+def store_item(store: SnapshotStore, collection: Collection, item: Dict, known: Dict[str, str],
+               counts: RefreshCounts):
+    """Write one fetched item unless its content hash is the stored one"""
+    counts.fetched += 1
+    digest = content_hash(item)
+    previous = known.get(item['id'])
+    if previous == digest:
+        counts.unchanged += 1
+        return
+    store.upsert(collection.kind, item, collection.parent_of(item), digest)
+    if previous is None:
+        counts.added += 1
+    else:
+        counts.updated += 1
+
+
+def refresh_collection(api: TeamCityAPI, store: SnapshotStore, collection: Collection,
+                       page_size: int) -> RefreshCounts:
+    """Stream a collection from the server and write only the rows whose content hash changed
+
+    TeamCity does not expose modification stamps for these entities, so
+    the narrow field selection of each item is hashed instead.
+    """
+    counts = RefreshCounts()
+    known = store.hashes(collection.kind)
+    seen = set()
+    for item in fetch_items(api, collection, page_size):
+        seen.add(item['id'])
+        store_item(store, collection, item, known, counts)
+    stale = [entity_id for entity_id in known if entity_id not in seen]
+    store.remove(collection.kind, stale)
+    counts.removed = len(stale)
+    return counts
+
+
+def audit_changes(api: TeamCityAPI, since: float, page_size: int) -> Dict[str, Optional[Set[str]]]:
+    """Ids per audit entity type named by events since ``since``; None where an event named no id
+
+    The audit log is newest first, so paging stops at the first older event.
+    """
+    changed: Dict[str, Optional[Set[str]]] = {}
+    events = api.iter_collection('audit', 'auditEvent', fields=AUDIT_FIELDS, page_size=page_size)
+    try:
+        for event in events:
+            if (parse_date(event.get('timestamp')) or 0) < since:
+                break
+            for entity in event.get('relatedEntities', {}).get('entity', []):
+                entity_type = entity.get('type')
+                entity_id = (entity.get(entity_type) or {}).get('id')
+                if entity_id is None:
+                    changed[entity_type] = None
+                elif changed.setdefault(entity_type, set()) is not None:
+                    changed[entity_type].add(entity_id)
+    finally:
+        events.close()
+    return changed
+
+
+def refresh_changed(api: TeamCityAPI, store: SnapshotStore, collection: Collection,
+                    entity_ids: Set[str]) -> RefreshCounts:
+    """Fetch only the named items; one the server no longer has is removed, as are rows left without a parent"""
+    counts = RefreshCounts()
+    known = store.hashes(collection.kind)
+    for entity_id in sorted(entity_ids):
+        response = api.query(f"{collection.endpoint}/id:{entity_id}", fields=collection.fields[collection.item_key])
+        if response.status_code == 404:
+            if entity_id in known:
+                store.remove(collection.kind, [entity_id])
+                counts.removed += 1
+            continue
+        response.raise_for_status()
+        store_item(store, collection, response.json(), known, counts)
+    if store.count('project'):
+        # A deleted project takes everything under it along, without an audit event of their own
+        while True:
+            orphans = store.orphans(collection.kind)
+            if not orphans:
+                break
+            store.remove(collection.kind, orphans)
+            counts.removed += len(orphans)
+    return counts
+
+
+def refresh(api: TeamCityAPI, store: SnapshotStore, kinds: Sequence[str], page_size: int,
+            full: bool = False) -> bool:
+    """Refresh the snapshot, from the audit log's changes where it can, re-listing collections otherwise
+
+    A collection is re-listed when ``full`` is set, it was never fetched,
+    it has no audit entity type, or the audit log cannot be read.
+    """
+    started_at = time.time()
+    refreshed = [store.meta(f"refreshed_at:{collection.kind}") for collection in COLLECTIONS
+                 if collection.kind in kinds and collection.audit_type]
+    changed: Optional[Dict[str, Optional[Set[str]]]] = None
+    if not full and refreshed and all(refreshed):
+        since = min(float(value) for value in refreshed) - AUDIT_OVERLAP
+        try:
+            changed = audit_changes(api, since, page_size)
+            named = sum(len(ids) for ids in changed.values() if ids)
+            print(f"  📜 Audit log since {format_date(since)}: {named} changed entities")
+        except requests.HTTPError as e:
+            print(f"  ⚠️  Audit log unavailable (HTTP {e.response.status_code}), re-listing everything")
+        except requests.RequestException as e:
+            print(f"  ⚠️  Audit log unavailable ({e}), re-listing everything")
+
+    success = True
+    for collection in COLLECTIONS:
+        if collection.kind not in kinds:
+            continue
+        started = time.monotonic()
+        entity_ids = changed.get(collection.audit_type, set()) if changed is not None and collection.audit_type \
+            else None
+        if entity_ids is not None and collection.embeds_parent:
+            # Items under a project that is gone are dropped as orphans instead
+            projects = set(store.hashes('project')) & (changed.get('project') or set())
+            entity_ids = entity_ids | store.children(collection.kind, projects)
+        try:
+            with store.db:
+                if entity_ids is None:
+                    counts = refresh_collection(api, store, collection, page_size)
+                else:
+                    counts = refresh_changed(api, store, collection, entity_ids)
+                store.set_meta(f"refreshed_at:{collection.kind}", str(started_at))
+            how = 're-listed' if entity_ids is None else 'changes only'
+            print(f"  ✅ {collection.kind} ({how}): {counts.summary()} ({time.monotonic() - started:.1f}s)")
+        except requests.HTTPError as e:
+            print(f"  ❌ {collection.kind}: failed (HTTP {e.response.status_code}), previous rows kept")
+            success = False
+        except requests.RequestException as e:
+            print(f"  ❌ {collection.kind}: {e}, previous rows kept")
+            success = False
+    return success
+
+
+def print_diagnosis(store: SnapshotStore):
+    print("📂 VCS Roots:")
+    for root in store.entities('vcs-root'):
+        properties = store.properties('vcs-root', root['id'])
+        print(f"  - {root['name']} (ID: {root['id']})")
+        print(f"    URL: {properties.get('url', 'unknown')}")
+        print(f"    Branch: {properties.get('branch', 'unknown')}")
+        print(f"    Auth Method: {properties.get('authMethod', 'unknown')}")
+    print()
+
+    print("⚙️  Root Project Features:")
+    for feature in store.entities('feature'):
+        print(f"  - {feature['type']} (ID: {feature['id']})")
+        if feature['type'] == 'versionedSettings':
+            properties = store.properties('feature', feature['id'])
+            print(f"    Enabled: {properties.get('enabled', 'unknown')}")
+            print(f"    VCS Root ID: {properties.get('rootId', 'unknown')}")
+            print(f"    Build Settings: {properties.get('buildSettings', 'unknown')}")
+            print(f"    Import Settings: {properties.get('importSettings', 'unknown')}")
+            print(f"    Credentials Storage: {properties.get('credentialsStorageType', 'unknown')}")
+            print(f"    Show Changes: {properties.get('showChanges', 'unknown')}")
+    print()
+
+    print("📋 Current Projects:")
+    for project in store.entities('project'):
+        print(f"  - {project['name']} (ID: {project['id']})")
+    print()
+
+    print("🔧 Build Configurations:")
+    for bt in store.entities('buildType'):
+        print(f"  - {bt['name']} (ID: {bt['id']}) - Project: {bt.get('projectName', 'unknown')}")
+
+
+def validate(store: SnapshotStore) -> bool:
+    """Check the snapshot against what this repository deploys"""
+    success = True
+
+    def check(ok: bool, message: str):
+        nonlocal success
+        print(f"   {'✅' if ok else '❌'} {message}")
+        success = success and ok
+
+    check(store.entity('vcs-root', VCS_ROOT_ID) is not None, f"VCS root {VCS_ROOT_ID} exists")
+
+    features = [f for f in store.entities('feature') if f['type'] == 'versionedSettings']
+    check(bool(features), "versioned settings feature exists on _Root")
+    if features:
+        properties = store.properties('feature', features[0]['id'])
+        for name, expected in VERSIONED_SETTINGS_PROPERTIES.items():
+            check(properties.get(name) == expected,
+                  f"versioned settings {name} = {expected} (found {properties.get(name, 'unset')})")
+
+    for project_id in expected_projects_from_settings():
+        check(store.entity('project', project_id) is not None, f"project {project_id} imported")
+    return success
+
+
+def load_environment():
+    """Load environment variables from .env file"""
+    env_file = Path('.env')
+    if env_file.exists():
+        with open(env_file) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#') and '=' in line:
+                    key, value = line.split('=', 1)
+                    os.environ[key] = value
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local SQLite snapshot of TeamCity configuration")
+    parser.add_argument('command', choices=['export', 'refresh', 'diagnose', 'validate', 'info'],
+                        help="export: full snapshot; refresh: fetch the entities the audit log shows as "
+                             "changed and write only those that differ; diagnose/validate/info: read the "
+                             "snapshot offline")
+    parser.add_argument('--db', type=Path, default=DEFAULT_DB,
+                        help=f"Snapshot file (default: {DEFAULT_DB})")
+    parser.add_argument('--url', default="https://teamcity.devinfra.ru", help="TeamCity server URL")
+    parser.add_argument('--only', default=','.join(COLLECTION_KINDS),
+                        help=f"Comma-separated kinds to export/refresh (default: {','.join(COLLECTION_KINDS)})")
+    parser.add_argument('--full', action='store_true',
+                        help="refresh: re-list every collection instead of following the audit log")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                        help=f"Items per page when listing collections (default: {DEFAULT_PAGE_SIZE})")
+    add_transport_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    print("🗄️  TeamCity Configuration Snapshot")
+    print("==================================")
+    print()
+
+    if args.command in ('export', 'refresh'):
+        load_environment()
+        admin_token = os.getenv('TEAMCITY_ADMIN_TOKEN')
+        if not admin_token:
+            print("❌ ERROR: TEAMCITY_ADMIN_TOKEN environment variable not set")
+            sys.exit(1)
+        kinds = [kind.strip() for kind in args.only.split(',') if kind.strip()]
+        unknown = [kind for kind in kinds if kind not in COLLECTION_KINDS]
+        if unknown:
+            print(f"❌ ERROR: Unknown kinds: {', '.join(unknown)}")
+            sys.exit(1)
+
+        if args.command == 'export' and args.db.exists():
+            args.db.unlink()
+        api = TeamCityAPI(args.url, admin_token, transport=transport_from_args(args))
+        store = SnapshotStore(args.db)
+        print(f"📥 {'Exporting' if args.command == 'export' else 'Refreshing'} {args.url} into {args.db}:")
+        with store.db:
+            store.set_meta('server_url', args.url)
+        success = refresh(api, store, kinds, args.page_size, full=args.full)
+        store.close()
+        print()
+        print(f"📊 API usage: {api.stats.summary()}")
+        if not success:
+            sys.exit(1)
+        return
+
+    if not args.db.exists():
+        print(f"❌ ERROR: Snapshot {args.db} not found, run '{sys.argv[0]} export' first")
+        sys.exit(1)
+    store = SnapshotStore(args.db)
+    print(f"📁 Snapshot of {store.meta('server_url') or 'unknown server'} ({args.db})")
+    for kind in COLLECTION_KINDS:
+        refreshed = store.meta(f"refreshed_at:{kind}")
+        age = f"{(time.time() - float(refreshed)) / 60:.0f} min old" if refreshed else "never fetched"
+        print(f"  - {kind}: {store.count(kind)} entities, {age}")
+    print()
+
+    if args.command == 'diagnose':
+        print_diagnosis(store)
+    elif args.command == 'validate':
+        print("🔍 Validating snapshot:")
+        if not validate(store):
+            store.close()
+            sys.exit(1)
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+TeamCity Super User Token
+Finds the latest super user token by scanning the server log backwards, with a validated local cache
+"""
+
+import argparse
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import requests
+
+from teamcity_api import TeamCityAPI
+
+DEFAULT_URL = "https://teamcity.devinfra.ru"
+DEFAULT_NODE = 'node5'
+DEFAULT_CONTAINER = 'teamcity_teamcity_1'
+DEFAULT_LOG_PATH = '/opt/teamcity/logs/teamcity-server.log'
+CACHE_FILE = Path('.teamcity-token-cache.json')
+
+TOKEN_RE = re.compile(rb'Super user authentication token: (\d+)')
+# A match can straddle two blocks; keep this many bytes of the later block when reading the earlier one
+OVERLAP = 128
+
+
+class LocalLog:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.source = str(self.path)
+
+    def stat(self) -> Tuple[int, int, int]:
+        st = os.stat(self.path)
+        return st.st_ino, st.st_size, int(st.st_mtime)
+
+    def read(self, offset: int, length: int) -> bytes:
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+
+class RemoteLog:
+    """The log inside the server container, read block by block over ssh + docker exec"""
+
+    def __init__(self, node: str, container: str, path: str):
+        self.node = node
+        self.container = container
+        self.path = path
+        self.source = f"{node}:{container}:{path}"
+
+    def _run(self, command: str) -> bytes:
+        remote = f"sudo docker exec {shlex.quote(self.container)} sh -c {shlex.quote(command)}"
+        result = subprocess.run(['ssh', self.node, remote], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                stdin=subprocess.DEVNULL, timeout=60)
+        if result.returncode != 0:
+            raise OSError(f"{self.source}: {result.stderr.decode(errors='replace').strip() or 'ssh failed'}")
+        return result.stdout
+
+    def stat(self) -> Tuple[int, int, int]:
+        inode, size, mtime = self._run(f"stat -c '%i %s %Y' {shlex.quote(self.path)}").split()
+        return int(inode), int(size), int(mtime)
+
+    def read(self, offset: int, length: int) -> bytes:
+        return self._run(f"dd if={shlex.quote(self.path)} iflag=skip_bytes,count_bytes "
+                         f"skip={offset} count={length} bs=65536 2>/dev/null")
+
+
+def reverse_find(log, size: int, stop_at: int = 0, block_size: int = 1 << 20) -> Tuple[Optional[str], int]:
+    """Find the last token in ``log`` by reading blocks from EOF towards ``stop_at``
+
+    Returns (token, offset of its match) or (None, -1). Only the blocks
+    after the last match are read, so the cost depends on how recently the
+    server printed a token, not on the size of the log.
+    """
+    end = size
+    carry = b''
+    while end > stop_at:
+        start = max(stop_at, end - block_size)
+        data = log.read(start, end - start) + carry
+        last = None
+        for last in TOKEN_RE.finditer(data):
+            pass
+        if last is not None:
+            return last.group(1).decode('ascii'), start + last.start()
+        carry = data[:OVERLAP]
+        end = start
+    return None, -1
+
+
+class TokenCache:
+    """Token plus the identity of the log it came from; stored with owner-only permissions"""
+
+    def __init__(self, path: Path = CACHE_FILE):
+        self.path = path
+
+    def load(self, source: str) -> Optional[Dict]:
+        try:
+            with open(self.path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get('source') == source else None
+
+    def save(self, entry: Dict):
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+
+    def clear(self):
+        if self.path.exists():
+            self.path.unlink()
+
+
+def token_is_valid(url: str, token: str) -> Optional[bool]:
+    """One GET of the server endpoint with the token as the password of an empty user
+
+    False only when the server rejects the token (401/403); None when it
+    could not say, e.g. it is unreachable or answers with an error.
+    """
+    try:
+        status = TeamCityAPI(url, token).query('server', fields='version').status_code
+    except requests.RequestException as e:
+        print(f"⚠️  Cannot check the token against {url}: {e}", file=sys.stderr)
+        return None
+    if status in (401, 403):
+        return False
+    if status != 200:
+        print(f"⚠️  Cannot check the token against {url}: HTTP {status}", file=sys.stderr)
+        return None
+    return True
+
+
+def acquire_token(log, url: str, cache: TokenCache, refresh: bool = False, validate: bool = True,
+                  block_size: int = 1 << 20) -> Optional[str]:
+    """Return a working super user token, touching the log only when the cached one is stale
+
+    A cached token that still authenticates costs one HTTP request. When
+    it has stopped working and the log is the same file grown since, only
+    the bytes after the cached match are scanned. A token the server could
+    not be asked about (network failure, 5xx) is kept, with a warning.
+    """
+    cached = None if refresh else cache.load(log.source)
+    valid = token_is_valid(url, cached['token']) if cached and validate else None
+    if cached and valid:
+        print("✅ Cached super user token is valid", file=sys.stderr)
+        return cached['token']
+    if cached and valid is None:
+        if validate:
+            print("⚠️  Using the cached token unchecked; the server could not confirm or reject it", file=sys.stderr)
+        return cached['token']
+
+    inode, size, mtime = log.stat()
+    stop_at = 0
+    if cached and cached['inode'] == inode and size >= cached['size']:
+        if (size, mtime) == (cached['size'], cached['mtime']):
+            print("⚠️  Cached token is rejected and the log has not changed since it was read", file=sys.stderr)
+            return None
+        # Same file, grown: a newer token can only be after the one we already have
+        stop_at = cached['offset'] + 1
+
+    print(f"🔍 Scanning {log.source} backwards ({size / 1024 / 1024:.1f} MiB, "
+          f"{(size - stop_at) / 1024 / 1024:.1f} MiB eligible)", file=sys.stderr)
+    token, offset = reverse_find(log, size, stop_at, block_size)
+    if token is None:
+        print("⚠️  No super user token found in the log", file=sys.stderr)
+        return None
+    valid = token_is_valid(url, token) if validate else True
+    if valid is False:
+        print("⚠️  Latest token in the log is rejected by the server", file=sys.stderr)
+        return None
+    if valid is None:
+        print("⚠️  Using the latest token in the log unchecked", file=sys.stderr)
+    cache.save({'source': log.source, 'inode': inode, 'size': size, 'mtime': mtime,
+                'offset': offset, 'token': token})
+    return token
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Print the current TeamCity super user token")
+    parser.add_argument('--url', default=DEFAULT_URL, help=f"Server used to validate the token (default: {DEFAULT_URL})")
+    parser.add_argument('--local', type=Path, help="Read a local copy of teamcity-server.log")
+    parser.add_argument('--node', default=DEFAULT_NODE, help=f"SSH host running the server (default: {DEFAULT_NODE})")
+    parser.add_argument('--container', default=DEFAULT_CONTAINER, help=f"Server container (default: {DEFAULT_CONTAINER})")
+    parser.add_argument('--path', default=DEFAULT_LOG_PATH, help=f"Log path in the container (default: {DEFAULT_LOG_PATH})")
+    parser.add_argument('--cache', type=Path, default=CACHE_FILE, help=f"Token cache file (default: {CACHE_FILE})")
+    parser.add_argument('--refresh', action='store_true', help="Ignore the cache and scan the log")
+    parser.add_argument('--no-validate', action='store_true', help="Do not check the token against the server")
+    parser.add_argument('--block-size', type=int, default=1 << 20, help="Bytes read per backwards step")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    log = LocalLog(args.local) if args.local else RemoteLog(args.node, args.container, args.path)
+    try:
+        token = acquire_token(log, args.url, TokenCache(args.cache), args.refresh,
+                              not args.no_validate, args.block_size)
+    except (OSError, subprocess.TimeoutExpired, ValueError) as e:
+        print(f"❌ ERROR: Cannot read {log.source}: {e}", file=sys.stderr)
+        sys.exit(1)
+    if token is None:
+        sys.exit(1)
+    print(token)
+
+
+if __name__ == "__main__":
+    main()
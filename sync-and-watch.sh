@@ -12,6 +12,7 @@ LOG_NODE="node5"
 CONTAINER_NAME="teamcity_teamcity_1"
 PROJECT_ID="_Root"
 SYNC_TIMEOUT=300  # 5 minutes
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 
 # Colors for output
 RED='\033[0;31m'
@@ -108,37 +109,17 @@ watch_logs() {
     print_warning "Press Ctrl+C to stop log monitoring"
     echo ""
     
-    # Start log monitoring in background
-    ssh "$LOG_NODE" "sudo docker logs --tail 50 -f $CONTAINER_NAME 2>&1" | while read line; do
-        timestamp=$(date '+%H:%M:%S')
-        
-        # Highlight important log entries
-        if echo "$line" | grep -qi "error\|exception\|failed"; then
-            echo -e "${RED}[$timestamp]${NC} $line"
-        elif echo "$line" | grep -qi "warning\|warn"; then
-            echo -e "${YELLOW}[$timestamp]${NC} $line"
-        elif echo "$line" | grep -qi "sync\|vcs\|commit\|configuration"; then
-            echo -e "${GREEN}[$timestamp]${NC} $line"
-        else
-            echo -e "${NC}[$timestamp] $line"
-        fi
-    done
+    # Classify the stream in one Python process instead of forking grep per line
+    python3 "$SCRIPT_DIR/logwatch.py" --node "$LOG_NODE" --container "$CONTAINER_NAME" --tail 50
 }
 
 # Function to watch for specific sync events
 watch_sync_events() {
     print_status "Monitoring for configuration sync events..."
     
-    timeout $SYNC_TIMEOUT ssh "$LOG_NODE" "sudo docker logs --tail 0 -f $CONTAINER_NAME 2>&1" | while read line; do
-        if echo "$line" | grep -qi "VCS.*sync\|configuration.*loaded\|DSL.*processed"; then
-            print_success "Sync event: $line"
-        elif echo "$line" | grep -qi "error.*sync\|failed.*configuration"; then
-            print_error "Sync error: $line"
-            break
-        elif echo "$line" | grep -qi "warning.*sync"; then
-            print_warning "Sync warning: $line"
-        fi
-    done
+    python3 "$SCRIPT_DIR/logwatch.py" --node "$LOG_NODE" --container "$CONTAINER_NAME" --tail 0 \
+        --pattern-set sync-events --only sync-event,sync-warn,sync-error \
+        --stop-on sync-error --timeout $SYNC_TIMEOUT
 }
 
 # Function to show usage
@@ -223,6 +204,11 @@ if ! command -v curl &> /dev/null; then
     exit 1
 fi
 
+if ! command -v python3 &> /dev/null; then
+    print_error "python3 is required for log monitoring but not installed"
+    exit 1
+fi
+
 if ! command -v jq &> /dev/null; then
     print_warning "jq not found - JSON parsing will be limited"
 fi
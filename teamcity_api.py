@@ -0,0 +1,406 @@
+"""
+TeamCity REST API Client
+Shared synchronous and asyncio clients used by the deployment and diagnostic scripts
+"""
+
+import asyncio
+import base64
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import quote, urlsplit
+
+import requests
+
+from teamcity_cache import ResponseCache
+from teamcity_governor import Governor
+from teamcity_metrics import RequestEvent
+from teamcity_transport import Transport, shared_transport
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_PAGE_SIZE = 100
+
+# Field selections for the inspection paths: one request returns exactly what is printed
+PROPERTY_FIELDS = {'properties': {'property': ['name', 'value']}}
+VCS_ROOT_FIELDS = {'vcs-root': ['id', 'name', 'vcsName', PROPERTY_FIELDS]}
+PROJECT_FEATURE_FIELDS = {'projectFeature': ['id', 'type', PROPERTY_FIELDS]}
+PROJECT_FIELDS = {'project': ['id', 'name', 'parentProjectId']}
+BUILD_TYPE_FIELDS = {'buildType': ['id', 'name', 'projectId', 'projectName']}
+DEPENDENCY_FIELDS = [
+    {'snapshot-dependencies': {'snapshot-dependency': [{'source-buildType': ['id']}]}},
+    {'artifact-dependencies': {'artifact-dependency': [{'source-buildType': ['id']}]}},
+]
+BUILD_TYPE_DEPENDENCY_FIELDS = {'buildType': ['id', 'name', 'projectId'] + DEPENDENCY_FIELDS}
+BUILD_FIELDS = {'build': ['id', 'buildTypeId', 'state', 'status', 'queuedDate', 'startDate', 'finishDate']}
+
+
+def build_locator(**dimensions: Any) -> str:
+    """Build a TeamCity locator expression, e.g. ``type:versionedSettings,count:100``
+
+    Nested dimensions are given as dicts and rendered in parentheses;
+    booleans are rendered the way TeamCity expects them.
+    """
+    parts = []
+    for name, value in dimensions.items():
+        if value is None:
+            continue
+        if isinstance(value, dict):
+            value = f"({build_locator(**value)})"
+        elif isinstance(value, bool):
+            value = 'true' if value else 'false'
+        parts.append(f"{name}:{value}")
+    return ','.join(parts)
+
+
+def build_fields(spec: Any) -> str:
+    """Build a TeamCity fields expression from a nested spec
+
+    ``{'vcs-root': ['id', 'name', {'properties': {'property': ['name', 'value']}}]}``
+    renders as ``vcs-root(id,name,properties(property(name,value)))``.
+    Plain strings are passed through unchanged.
+    """
+    if isinstance(spec, str):
+        return spec
+    if isinstance(spec, dict):
+        return ','.join(f"{name}({build_fields(sub)})" for name, sub in spec.items())
+    return ','.join(build_fields(item) for item in spec)
+
+
+def paged_locator(locator: Any, count: int, start: Optional[int] = None) -> str:
+    """Add count/start paging dimensions to a locator"""
+    if isinstance(locator, dict):
+        locator = build_locator(**locator)
+    paging = build_locator(count=count, start=start)
+    return f"{locator},{paging}" if locator else paging
+
+
+def paged_fields(fields: Any) -> Optional[str]:
+    """Make sure a field selection keeps the paging attributes of the collection"""
+    if not fields:
+        return None
+    return f"count,nextHref,{build_fields(fields)}"
+
+
+class RequestStats:
+    """Request count and payload bytes transferred by a client, plus the state of its server's governor"""
+
+    def __init__(self, governor: Optional[Governor] = None):
+        self.governor = governor
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.by_method: Dict[str, int] = {}
+
+    def record(self, method: str, response: requests.Response, received: Optional[int] = None):
+        body = response.request.body if response.request is not None else None
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += len(body) if body else 0
+            self.bytes_received += len(response.content) if received is None else received
+            self.by_method[method] = self.by_method.get(method, 0) + 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'by_method': dict(self.by_method),
+            'governor': self.governor.as_dict() if self.governor is not None else None,
+        }
+
+    def summary(self) -> str:
+        methods = ', '.join(f"{method} {count}" for method, count in sorted(self.by_method.items()))
+        governor = f"; governor {self.governor.summary()}" if self.governor is not None else ''
+        return (f"{self.requests} requests ({methods or 'none'}), "
+                f"{self.bytes_received / 1024:.1f} KB received, {self.bytes_sent / 1024:.1f} KB sent{governor}")
+
+
+class TeamCityAPI:
+    def __init__(self, url: str, token: str, cache: Optional[ResponseCache] = None,
+                 transport: Optional[Transport] = None):
+        self.url = url.rstrip('/')
+        self.token = token
+        self.cache = cache
+        # Connections, timeouts, retries and the circuit breaker are shared process-wide
+        self.transport = transport or shared_transport()
+
+        # Set up Basic authentication
+        auth_string = f":{token}"
+        auth_bytes = auth_string.encode('ascii')
+        auth_b64 = base64.b64encode(auth_bytes).decode('ascii')
+
+        self.headers = {
+            'Authorization': f'Basic {auth_b64}',
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+        # The governor is per server and shared, so its numbers cover every client talking to it
+        self.stats = RequestStats(self.transport.governor(urlsplit(self.url).netloc))
+        self.hooks: List[Callable[[RequestEvent], None]] = []
+
+    def add_hook(self, hook: Callable[[RequestEvent], None]):
+        """Call ``hook`` with a RequestEvent after every request, including ones that raised"""
+        self.hooks.append(hook)
+
+    def _emit(self, event: RequestEvent):
+        for hook in self.hooks:
+            hook(event)
+
+    def _request(self, method: str, endpoint: str, headers: Optional[Dict[str, str]] = None,
+                 **kwargs) -> requests.Response:
+        url = f"{self.url}/app/rest/{endpoint.lstrip('/')}"
+        started = time.time()
+        clock = time.perf_counter()
+        try:
+            response = self.transport.request(method, url, headers={**self.headers, **(headers or {})}, **kwargs)
+        except requests.RequestException as e:
+            if self.hooks:
+                self._emit(RequestEvent(method, url, endpoint, None, started, time.perf_counter() - clock,
+                                        retries=getattr(e, 'retries', 0), error=str(e)))
+            raise
+        # A streamed body is read later by the caller, so only its announced length is counted
+        if kwargs.get('stream'):
+            received = int(response.headers.get('Content-Length') or 0)
+        else:
+            received = len(response.content)
+        self.stats.record(method, response, received)
+        if self.hooks:
+            body = response.request.body if response.request is not None else None
+            self._emit(RequestEvent(method, url, endpoint, response.status_code, started,
+                                    time.perf_counter() - clock, len(body) if body else 0,
+                                    received, getattr(response, 'retries', 0)))
+        return response
+
+    def _write(self, method: str, endpoint: str, data: Any = None, **kwargs) -> requests.Response:
+        if isinstance(data, str):
+            # Single-value endpoints such as .../properties/<name> take plain text
+            kwargs['data'] = data.encode('utf-8')
+            kwargs['headers'] = {'Content-Type': 'text/plain', 'Accept': 'text/plain'}
+        elif data is not None:
+            kwargs['json'] = data
+        response = self._request(method, endpoint, **kwargs)
+        if self.cache is not None:
+            self.cache.invalidate(endpoint)
+        return response
+
+    def get(self, endpoint: str, max_age: Optional[float] = None,
+            timeout: Optional[Tuple[float, float]] = None) -> requests.Response:
+        """Make GET request to TeamCity API
+
+        With a cache attached, ``max_age=0`` forces revalidation with the server
+        (polling loops use it); otherwise the endpoint's TTL applies.
+        ``timeout`` is a (connect, read) pair overriding the transport defaults.
+        """
+        if self.cache is None:
+            return self._request('GET', endpoint, timeout=timeout)
+
+        entry = self.cache.lookup(endpoint)
+        if entry is not None and entry.is_fresh(max_age):
+            self.cache.record_hit()
+            return entry.response
+
+        headers = entry.validators() if entry is not None else {}
+        response = self._request('GET', endpoint, headers=headers, timeout=timeout)
+        if response.status_code == 304 and entry is not None:
+            self.cache.revalidated(endpoint, entry)
+            return entry.response
+
+        self.cache.record_miss()
+        if response.status_code == 200:
+            self.cache.store(endpoint, response)
+        return response
+
+    def stream(self, endpoint: str, headers: Optional[Dict[str, str]] = None,
+               timeout: Optional[Tuple[float, float]] = None) -> requests.Response:
+        """GET a raw (non-JSON) body without reading it, e.g. artifact content with a Range header
+
+        Bypasses the response cache. Read it with ``iter_content`` and close it: until
+        then it counts against the governor's concurrency limit.
+        """
+        return self._request('GET', endpoint, headers={'Accept': '*/*', **(headers or {})}, timeout=timeout,
+                             stream=True)
+
+    def post(self, endpoint: str, data: Union[Dict, str],
+             timeout: Optional[Tuple[float, float]] = None) -> requests.Response:
+        """Make POST request to TeamCity API (a str body is sent as text/plain)"""
+        return self._write('POST', endpoint, data, timeout=timeout)
+
+    def put(self, endpoint: str, data: Union[Dict, str],
+            timeout: Optional[Tuple[float, float]] = None) -> requests.Response:
+        """Make PUT request to TeamCity API (a str body is sent as text/plain)"""
+        return self._write('PUT', endpoint, data, timeout=timeout)
+
+    def delete(self, endpoint: str, timeout: Optional[Tuple[float, float]] = None) -> requests.Response:
+        """Make DELETE request to TeamCity API"""
+        return self._write('DELETE', endpoint, timeout=timeout)
+
+    @staticmethod
+    def query_endpoint(endpoint: str, locator: Any = None, fields: Any = None) -> str:
+        """Append locator= and fields= expressions to an endpoint"""
+        params = []
+        if locator:
+            if isinstance(locator, dict):
+                locator = build_locator(**locator)
+            params.append(f"locator={quote(locator, safe='(),:$')}")
+        if fields:
+            params.append(f"fields={quote(build_fields(fields), safe='(),:$')}")
+        if not params:
+            return endpoint
+        separator = '&' if '?' in endpoint else '?'
+        return f"{endpoint}{separator}{'&'.join(params)}"
+
+    def query(self, endpoint: str, locator: Any = None, fields: Any = None,
+              max_age: Optional[float] = None) -> requests.Response:
+        """GET an endpoint restricted by a locator and narrowed to the selected fields"""
+        return self.get(self.query_endpoint(endpoint, locator, fields), max_age)
+
+    def query_items(self, endpoint: str, item_key: str, locator: Any = None,
+                    fields: Any = None) -> Optional[List[Dict]]:
+        """Return the items of a collection query, or None if the request failed"""
+        response = self.query(endpoint, locator, fields)
+        if response.status_code != 200:
+            return None
+        return response.json().get(item_key, [])
+
+    def _next_page_endpoint(self, next_href: Optional[str], fields: Any) -> Optional[str]:
+        """Turn a nextHref into an endpoint relative to /app/rest"""
+        if not next_href:
+            return None
+        endpoint = next_href.split('/app/rest/', 1)[-1]
+        if fields and 'fields=' not in endpoint:
+            endpoint = f"{endpoint}&fields={quote(paged_fields(fields), safe='(),:$')}"
+        return endpoint
+
+    def iter_collection(self, endpoint: str, item_key: str, locator: Any = None, fields: Any = None,
+                        page_size: int = DEFAULT_PAGE_SIZE, max_age: Optional[float] = None) -> Iterator[Dict]:
+        """Yield the items of a collection one at a time, following nextHref between pages
+
+        Only the current page is held in memory, and closing the generator
+        stops paging. Raises requests.HTTPError if a page cannot be fetched.
+        """
+        next_endpoint = self.query_endpoint(endpoint, paged_locator(locator, page_size), paged_fields(fields))
+        while next_endpoint:
+            response = self.get(next_endpoint, max_age)
+            response.raise_for_status()
+            page = response.json()
+            next_endpoint = self._next_page_endpoint(page.get('nextHref'), fields)
+            yield from page.get(item_key, [])
+
+    def iter_projects(self, locator: Any = None, fields: Any = PROJECT_FIELDS,
+                      page_size: int = DEFAULT_PAGE_SIZE, max_age: Optional[float] = None) -> Iterator[Dict]:
+        """Yield projects page by page"""
+        return self.iter_collection('projects', 'project', locator, fields, page_size, max_age)
+
+    def iter_build_types(self, locator: Any = None, fields: Any = BUILD_TYPE_FIELDS,
+                         page_size: int = DEFAULT_PAGE_SIZE, max_age: Optional[float] = None) -> Iterator[Dict]:
+        """Yield build configurations page by page"""
+        return self.iter_collection('buildTypes', 'buildType', locator, fields, page_size, max_age)
+
+    def iter_builds(self, locator: Any = None, fields: Any = BUILD_FIELDS,
+                    page_size: int = DEFAULT_PAGE_SIZE, max_age: Optional[float] = None) -> Iterator[Dict]:
+        """Yield builds page by page, newest first"""
+        return self.iter_collection('builds', 'build', locator, fields, page_size, max_age)
+
+    def iter_vcs_roots(self, locator: Any = None, fields: Any = VCS_ROOT_FIELDS,
+                       page_size: int = DEFAULT_PAGE_SIZE, max_age: Optional[float] = None) -> Iterator[Dict]:
+        """Yield VCS roots page by page"""
+        return self.iter_collection('vcs-roots', 'vcs-root', locator, fields, page_size, max_age)
+
+
+class AsyncTeamCityAPI:
+    """asyncio client with the same surface as TeamCityAPI.
+
+    Requests are executed through the wrapped client's transport from a worker
+    pool, and at most ``concurrency`` of them are in flight at any time, so
+    fanning out N lookups costs roughly the latency of the slowest one.
+    """
+
+    def __init__(self, api: TeamCityAPI, concurrency: int = DEFAULT_CONCURRENCY):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.api = api
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='teamcity-api')
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # Size the connection pool so concurrent requests don't wait for a free socket
+        self.api.transport.ensure_pool_size(concurrency)
+
+    def _limiter(self) -> asyncio.Semaphore:
+        """Return the semaphore bound to the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def _call(self, method, *args) -> requests.Response:
+        async with self._limiter():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(method, *args))
+
+    async def get(self, endpoint: str) -> requests.Response:
+        """Make GET request to TeamCity API"""
+        return await self._call(self.api.get, endpoint)
+
+    async def post(self, endpoint: str, data: Union[Dict, str]) -> requests.Response:
+        """Make POST request to TeamCity API"""
+        return await self._call(self.api.post, endpoint, data)
+
+    async def put(self, endpoint: str, data: Union[Dict, str]) -> requests.Response:
+        """Make PUT request to TeamCity API"""
+        return await self._call(self.api.put, endpoint, data)
+
+    async def delete(self, endpoint: str) -> requests.Response:
+        """Make DELETE request to TeamCity API"""
+        return await self._call(self.api.delete, endpoint)
+
+    async def get_many(self, endpoints: List[str]) -> List[requests.Response]:
+        """GET several endpoints concurrently, returning responses in input order"""
+        return list(await asyncio.gather(*(self.get(endpoint) for endpoint in endpoints)))
+
+    def fetch_all(self, endpoints: List[str]) -> List[requests.Response]:
+        """Blocking wrapper around get_many for synchronous callers"""
+        if not endpoints:
+            return []
+        return asyncio.run(self.get_many(endpoints))
+
+    def iter_collection(self, endpoint: str, item_key: str, locator: Any = None, fields: Any = None,
+                        page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[Dict]:
+        """Yield the items of a collection in order, fetching several pages at once
+
+        Pages are addressed by start offset so a window of them can be requested
+        concurrently. The window starts at one page and doubles up to the
+        concurrency limit, so small collections still cost a single request.
+        Paging stops at the first page without a nextHref.
+        """
+        start, window = 0, 1
+        while True:
+            endpoints = [
+                self.api.query_endpoint(endpoint, paged_locator(locator, page_size, start + i * page_size),
+                                        paged_fields(fields))
+                for i in range(window)
+            ]
+            for response in self.fetch_all(endpoints):
+                response.raise_for_status()
+                page = response.json()
+                yield from page.get(item_key, [])
+                if not page.get('nextHref'):
+                    return
+            start += window * page_size
+            window = min(window * 2, self.concurrency)
+
+    def close(self):
+        """Shut down the worker pool"""
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,562 @@
+"""
+TeamCity Build Artifacts
+Artifact listing, parallel resumable range downloads and single-member extraction from remote zips
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import quote
+
+import requests
+
+from teamcity_api import TeamCityAPI
+
+DEFAULT_PARALLEL = 4
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+STREAM_CHUNK = 256 * 1024
+ARTIFACT_FIELDS = {'file': ['name', 'size', 'modificationTime', {'children': ['href']}]}
+
+# The end-of-central-directory record is 22 bytes plus a comment of up to 64 KiB; the first
+# read of an archive takes a smaller tail, which usually holds the whole central directory too
+ZIP_TAIL = 22 + 65535
+ZIP_FIRST_TAIL = 16 * 1024
+EOCD = struct.Struct('<4sHHHHIIH')
+ZIP64_LOCATOR = struct.Struct('<4sIQI')
+ZIP64_EOCD = struct.Struct('<4sQHHIIQQQQ')
+CENTRAL_HEADER = struct.Struct('<4sHHHHHHIIIHHHHHII')
+LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+# Slack requested past a member's data in case its local extra field is longer than the central one
+LOCAL_EXTRA_SLACK = 1024
+
+
+class ArtifactError(Exception):
+    """An artifact could not be downloaded, or the bytes on disk failed verification"""
+
+
+class Artifact:
+    __slots__ = ('path', 'size', 'modified', 'is_dir')
+
+    def __init__(self, path: str, size: Optional[int], modified: Optional[str], is_dir: bool):
+        self.path = path
+        self.size = size
+        self.modified = modified
+        self.is_dir = is_dir
+
+
+def artifact_endpoint(build_id: int, kind: str, path: str = '') -> str:
+    """``builds/id:N/artifacts/<kind>/<path>``; ``!/`` inside a path addresses an archive member"""
+    return f"builds/id:{build_id}/artifacts/{kind}/{quote(path, safe='/!')}".rstrip('/')
+
+
+def list_artifacts(api: TeamCityAPI, build_id: int, path: str = '', recursive: bool = True) -> List[Artifact]:
+    """Files (and, unless recursive, directories) under ``path`` of a build's artifacts
+
+    Archives are listed as files; their members are not expanded.
+    Raises requests.HTTPError if the build or path does not exist.
+    """
+    response = api.query(artifact_endpoint(build_id, 'children', path), fields=ARTIFACT_FIELDS)
+    response.raise_for_status()
+    artifacts = []
+    for item in response.json().get('file', []):
+        full_path = f"{path}/{item['name']}" if path else item['name']
+        if 'size' not in item:
+            if recursive:
+                artifacts.extend(list_artifacts(api, build_id, full_path))
+            else:
+                artifacts.append(Artifact(full_path, None, item.get('modificationTime'), True))
+        else:
+            artifacts.append(Artifact(full_path, int(item['size']), item.get('modificationTime'), False))
+    return artifacts
+
+
+def match_artifacts(artifacts: List[Artifact], pattern: str) -> List[Artifact]:
+    """Artifacts whose path matches a glob, or lie under it when it names a directory"""
+    prefix = pattern.rstrip('/') + '/'
+    return [artifact for artifact in artifacts
+            if fnmatch.fnmatchcase(artifact.path, pattern) or artifact.path.startswith(prefix)]
+
+
+class DownloadResult:
+    def __init__(self, name: str, dest: Path, size: int, transferred: int, elapsed: float, parts: int = 1,
+                 resumed: int = 0, sha256: Optional[str] = None, verified: Optional[str] = None):
+        self.name = name
+        self.dest = dest
+        self.size = size
+        self.transferred = transferred
+        self.elapsed = elapsed
+        self.parts = parts
+        self.resumed = resumed
+        self.sha256 = sha256
+        # How the content was checked: 'sha256', 'crc32', 'size' or None
+        self.verified = verified
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.transferred / 1024 / 1024 / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self) -> Dict:
+        return {'name': self.name, 'dest': str(self.dest), 'size': self.size, 'transferred': self.transferred,
+                'seconds': round(self.elapsed, 3), 'mb_per_second': round(self.mb_per_second, 2),
+                'parts': self.parts, 'resumed': self.resumed, 'sha256': self.sha256, 'verified': self.verified}
+
+
+def artifact_identity(build_id: int, artifact: Artifact) -> Dict:
+    """What a file on disk must have come from to stand in for ``artifact``"""
+    return {'build_id': build_id, 'path': artifact.path, 'size': artifact.size, 'modified': artifact.modified}
+
+
+class CompletedDownload:
+    """A hidden ``.<name>.artifact.json`` next to a finished file, naming the build artifact it holds"""
+
+    def __init__(self, dest: Path):
+        self.record = dest.with_name(f".{dest.name}.artifact.json")
+
+    def identity(self) -> Optional[Dict]:
+        try:
+            with open(self.record) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def discard(self):
+        try:
+            self.record.unlink()
+        except FileNotFoundError:
+            pass
+
+    def save(self, identity: Dict):
+        tmp = self.record.with_name(self.record.name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(identity, f)
+        os.replace(tmp, self.record)
+
+
+class PartialDownload:
+    """A ``.part`` file and a record of which of its fixed-size parts are complete
+
+    The record also keeps the artifact's build, size and timestamp, so a
+    partial file left from a different artifact is started over rather
+    than mixed in.
+    """
+
+    def __init__(self, dest: Path, identity: Dict, part_size: int):
+        self.part = dest.with_name(dest.name + '.part')
+        self.record = dest.with_name(dest.name + '.part.json')
+        self.identity = dict(identity, part_size=part_size)
+        self.done: Set[int] = set()
+        self._lock = threading.Lock()
+        try:
+            with open(self.record) as f:
+                data = json.load(f)
+            if data.get('identity') == self.identity and self.part.stat().st_size == identity['size']:
+                self.done = set(data.get('done', []))
+        except (OSError, ValueError):
+            pass
+
+    def open(self) -> int:
+        """File descriptor of the .part file, created at full size so parts can be written anywhere"""
+        fd = os.open(self.part, os.O_RDWR | os.O_CREAT, 0o644)
+        if not self.done:
+            os.ftruncate(fd, self.identity['size'])
+        return fd
+
+    def mark(self, index: int):
+        with self._lock:
+            self.done.add(index)
+            tmp = self.record.with_name(self.record.name + '.tmp')
+            with open(tmp, 'w') as f:
+                json.dump({'identity': self.identity, 'done': sorted(self.done)}, f)
+            os.replace(tmp, self.record)
+
+    def finish(self, dest: Path):
+        os.replace(self.part, dest)
+        self.discard_record()
+
+    def discard_record(self):
+        try:
+            self.record.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ArtifactDownloader:
+    """Downloads build artifacts straight to disk
+
+    Files larger than ``part_size`` are fetched as parallel Range requests
+    written in place with pwrite, and every finished part is recorded so an
+    interrupted download resumes where it stopped. Servers that ignore Range
+    get a single sequential stream instead. Nothing is held in memory beyond
+    one chunk per worker.
+    """
+
+    def __init__(self, api: TeamCityAPI, parallel: int = DEFAULT_PARALLEL, part_size: int = DEFAULT_PART_SIZE):
+        if parallel < 1:
+            raise ValueError("parallel must be at least 1")
+        self.api = api
+        self.parallel = parallel
+        self.part_size = part_size
+        self.api.transport.ensure_pool_size(parallel)
+
+    # --- plumbing ----------------------------------------------------------
+
+    def _open(self, endpoint: str, byte_range: Optional[str] = None) -> requests.Response:
+        """Streamed GET of the content, or of ``byte_range`` ('0-99', '100-', '-22') when the server honours it"""
+        response = self.api.stream(endpoint, {'Range': f"bytes={byte_range}"} if byte_range else None)
+        if response.status_code not in (200, 206):
+            response.close()
+            raise ArtifactError(f"GET {endpoint}: HTTP {response.status_code}")
+        start = byte_range.split('-')[0] if byte_range else ''
+        if start and response.status_code == 206:
+            content_range = response.headers.get('Content-Range', '')
+            if not content_range.startswith(f"bytes {start}-"):
+                response.close()
+                raise ArtifactError(f"GET {endpoint}: asked for bytes {byte_range} but got '{content_range}'")
+        return response
+
+    @staticmethod
+    def _total_size(response: requests.Response) -> Optional[int]:
+        """Full size of the content from a 206's Content-Range, None for a 200"""
+        match = re.search(r'/(\d+)$', response.headers.get('Content-Range', ''))
+        return int(match.group(1)) if response.status_code == 206 and match else None
+
+    def probe(self, endpoint: str) -> Tuple[int, bool]:
+        """Size of the content and whether the server honours Range, from a one-byte request"""
+        response = self._open(endpoint, '0-0')
+        try:
+            size = self._total_size(response)
+            if size is not None:
+                return size, True
+            return int(response.headers.get('Content-Length') or 0), False
+        finally:
+            response.close()
+
+    def _fetch(self, endpoint: str, start: int, end: int) -> bytes:
+        """A small byte range read into memory (zip directory records)"""
+        response = self._open(endpoint, f"{start}-{end}")
+        try:
+            if response.status_code != 206:
+                raise ArtifactError(f"GET {endpoint}: server ignored the Range header")
+            return response.content
+        finally:
+            response.close()
+
+    # --- whole files -------------------------------------------------------
+
+    def download(self, build_id: int, artifact: Artifact, dest: Path,
+                 expected_sha256: Optional[str] = None) -> DownloadResult:
+        """Download one artifact to ``dest``, resuming a previous partial download of it
+
+        The size is always checked; with ``expected_sha256`` the content is
+        hashed from disk and compared. Raises ArtifactError on failure,
+        leaving the completed parts in place for the next attempt. An
+        existing ``dest`` is kept only if it was downloaded from this very
+        artifact, or its content matches ``expected_sha256``.
+        """
+        endpoint = artifact_endpoint(build_id, 'content', artifact.path)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        started = time.perf_counter()
+        identity = artifact_identity(build_id, artifact)
+        completed = CompletedDownload(dest)
+        if dest.exists() and dest.stat().st_size == artifact.size and \
+                not dest.with_name(dest.name + '.part').exists() and \
+                (expected_sha256 or completed.identity() == identity):
+            # Artifacts of a build never change, so a complete copy of this one is kept
+            try:
+                result = self._verified(DownloadResult(artifact.path, dest, artifact.size, 0, 0.0, 0,
+                                                       artifact.size), expected_sha256)
+            except ArtifactError:
+                pass  # different content: download it again
+            else:
+                completed.save(identity)
+                return result
+
+        size, ranges = self.probe(endpoint)
+        partial = PartialDownload(dest, dict(identity, size=size), self.part_size)
+        if ranges and size > self.part_size:
+            transferred, parts, resumed = self._download_parts(endpoint, partial, size)
+        else:
+            partial.done = set()
+            transferred, parts, resumed = self._download_stream(endpoint, partial), 1, 0
+        if partial.part.stat().st_size != size:
+            raise ArtifactError(f"expected {size} bytes, got {partial.part.stat().st_size}")
+        result = DownloadResult(artifact.path, dest, size, transferred, time.perf_counter() - started, parts, resumed)
+        try:
+            self._verified(result, expected_sha256, partial.part)
+        except ArtifactError:
+            partial.part.unlink()
+            partial.discard_record()
+            raise
+        # Dropped first, so a crash in between cannot leave the old record describing the new file
+        completed.discard()
+        partial.finish(dest)
+        completed.save(identity)
+        return result
+
+    def _verified(self, result: DownloadResult, expected_sha256: Optional[str],
+                  path: Optional[Path] = None) -> DownloadResult:
+        result.verified = 'size'
+        if expected_sha256:
+            result.sha256 = file_sha256(path or result.dest)
+            if result.sha256 != expected_sha256.lower():
+                raise ArtifactError(f"sha256 {result.sha256} does not match {expected_sha256}")
+            result.verified = 'sha256'
+        return result
+
+    def _download_stream(self, endpoint: str, partial: PartialDownload) -> int:
+        transferred = 0
+        response = self._open(endpoint)
+        try:
+            with open(partial.part, 'wb') as f:
+                for chunk in response.iter_content(STREAM_CHUNK):
+                    f.write(chunk)
+                    transferred += len(chunk)
+        finally:
+            response.close()
+        return transferred
+
+    def _download_parts(self, endpoint: str, partial: PartialDownload, size: int) -> Tuple[int, int, int]:
+        count = (size + self.part_size - 1) // self.part_size
+        pending = [index for index in range(count) if index not in partial.done]
+        resumed = sum(min(self.part_size, size - index * self.part_size) for index in partial.done)
+        fd = partial.open()
+        transferred = [0]
+        lock = threading.Lock()
+
+        def fetch(index: int):
+            start = index * self.part_size
+            end = min(size, start + self.part_size) - 1
+            offset = start
+            response = self._open(endpoint, f"{start}-{end}")
+            try:
+                if response.status_code != 206:
+                    raise ArtifactError(f"GET {endpoint}: server stopped honouring Range")
+                for chunk in response.iter_content(STREAM_CHUNK):
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+                    with lock:
+                        transferred[0] += len(chunk)
+            finally:
+                response.close()
+            if offset != end + 1:
+                raise ArtifactError(f"GET {endpoint}: part {index} ended at byte {offset} instead of {end + 1}")
+            partial.mark(index)
+
+        pool = ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix='teamcity-artifact')
+        try:
+            futures = [pool.submit(fetch, index) for index in pending]
+            errors = [future.exception() for future in futures if future.exception() is not None]
+        finally:
+            # On an interrupt the parts in flight still complete and are recorded; the rest are dropped
+            pool.shutdown(wait=True, cancel_futures=True)
+            os.close(fd)
+        if errors:
+            raise ArtifactError(f"{len(errors)} of {len(pending)} parts failed, first: {errors[0]}")
+        return transferred[0], len(pending), resumed
+
+    # --- archive members ---------------------------------------------------
+
+    def extract_member(self, build_id: int, archive: str, member: str, dest: Path) -> DownloadResult:
+        """Extract one file from a zip artifact, e.g. ``index.html`` from ``coverage.zip``
+
+        With Range support only the zip's central directory and the member's
+        own compressed bytes are transferred, and the CRC-32 from the
+        directory is checked. Otherwise the server extracts the member
+        itself (``coverage.zip!/index.html``), checked by size only.
+        """
+        endpoint = artifact_endpoint(build_id, 'content', archive)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        started = time.perf_counter()
+        part = dest.with_name(dest.name + '.part')
+        # The archive's tail doubles as the range probe: a 200 means the server will not seek for us
+        response = self._open(endpoint, f"-{ZIP_FIRST_TAIL}")
+        try:
+            size = self._total_size(response)
+            tail = response.content if size is not None else None
+        finally:
+            response.close()
+        if tail is None:
+            inner = artifact_endpoint(build_id, 'content', f"{archive}!/{member}")
+            response = self._open(inner)
+            transferred = 0
+            try:
+                with open(part, 'wb') as f:
+                    for chunk in response.iter_content(STREAM_CHUNK):
+                        f.write(chunk)
+                        transferred += len(chunk)
+            finally:
+                response.close()
+            expected = int(response.headers.get('Content-Length') or transferred)
+            if transferred != expected:
+                raise ArtifactError(f"expected {expected} bytes, got {transferred}")
+            os.replace(part, dest)
+            return DownloadResult(f"{archive}!{member}", dest, transferred, transferred,
+                                  time.perf_counter() - started, verified='size')
+
+        directory, directory_bytes = self._central_directory(endpoint, size, tail)
+        entry = directory.get(member)
+        if entry is None:
+            raise ArtifactError(f"no member '{member}' in {archive}")
+        method, crc, compressed, uncompressed, offset, name_length, extra_length, flags = entry
+        if flags & 0x1:
+            raise ArtifactError("member is encrypted")
+        if method not in (0, 8):
+            raise ArtifactError(f"member uses unsupported compression method {method}")
+
+        transferred, actual_crc, written = self._stream_member(
+            endpoint, size, offset, name_length + extra_length, compressed, method, part)
+        if written != uncompressed or actual_crc != crc:
+            part.unlink()
+            raise ArtifactError(f"CRC-32 {actual_crc:08x}/{written} bytes, "
+                                f"expected {crc:08x}/{uncompressed}")
+        os.replace(part, dest)
+        return DownloadResult(f"{archive}!{member}", dest, written, transferred + directory_bytes,
+                              time.perf_counter() - started, verified='crc32')
+
+    def _central_directory(self, endpoint: str, size: int, tail: bytes) -> Tuple[Dict[str, Tuple], int]:
+        """Parse the zip central directory: name -> (method, crc, csize, usize, offset, name len, extra len, flags)
+
+        ``tail`` is the end of the archive as already read; more is fetched
+        when the directory (or a long archive comment) lies before it.
+        Returns the directory and the number of bytes read, tail included.
+        """
+        transferred = len(tail)
+        position = tail.rfind(b'PK\x05\x06')
+        if position < 0 and len(tail) < min(size, ZIP_TAIL):
+            tail = self._fetch(endpoint, max(0, size - ZIP_TAIL), size - 1)
+            transferred += len(tail)
+            position = tail.rfind(b'PK\x05\x06')
+        tail_start = size - len(tail)
+        if position < 0 or position + EOCD.size > len(tail):
+            raise ArtifactError(f"{endpoint}: not a zip archive")
+        _, _, _, _, entries, directory_size, directory_offset, _ = EOCD.unpack_from(tail, position)
+
+        if 0xFFFFFFFF in (directory_size, directory_offset) or entries == 0xFFFF:
+            locator = position - ZIP64_LOCATOR.size
+            signature, _, record_offset, _ = ZIP64_LOCATOR.unpack_from(tail, locator)
+            if signature != b'PK\x06\x07':
+                raise ArtifactError(f"{endpoint}: damaged zip64 archive")
+            if record_offset >= tail_start:
+                record = tail[record_offset - tail_start:record_offset - tail_start + ZIP64_EOCD.size]
+            else:
+                record = self._fetch(endpoint, record_offset, record_offset + ZIP64_EOCD.size - 1)
+                transferred += len(record)
+            directory_size, directory_offset = ZIP64_EOCD.unpack(record)[8:10]
+
+        if directory_offset >= tail_start:
+            data = tail[directory_offset - tail_start:directory_offset - tail_start + directory_size]
+        else:
+            data = self._fetch(endpoint, directory_offset, directory_offset + directory_size - 1)
+            transferred += len(data)
+
+        directory = {}
+        position = 0
+        while position + CENTRAL_HEADER.size <= len(data):
+            fields = CENTRAL_HEADER.unpack_from(data, position)
+            if fields[0] != b'PK\x01\x02':
+                break
+            flags, method, crc, compressed, uncompressed = fields[3], fields[4], fields[7], fields[8], fields[9]
+            name_length, extra_length, comment_length, offset = fields[10], fields[11], fields[12], fields[16]
+            name_start = position + CENTRAL_HEADER.size
+            raw_name = data[name_start:name_start + name_length]
+            name = raw_name.decode('utf-8' if flags & 0x800 else 'cp437')
+            extra = data[name_start + name_length:name_start + name_length + extra_length]
+            uncompressed, compressed, offset = self._zip64_sizes(extra, uncompressed, compressed, offset)
+            directory[name] = (method, crc, compressed, uncompressed, offset, name_length, extra_length, flags)
+            position = name_start + name_length + extra_length + comment_length
+        return directory, transferred
+
+    @staticmethod
+    def _zip64_sizes(extra: bytes, uncompressed: int, compressed: int, offset: int) -> Tuple[int, int, int]:
+        """Replace 0xFFFFFFFF placeholders with the values from a zip64 extra field"""
+        position = 0
+        while position + 4 <= len(extra):
+            header_id, length = struct.unpack_from('<HH', extra, position)
+            if header_id == 0x0001:
+                values = iter(struct.unpack_from(f'<{length // 8}Q', extra, position + 4))
+                if uncompressed == 0xFFFFFFFF:
+                    uncompressed = next(values)
+                if compressed == 0xFFFFFFFF:
+                    compressed = next(values)
+                if offset == 0xFFFFFFFF:
+                    offset = next(values)
+                break
+            position += 4 + length
+        return uncompressed, compressed, offset
+
+    def _stream_member(self, endpoint: str, size: int, offset: int, header_guess: int, compressed: int,
+                       method: int, part: Path) -> Tuple[int, int, int]:
+        """Stream a member's local header and data in one ranged request, inflating to ``part``
+
+        Returns (bytes transferred, CRC-32 of the output, bytes written).
+        """
+        end = min(size - 1, offset + LOCAL_HEADER.size + header_guess + LOCAL_EXTRA_SLACK + compressed)
+        response = self._open(endpoint, f"{offset}-{end}")
+        transferred = 0
+        try:
+            chunks = response.iter_content(STREAM_CHUNK)
+            buffer = b''
+            while len(buffer) < LOCAL_HEADER.size:
+                chunk = next(chunks, b'')
+                if not chunk:
+                    raise ArtifactError(f"{endpoint}: truncated local header at {offset}")
+                buffer += chunk
+            header = LOCAL_HEADER.unpack_from(buffer)
+            if header[0] != b'PK\x03\x04':
+                raise ArtifactError(f"{endpoint}: no local header at {offset}")
+            data_start = LOCAL_HEADER.size + header[9] + header[10]
+            if offset + data_start + compressed - 1 > end:
+                # The local extra field is longer than the slack; fetch the data on its own
+                transferred += len(buffer)
+                response.close()
+                response = self._open(endpoint, f"{offset + data_start}-{offset + data_start + compressed - 1}")
+                chunks, buffer = response.iter_content(STREAM_CHUNK), b''
+            else:
+                while len(buffer) < data_start:
+                    chunk = next(chunks, b'')
+                    if not chunk:
+                        raise ArtifactError(f"{endpoint}: truncated local header at {offset}")
+                    buffer += chunk
+                transferred += data_start
+                buffer = buffer[data_start:]
+
+            inflater = zlib.decompressobj(-zlib.MAX_WBITS) if method == 8 else None
+            crc, written, remaining = 0, 0, compressed
+            with open(part, 'wb') as f:
+                while remaining > 0:
+                    if not buffer:
+                        buffer = next(chunks, b'')
+                        if not buffer:
+                            raise ArtifactError(f"{endpoint}: member data ended {remaining} bytes early")
+                    piece, buffer = buffer[:remaining], buffer[remaining:]
+                    remaining -= len(piece)
+                    transferred += len(piece)
+                    output = inflater.decompress(piece) if inflater else piece
+                    crc = zlib.crc32(output, crc)
+                    written += len(output)
+                    f.write(output)
+                if inflater:
+                    output = inflater.flush()
+                    crc = zlib.crc32(output, crc)
+                    written += len(output)
+                    f.write(output)
+        finally:
+            response.close()
+        return transferred, crc, written
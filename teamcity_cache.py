@@ -0,0 +1,174 @@
+"""
+TeamCity REST Response Cache
+Opt-in conditional-request cache for TeamCityAPI GET responses
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+import requests
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL = 15.0
+
+# Seconds a cached response is served without contacting the server, by endpoint prefix
+DEFAULT_TTLS = {
+    'server': 300.0,
+    'vcs-roots': 60.0,
+    'projects': 30.0,
+    'buildTypes': 30.0,
+}
+
+# Writes to one collection can change what another one returns
+RELATED_COLLECTIONS = {
+    'vcs-roots': {'vcs-roots', 'projects'},
+    'projects': {'projects', 'buildTypes', 'vcs-roots'},
+    'buildTypes': {'buildTypes', 'projects'},
+}
+
+
+def endpoint_path(endpoint: str) -> str:
+    """Strip the query string and leading slash from an endpoint"""
+    return endpoint.lstrip('/').split('?', 1)[0]
+
+
+def endpoint_collection(endpoint: str) -> str:
+    """Return the top-level collection an endpoint belongs to, e.g. ``projects``"""
+    return endpoint_path(endpoint).split('/', 1)[0]
+
+
+class CacheEntry:
+    __slots__ = ('response', 'etag', 'last_modified', 'expires_at')
+
+    def __init__(self, response: requests.Response, ttl: float):
+        self.response = response
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        self.expires_at = time.monotonic() + ttl
+
+    def is_fresh(self, max_age: Optional[float] = None) -> bool:
+        if max_age is not None and max_age <= 0:
+            return False
+        return time.monotonic() < self.expires_at
+
+    def validators(self) -> Dict[str, str]:
+        """Conditional request headers for revalidating this entry"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+    def summary(self) -> str:
+        lookups = self.hits + self.revalidated + self.misses
+        hit_rate = (self.hits / lookups * 100) if lookups else 0.0
+        return (f"{self.hits} hits ({hit_rate:.0f}%), {self.revalidated} revalidated, "
+                f"{self.misses} misses, {self.evictions} evicted, {self.invalidations} invalidated - "
+                f"{self.hits} round trips saved")
+
+
+class ResponseCache:
+    """LRU cache of GET responses keyed by endpoint, including its locator and fields
+
+    Fresh entries are served without a request. Expired entries are
+    revalidated with If-None-Match/If-Modified-Since when the server sent
+    validators, so an unchanged resource costs a 304 instead of a full body.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, default_ttl: float = DEFAULT_TTL,
+                 ttls: Optional[Dict[str, float]] = None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.stats = CacheStats()
+        self._entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(endpoint: str) -> str:
+        return endpoint.lstrip('/')
+
+    def ttl_for(self, endpoint: str) -> float:
+        """TTL of the longest configured prefix matching the endpoint path"""
+        path = endpoint_path(endpoint)
+        best = None
+        for prefix in self.ttls:
+            if path.startswith(prefix) and (best is None or len(prefix) > len(best)):
+                best = prefix
+        return self.ttls[best] if best is not None else self.default_ttl
+
+    def lookup(self, endpoint: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(self.key(endpoint))
+            if entry is not None:
+                self._entries.move_to_end(self.key(endpoint))
+            return entry
+
+    def record_hit(self):
+        with self._lock:
+            self.stats.hits += 1
+
+    def record_miss(self):
+        with self._lock:
+            self.stats.misses += 1
+
+    def store(self, endpoint: str, response: requests.Response):
+        ttl = self.ttl_for(endpoint)
+        if ttl <= 0:
+            return
+        key = self.key(endpoint)
+        with self._lock:
+            self._entries[key] = CacheEntry(response, ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def revalidated(self, endpoint: str, entry: CacheEntry):
+        """Extend an entry after the server answered 304 Not Modified"""
+        with self._lock:
+            entry.expires_at = time.monotonic() + self.ttl_for(endpoint)
+            self.stats.revalidated += 1
+
+    def invalidate(self, endpoint: str):
+        """Drop every entry a write to ``endpoint`` may have changed"""
+        path = endpoint_path(endpoint)
+        with self._lock:
+            if 'versionedSettings' in path.split('/'):
+                # A settings sync can change anything on the server
+                stale = list(self._entries)
+            else:
+                collections: Set[str] = RELATED_COLLECTIONS.get(endpoint_collection(path),
+                                                                {endpoint_collection(path)})
+                stale = [key for key in self._entries if endpoint_collection(key) in collections]
+            for key in stale:
+                del self._entries[key]
+            self.stats.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
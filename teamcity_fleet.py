@@ -0,0 +1,163 @@
+"""
+TeamCity Fleet Deployment
+Runs a deployment job against every server in an inventory file in parallel
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+DEFAULT_MAX_PARALLEL = 4
+
+
+class FleetTarget:
+    def __init__(self, name: str, url: str, token: str, options: Optional[Dict] = None):
+        self.name = name
+        self.url = url
+        self.token = token
+        self.options = options or {}
+
+
+class TargetResult:
+    def __init__(self, target: FleetTarget, success: bool, duration: float, error: Optional[str] = None):
+        self.target = target
+        self.success = success
+        self.duration = duration
+        self.error = error
+
+
+def load_inventory(path: Path) -> List[FleetTarget]:
+    """Read a JSON inventory of TeamCity servers
+
+    Each entry under ``targets`` needs a ``name`` and ``url`` plus either a
+    literal ``token`` or a ``token_env`` naming the environment variable that
+    holds it; any other keys are passed to the job as options::
+
+        {"targets": [{"name": "prod", "url": "https://teamcity.devinfra.ru",
+                      "token_env": "TEAMCITY_PROD_TOKEN"}]}
+
+    Raises ValueError for malformed entries or missing tokens.
+    """
+    with open(path) as f:
+        inventory = json.load(f)
+
+    targets = []
+    for index, entry in enumerate(inventory.get('targets', [])):
+        name = entry.get('name') or f"target-{index + 1}"
+        if 'url' not in entry:
+            raise ValueError(f"inventory target '{name}' has no url")
+        token = entry.get('token')
+        if not token and entry.get('token_env'):
+            token = os.getenv(entry['token_env'])
+        if not token:
+            raise ValueError(f"inventory target '{name}' has no token (set token or token_env)")
+        options = {k: v for k, v in entry.items() if k not in ('name', 'url', 'token', 'token_env')}
+        targets.append(FleetTarget(name, entry['url'], token, options))
+
+    names = [t.name for t in targets]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError(f"duplicate inventory target names: {', '.join(duplicates)}")
+    return targets
+
+
+class PrefixedOutput:
+    """sys.stdout replacement that tags each line with the name of the target printing it
+
+    Worker threads register a prefix; output is buffered per thread until a
+    newline so lines from concurrent targets never interleave mid-line.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def set_prefix(self, prefix: Optional[str]):
+        self.flush()
+        self._local.prefix = prefix
+        self._local.buffer = ''
+
+    def write(self, text: str) -> int:
+        prefix = getattr(self._local, 'prefix', None)
+        if prefix is None:
+            with self._lock:
+                return self.stream.write(text)
+        self._local.buffer = getattr(self._local, 'buffer', '') + text
+        *lines, self._local.buffer = self._local.buffer.split('\n')
+        if lines:
+            with self._lock:
+                for line in lines:
+                    self.stream.write(f"[{prefix}] {line}\n")
+                self.stream.flush()
+        return len(text)
+
+    def flush(self):
+        prefix = getattr(self._local, 'prefix', None)
+        buffered = getattr(self._local, 'buffer', '')
+        with self._lock:
+            if prefix is not None and buffered:
+                self.stream.write(f"[{prefix}] {buffered}\n")
+                self._local.buffer = ''
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def run_fleet(targets: List[FleetTarget], job: Callable[[FleetTarget], bool],
+              max_parallel: int = DEFAULT_MAX_PARALLEL) -> List[TargetResult]:
+    """Run ``job`` for every target with at most ``max_parallel`` at once
+
+    Progress is streamed with a per-target prefix; results come back in
+    inventory order. A job that raises counts as a failure of its target only.
+    """
+    output = PrefixedOutput(sys.stdout)
+
+    def run(target: FleetTarget) -> TargetResult:
+        output.set_prefix(target.name)
+        started = time.monotonic()
+        try:
+            success = bool(job(target))
+            return TargetResult(target, success, time.monotonic() - started)
+        except Exception as e:
+            print(f"❌ {type(e).__name__}: {e}")
+            return TargetResult(target, False, time.monotonic() - started, str(e))
+        finally:
+            output.set_prefix(None)
+
+    results: Dict[str, TargetResult] = {}
+    original_stdout = sys.stdout
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_parallel), thread_name_prefix='fleet') as pool:
+            futures = {pool.submit(run, target): target for target in targets}
+            for future in as_completed(futures):
+                result = future.result()
+                results[result.target.name] = result
+                status = "✅ done" if result.success else "❌ failed"
+                print(f"{status}: {result.target.name} in {result.duration:.1f}s "
+                      f"({len(results)}/{len(targets)} complete)")
+    finally:
+        sys.stdout = original_stdout
+    return [results[target.name] for target in targets]
+
+
+def print_fleet_summary(results: List[TargetResult], wall_time: float):
+    print("📊 Fleet summary:")
+    width = max([len(r.target.name) for r in results] + [6])
+    print(f"  {'Target':<{width}}  {'Status':<8}  {'Duration':>9}  URL")
+    for result in results:
+        status = 'ok' if result.success else 'FAILED'
+        print(f"  {result.target.name:<{width}}  {status:<8}  {result.duration:>8.1f}s  {result.target.url}")
+        if result.error:
+            print(f"  {'':<{width}}  {result.error}")
+    serial_time = sum(r.duration for r in results)
+    failed = sum(1 for r in results if not r.success)
+    print(f"   {len(results) - failed}/{len(results)} targets succeeded in {wall_time:.1f}s "
+          f"(serial would take {serial_time:.1f}s)")
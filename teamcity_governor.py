@@ -0,0 +1,265 @@
+"""
+TeamCity Request Governor
+Adaptive (AIMD) concurrency limit, token-bucket rate limit and per-endpoint-class caps for one server
+"""
+
+import re
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_INITIAL_LIMIT = 8
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_RATE_LIMIT = 100.0
+# Latencies kept per baseline key; their median is what normal looks like for that endpoint
+LATENCY_WINDOW = 50
+# Latest responses whose median has to stay high before the limit is trimmed
+RECENT_WINDOW = 5
+# Baseline keys kept per server; the least recently seen is dropped beyond this
+MAX_BASELINES = 512
+
+# Responses and errors that mean the server is shedding load
+OVERLOAD_STATUSES = frozenset({429, 503, 504})
+
+# Collections whose listing (especially with expanded fields) is expensive for the server to render
+COLLECTIONS = frozenset({'projects', 'buildTypes', 'builds', 'vcs-roots', 'agents', 'buildQueue', 'changes',
+                         'testOccurrences', 'problemOccurrences', 'investigations', 'users'})
+
+_COUNT_RE = re.compile(r'(?:^|[,(])count:(\d+)')
+
+
+class EndpointClass:
+    """Requests that cost the server about the same
+
+    ``cost`` is charged against the adaptive limit and the token bucket;
+    ``max_in_flight`` caps the class on its own regardless of the limit.
+    """
+
+    def __init__(self, name: str, cost: int, max_in_flight: Optional[int] = None):
+        self.name = name
+        self.cost = cost
+        self.max_in_flight = max_in_flight
+
+
+ENDPOINT_CLASSES = {
+    'ping': EndpointClass('ping', 1),
+    'item': EndpointClass('item', 1),
+    'write': EndpointClass('write', 2, max_in_flight=8),
+    'collection': EndpointClass('collection', 4, max_in_flight=4),
+}
+
+
+def normalized_path(path: str) -> str:
+    """An /app/rest path with locators, ids and names replaced by ``*``, e.g. projects/*/parameters/*
+
+    Segments naming a resource are plain words; anything with a digit,
+    dot, colon or parenthesis identifies an item. Artifact paths collapse
+    after their kind, since every file is the same request to the server.
+    """
+    segments = []
+    for segment in path.split('/'):
+        if segments[-2:-1] == ['artifacts'] and segments[-1] != '*':
+            segments.append('*')
+            break
+        segments.append('*' if re.search(r'[\d.:(]', segment) else segment)
+    return '/'.join(segments)
+
+
+def classify(method: str, url: str) -> Tuple[EndpointClass, str]:
+    """Endpoint class of a request from its method and /app/rest path, with the key for its latency baseline
+
+    Requests share a baseline when they hit the same endpoint (ids removed)
+    with the same ``fields`` and page ``count``, so endpoints that are
+    simply slower than others are not mistaken for congestion.
+    """
+    parts = urlsplit(url)
+    path = parts.path.split('/app/rest/', 1)[-1].strip('/')
+    query = parse_qs(parts.query)
+    count = _COUNT_RE.search(query.get('locator', [''])[0])
+    baseline_key = ' '.join([method, normalized_path(path)]
+                            + [f"fields={value}" for value in query.get('fields', [])[:1]]
+                            + ([f"count={count.group(1)}"] if count else []))
+    if method not in ('GET', 'HEAD'):
+        return ENDPOINT_CLASSES['write'], baseline_key
+    segments = path.split('/')
+    if path == 'server' or segments[-1] == 'status':
+        return ENDPOINT_CLASSES['ping'], baseline_key
+    if len(segments) == 1 and segments[0] in COLLECTIONS:
+        return ENDPOINT_CLASSES['collection'], baseline_key
+    return ENDPOINT_CLASSES['item'], baseline_key
+
+
+class TokenBucket:
+    """Global request rate limit; ``rate`` tokens per second, holding at most ``burst``"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """Seconds until ``cost`` tokens are available; a cost above the burst waits for a full bucket"""
+        self.refill(now)
+        needed = min(cost, self.burst)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+
+    def take(self, cost: float):
+        self.tokens -= min(cost, self.burst)
+
+
+class Governor:
+    """Admission control for requests to one TeamCity server
+
+    A request is admitted when its class cost fits under the adaptive limit
+    (the first request always fits), its class is under its own cap, and the
+    token bucket has its cost available. Otherwise the calling thread waits;
+    the number waiting is the queue depth.
+
+    The limit follows AIMD: every uncongested response at full utilisation
+    adds ``cost / limit`` (about one slot per round trip), while an overload
+    response (429/503/504, timeout, connection error) halves it. Latency
+    shrinks it by 10% only while it stays high: when the median of an
+    endpoint's last few responses is well above the median of its recent
+    history. Decreases are at most one per round trip, so a burst of
+    failures from the same window counts once.
+    """
+
+    def __init__(self, initial_limit: float = DEFAULT_INITIAL_LIMIT,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, rate_limit: Optional[float] = DEFAULT_RATE_LIMIT,
+                 burst: Optional[float] = None, min_limit: float = 1.0, latency_tolerance: float = 2.0,
+                 latency_floor: float = 0.02):
+        self.max_concurrency = max_concurrency
+        self.min_limit = min_limit
+        self.limit = float(min(max(initial_limit, min_limit), max_concurrency))
+        self.bucket = TokenBucket(rate_limit, burst) if rate_limit else None
+        self.latency_tolerance = latency_tolerance
+        self.latency_floor = latency_floor
+
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        self.class_in_flight: Dict[str, int] = {name: 0 for name in ENDPOINT_CLASSES}
+        self.latencies: Dict[str, Deque[float]] = {}
+        self._last_decrease = 0.0
+
+        self.queued = 0
+        self.peak_queued = 0
+        self.peak_limit = self.limit
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.increases = 0
+        self.decreases = 0
+
+    def _admissible(self, endpoint_class: EndpointClass) -> bool:
+        if self.in_flight and self.in_flight + endpoint_class.cost > self.limit:
+            return False
+        cap = endpoint_class.max_in_flight
+        return cap is None or self.class_in_flight[endpoint_class.name] < cap
+
+    def acquire(self, endpoint_class: EndpointClass):
+        """Block until the request may be sent"""
+        with self._condition:
+            waited_since = None
+            while True:
+                if self._admissible(endpoint_class):
+                    now = time.monotonic()
+                    delay = self.bucket.wait_time(endpoint_class.cost, now) if self.bucket else 0.0
+                    if delay <= 0:
+                        break
+                else:
+                    delay = None
+                if waited_since is None:
+                    waited_since = time.monotonic()
+                    self.queued += 1
+                    self.peak_queued = max(self.peak_queued, self.queued)
+                # Woken early by a release; the token bucket is re-checked on every pass
+                self._condition.wait(delay)
+            if waited_since is not None:
+                self.queued -= 1
+                self.throttled += 1
+                self.throttled_seconds += time.monotonic() - waited_since
+            if self.bucket:
+                self.bucket.take(endpoint_class.cost)
+            self.in_flight += endpoint_class.cost
+            self.class_in_flight[endpoint_class.name] += 1
+
+    def release(self, endpoint_class: EndpointClass, latency: float, status: Optional[int] = None,
+                baseline_key: Optional[str] = None):
+        """Return the request's slot and adapt the limit
+
+        ``status`` None means the request failed without a response.
+        Latency is judged against earlier responses with the same
+        ``baseline_key`` (default: the class), see classify().
+        """
+        baseline_key = baseline_key or endpoint_class.name
+        with self._condition:
+            saturated = self.in_flight + endpoint_class.cost > self.limit
+            self.in_flight -= endpoint_class.cost
+            self.class_in_flight[endpoint_class.name] -= 1
+
+            now = time.monotonic()
+            if status is None or status in OVERLOAD_STATUSES:
+                self._decrease(0.5, now, latency)
+            elif status < 400:
+                if self._record_latency(baseline_key, latency):
+                    self._decrease(0.9, now, latency)
+                elif saturated and self.limit < self.max_concurrency:
+                    self.limit = min(self.max_concurrency, self.limit + endpoint_class.cost / self.limit)
+                    self.peak_limit = max(self.peak_limit, self.limit)
+                    self.increases += 1
+            self._condition.notify_all()
+
+    def _record_latency(self, baseline_key: str, latency: float) -> bool:
+        """Add a response's latency to its endpoint's history; True if its recent latency stays high
+
+        A lasting shift in the server's speed fills the history and becomes
+        the new normal.
+        """
+        history = self.latencies.pop(baseline_key, None)
+        if history is None:
+            history = deque(maxlen=LATENCY_WINDOW)
+            if len(self.latencies) >= MAX_BASELINES:
+                del self.latencies[next(iter(self.latencies))]
+        # Re-inserted so the dict stays ordered by last use
+        self.latencies[baseline_key] = history
+        history.append(latency)
+        if len(history) < 2 * RECENT_WINDOW:
+            return False
+        baseline = statistics.median(history)
+        recent = statistics.median(list(history)[-RECENT_WINDOW:])
+        return recent > max(baseline * self.latency_tolerance, baseline + self.latency_floor)
+
+    def _decrease(self, factor: float, now: float, latency: float):
+        if now - self._last_decrease < max(latency, 0.01):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.decreases += 1
+
+    def as_dict(self) -> Dict:
+        with self._condition:
+            return {
+                'limit': round(self.limit, 2),
+                'peak_limit': round(self.peak_limit, 2),
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'peak_queued': self.peak_queued,
+                'throttled': self.throttled,
+                'throttled_seconds': round(self.throttled_seconds, 3),
+                'increases': self.increases,
+                'decreases': self.decreases,
+                'rate_limit': self.bucket.rate if self.bucket else None,
+            }
+
+    def summary(self) -> str:
+        stats = self.as_dict()
+        return (f"limit {stats['limit']:.1f} (peak {stats['peak_limit']:.1f}), {stats['queued']} queued "
+                f"(peak {stats['peak_queued']}), {stats['throttled']} throttled for {stats['throttled_seconds']:.1f}s, "
+                f"{stats['decreases']} backoffs")
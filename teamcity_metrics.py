@@ -0,0 +1,361 @@
+"""
+TeamCity API Instrumentation
+Request hooks, latency histograms, phase spans and Prometheus/JSON trace exporters
+"""
+
+import argparse
+import functools
+import heapq
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Seconds; the last bucket is +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DEFAULT_TOP_N = 10
+
+_LOCATOR_SEGMENT_RE = re.compile(r'^([A-Za-z]+):.+$')
+_NAMED_CHILD_RE = re.compile(r'/(properties|parameters|name|settings)/[^/]+$')
+
+
+def endpoint_template(endpoint: str) -> str:
+    """Collapse an endpoint into a low-cardinality template for metric labels
+
+    ``projects/id:_Root/projectFeatures/id:PROJECT_EXT_1/properties/enabled?fields=id``
+    becomes ``projects/id:{}/projectFeatures/id:{}/properties/{}``.
+    """
+    path = endpoint.split('?', 1)[0].strip('/')
+    template = '/'.join(_LOCATOR_SEGMENT_RE.sub(r'\1:{}', segment) for segment in path.split('/'))
+    return _NAMED_CHILD_RE.sub(lambda m: f"/{m.group(1)}/{{}}" if m.group(1) != 'name' else '/name', template)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (the Prometheus convention)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def as_dict(self) -> Dict:
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Histogram':
+        histogram = cls(tuple(data['buckets']))
+        if len(data['counts']) != len(histogram.counts):
+            raise ValueError("histogram counts do not match its buckets")
+        histogram.counts = list(data['counts'])
+        histogram.sum = float(data['sum'])
+        histogram.count = int(data['count'])
+        return histogram
+
+
+class EndpointMetrics:
+    __slots__ = ('latency', 'statuses', 'bytes_sent', 'bytes_received', 'retries', 'errors')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.statuses: Dict[str, int] = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.errors = 0
+
+
+class RequestEvent:
+    """What a request hook receives once a request finishes (``status`` is None if it raised)"""
+
+    __slots__ = ('method', 'url', 'endpoint', 'template', 'status', 'started', 'elapsed',
+                 'bytes_sent', 'bytes_received', 'retries', 'error')
+
+    def __init__(self, method: str, url: str, endpoint: str, status: Optional[int], started: float,
+                 elapsed: float, bytes_sent: int = 0, bytes_received: int = 0, retries: int = 0,
+                 error: Optional[str] = None):
+        self.method = method
+        self.url = url
+        self.endpoint = endpoint
+        self.template = endpoint_template(endpoint)
+        self.status = status
+        self.started = started
+        self.elapsed = elapsed
+        self.bytes_sent = bytes_sent
+        self.bytes_received = bytes_received
+        self.retries = retries
+        self.error = error
+
+
+class RequestMetrics:
+    """Request hook aggregating per-(method, endpoint template) metrics and the slowest calls"""
+
+    def __init__(self, top_n: int = DEFAULT_TOP_N):
+        self.top_n = top_n
+        self.endpoints: Dict[Tuple[str, str], EndpointMetrics] = {}
+        self._slowest: List[Tuple[float, int, RequestEvent]] = []
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, event: RequestEvent):
+        with self._lock:
+            metrics = self.endpoints.get((event.method, event.template))
+            if metrics is None:
+                metrics = self.endpoints[(event.method, event.template)] = EndpointMetrics()
+            metrics.latency.observe(event.elapsed)
+            status = str(event.status) if event.status is not None else 'error'
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            metrics.bytes_sent += event.bytes_sent
+            metrics.bytes_received += event.bytes_received
+            metrics.retries += event.retries
+            metrics.errors += event.error is not None
+
+            self._sequence += 1
+            entry = (event.elapsed, self._sequence, event)
+            if len(self._slowest) < self.top_n:
+                heapq.heappush(self._slowest, entry)
+            elif entry > self._slowest[0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self) -> List[RequestEvent]:
+        with self._lock:
+            return [event for _, _, event in sorted(self._slowest, reverse=True)]
+
+
+class Span:
+    __slots__ = ('name', 'started', 'elapsed', 'thread', 'depth')
+
+    def __init__(self, name: str, started: float, thread: int, depth: int):
+        self.name = name
+        self.started = started
+        self.elapsed: Optional[float] = None
+        self.thread = thread
+        self.depth = depth
+
+
+class Instrumentation:
+    """Phase spans plus request metrics for one run; attach it to every client to be measured"""
+
+    def __init__(self, top_n: int = DEFAULT_TOP_N, trace_requests: bool = False):
+        self.metrics = RequestMetrics(top_n)
+        self.spans: List[Span] = []
+        self.requests: List[RequestEvent] = []
+        self.trace_requests = trace_requests
+        self.origin = time.time()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def attach(self, api):
+        api.add_hook(self.on_request)
+        return api
+
+    def on_request(self, event: RequestEvent):
+        self.metrics(event)
+        if self.trace_requests:
+            with self._lock:
+                self.requests.append(event)
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[Span]:
+        depth = getattr(self._local, 'depth', 0)
+        span = Span(name, time.time(), threading.get_ident(), depth)
+        with self._lock:
+            self.spans.append(span)
+        self._local.depth = depth + 1
+        started = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.elapsed = time.perf_counter() - started
+            self._local.depth = depth
+
+    def phase_totals(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            if span.elapsed is not None:
+                totals[span.name] = totals.get(span.name, 0.0) + span.elapsed
+        return totals
+
+
+@contextmanager
+def maybe_span(instrumentation: Optional[Instrumentation], name: str):
+    """``instrumentation.span(name)`` when instrumentation is enabled, otherwise a no-op"""
+    if instrumentation is None:
+        yield None
+    else:
+        with instrumentation.span(name) as span:
+            yield span
+
+
+def phase(name: str):
+    """Method decorator running the call inside a span of ``self.instrumentation`` (if it has one)"""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with maybe_span(getattr(self, 'instrumentation', None), name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(instrumentation: Instrumentation) -> str:
+    """Render metrics in the Prometheus text exposition format (for the node_exporter textfile collector)"""
+    lines = [
+        '# HELP teamcity_api_request_duration_seconds TeamCity REST request latency.',
+        '# TYPE teamcity_api_request_duration_seconds histogram',
+    ]
+    endpoints = sorted(instrumentation.metrics.endpoints.items())
+    for (method, template), metrics in endpoints:
+        labels = f'method="{method}",endpoint="{_label(template)}"'
+        cumulative = 0
+        for bound, count in zip(metrics.latency.buckets + (float('inf'),), metrics.latency.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'teamcity_api_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f'teamcity_api_request_duration_seconds_sum{{{labels}}} {metrics.latency.sum:.6f}')
+        lines.append(f'teamcity_api_request_duration_seconds_count{{{labels}}} {metrics.latency.count}')
+
+    lines += ['# HELP teamcity_api_responses_total Responses by status code ("error" when no response).',
+              '# TYPE teamcity_api_responses_total counter']
+    for (method, template), metrics in endpoints:
+        for status, count in sorted(metrics.statuses.items()):
+            lines.append(f'teamcity_api_responses_total{{method="{method}",endpoint="{_label(template)}",'
+                         f'status="{status}"}} {count}')
+
+    lines += ['# HELP teamcity_api_bytes_total Payload bytes transferred.',
+              '# TYPE teamcity_api_bytes_total counter']
+    for (method, template), metrics in endpoints:
+        labels = f'method="{method}",endpoint="{_label(template)}"'
+        lines.append(f'teamcity_api_bytes_total{{{labels},direction="sent"}} {metrics.bytes_sent}')
+        lines.append(f'teamcity_api_bytes_total{{{labels},direction="received"}} {metrics.bytes_received}')
+
+    lines += ['# HELP teamcity_api_retries_total Transport retries.',
+              '# TYPE teamcity_api_retries_total counter']
+    for (method, template), metrics in endpoints:
+        lines.append(f'teamcity_api_retries_total{{method="{method}",endpoint="{_label(template)}"}} '
+                     f'{metrics.retries}')
+
+    lines += ['# HELP teamcity_phase_duration_seconds Time spent in each deployment phase.',
+              '# TYPE teamcity_phase_duration_seconds gauge']
+    for name, elapsed in sorted(instrumentation.phase_totals().items()):
+        lines.append(f'teamcity_phase_duration_seconds{{phase="{_label(name)}"}} {elapsed:.6f}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus_textfile(instrumentation: Instrumentation, path: Path):
+    """Write atomically so the textfile collector never reads a partial file"""
+    tmp = Path(f"{path}.{os.getpid()}.tmp")
+    tmp.write_text(prometheus_text(instrumentation))
+    os.replace(tmp, path)
+
+
+def write_json_trace(instrumentation: Instrumentation, path: Path):
+    """Write spans and requests in the Chrome trace event format (chrome://tracing, Perfetto)"""
+    def micros(epoch: float) -> int:
+        return int((epoch - instrumentation.origin) * 1_000_000)
+
+    events = []
+    for span in instrumentation.spans:
+        if span.elapsed is not None:
+            events.append({'name': span.name, 'cat': 'phase', 'ph': 'X', 'pid': 1, 'tid': span.thread,
+                           'ts': micros(span.started), 'dur': int(span.elapsed * 1_000_000)})
+    for request in instrumentation.requests:
+        events.append({'name': f"{request.method} {request.template}", 'cat': 'request', 'ph': 'X',
+                       'pid': 1, 'tid': 'http', 'ts': micros(request.started),
+                       'dur': int(request.elapsed * 1_000_000),
+                       'args': {'url': request.url, 'status': request.status, 'retries': request.retries,
+                                'bytes_received': request.bytes_received, 'error': request.error}})
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def print_profile(instrumentation: Instrumentation):
+    slowest = instrumentation.metrics.slowest()
+    print()
+    print(f"⏱️  Slowest {len(slowest)} calls:")
+    if slowest:
+        print(f"  {'Time':>8}  {'Status':>6}  {'Retries':>7}  Request")
+        for event in slowest:
+            status = event.status if event.status is not None else 'error'
+            print(f"  {event.elapsed * 1000:>6.0f}ms  {status:>6}  {event.retries:>7}  "
+                  f"{event.method} {event.endpoint.split('?', 1)[0]}")
+
+    endpoints = sorted(instrumentation.metrics.endpoints.items(), key=lambda item: -item[1].latency.sum)
+    if endpoints:
+        print("📈 By endpoint:")
+        print(f"  {'Calls':>5}  {'Total':>8}  {'p50≤':>7}  {'p95≤':>7}  Endpoint")
+        for (method, template), metrics in endpoints:
+            latency = metrics.latency
+            print(f"  {latency.count:>5}  {latency.sum:>7.2f}s  {latency.quantile(0.5) * 1000:>5.0f}ms  "
+                  f"{latency.quantile(0.95) * 1000:>5.0f}ms  {method} {template}")
+
+    totals = instrumentation.phase_totals()
+    if totals:
+        print("🧭 Phases:")
+        for name, elapsed in totals.items():
+            print(f"  {elapsed:>7.2f}s  {name}")
+
+
+def add_instrumentation_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('instrumentation')
+    group.add_argument('--profile', action='store_true',
+                       help="Print the slowest calls, per-endpoint latency and phase times at the end")
+    group.add_argument('--profile-top', type=int, default=DEFAULT_TOP_N,
+                       help=f"Calls listed by --profile (default: {DEFAULT_TOP_N})")
+    group.add_argument('--metrics-file', type=Path,
+                       help="Write Prometheus metrics to this textfile at the end of the run")
+    group.add_argument('--trace-file', type=Path,
+                       help="Write a JSON trace of phases and requests (Chrome trace format)")
+
+
+def instrumentation_from_args(args: argparse.Namespace) -> Optional[Instrumentation]:
+    """An Instrumentation when any instrumentation option is set, otherwise None"""
+    if not (args.profile or args.metrics_file or args.trace_file):
+        return None
+    return Instrumentation(args.profile_top, trace_requests=args.trace_file is not None)
+
+
+def report_instrumentation(instrumentation: Optional[Instrumentation], args: argparse.Namespace):
+    if instrumentation is None:
+        return
+    if args.profile:
+        print_profile(instrumentation)
+    for path, writer in ((args.metrics_file, write_prometheus_textfile), (args.trace_file, write_json_trace)):
+        if path is None:
+            continue
+        try:
+            writer(instrumentation, path)
+            print(f"📝 Wrote {path}")
+        except OSError as e:
+            print(f"⚠️  Could not write {path}: {e}")
+
@@ -0,0 +1,196 @@
+"""
+TeamCity Entity Model
+Compact slotted entities and an indexed registry of the project tree
+"""
+
+import calendar
+import sys
+import time
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from teamcity_api import TeamCityAPI, DEFAULT_PAGE_SIZE, PROJECT_FIELDS, BUILD_TYPE_FIELDS, VCS_ROOT_FIELDS
+
+ROOT_PROJECT_ID = '_Root'
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value is not None else None
+
+
+def property_dict(entity: Dict) -> Dict[str, str]:
+    """Flatten a REST ``properties`` block into a name -> value dict"""
+    return {sys.intern(prop['name']): prop.get('value', '')
+            for prop in entity.get('properties', {}).get('property', [])}
+
+
+def parse_date(value: Optional[str]) -> Optional[float]:
+    """Convert a REST timestamp like ``20250625T101500+0300`` to epoch seconds"""
+    if not value:
+        return None
+    seconds = calendar.timegm(time.strptime(value[:15], '%Y%m%dT%H%M%S'))
+    offset = value[15:]
+    if len(offset) == 5 and offset[0] in '+-':
+        sign = 1 if offset[0] == '+' else -1
+        seconds -= sign * (int(offset[1:3]) * 3600 + int(offset[3:5]) * 60)
+    return float(seconds)
+
+
+def format_date(timestamp: float) -> str:
+    """Epoch seconds as a REST timestamp in UTC, e.g. for ``sinceDate:`` locators"""
+    return time.strftime('%Y%m%dT%H%M%S+0000', time.gmtime(timestamp))
+
+
+class Project:
+    __slots__ = ('id', 'name', 'parent_id', 'archived')
+
+    def __init__(self, id: str, name: str, parent_id: Optional[str] = None, archived: bool = False):
+        self.id = id
+        self.name = name
+        self.parent_id = _intern(parent_id)
+        self.archived = archived
+
+    @classmethod
+    def from_json(cls, data: Dict) -> 'Project':
+        return cls(data['id'], data.get('name', data['id']), data.get('parentProjectId'),
+                   bool(data.get('archived', False)))
+
+
+class BuildType:
+    __slots__ = ('id', 'name', 'project_id', 'paused')
+
+    def __init__(self, id: str, name: str, project_id: str, paused: bool = False):
+        self.id = id
+        self.name = name
+        self.project_id = _intern(project_id)
+        self.paused = paused
+
+    @classmethod
+    def from_json(cls, data: Dict) -> 'BuildType':
+        return cls(data['id'], data.get('name', data['id']), data.get('projectId'),
+                   bool(data.get('paused', False)))
+
+
+class VcsRoot:
+    __slots__ = ('id', 'name', 'vcs_name', 'project_id', 'properties')
+
+    def __init__(self, id: str, name: str, vcs_name: Optional[str] = None, project_id: Optional[str] = None,
+                 properties: Optional[Dict[str, str]] = None):
+        self.id = id
+        self.name = name
+        self.vcs_name = _intern(vcs_name)
+        self.project_id = _intern(project_id)
+        self.properties = properties or {}
+
+    @classmethod
+    def from_json(cls, data: Dict) -> 'VcsRoot':
+        return cls(data['id'], data.get('name', data['id']), data.get('vcsName'),
+                   data.get('project', {}).get('id'), property_dict(data))
+
+
+class Feature:
+    __slots__ = ('id', 'type', 'project_id', 'properties')
+
+    def __init__(self, id: str, type: str, project_id: str = ROOT_PROJECT_ID,
+                 properties: Optional[Dict[str, str]] = None):
+        self.id = id
+        self.type = _intern(type)
+        self.project_id = _intern(project_id)
+        self.properties = properties or {}
+
+    @classmethod
+    def from_json(cls, data: Dict, project_id: str = ROOT_PROJECT_ID) -> 'Feature':
+        return cls(data['id'], data['type'], project_id, property_dict(data))
+
+
+class ProjectTree:
+    """Registry of entities with id, name, parent -> children and project -> buildType indexes
+
+    Lookups by id and name are dict hits; subtree queries walk the children
+    index instead of scanning every project.
+    """
+
+    def __init__(self):
+        self.projects: Dict[str, Project] = {}
+        self.build_types: Dict[str, BuildType] = {}
+        self.vcs_roots: Dict[str, VcsRoot] = {}
+        self._by_name: Dict[str, List[str]] = {}
+        self._children: Dict[str, List[str]] = {}
+        self._project_build_types: Dict[str, List[str]] = {}
+        self._features: Dict[str, List[Feature]] = {}
+
+    def __contains__(self, project_id: str) -> bool:
+        return project_id in self.projects
+
+    def __len__(self) -> int:
+        return len(self.projects)
+
+    def add_project(self, project: Project):
+        self.projects[project.id] = project
+        self._by_name.setdefault(project.name, []).append(project.id)
+        if project.parent_id is not None:
+            self._children.setdefault(project.parent_id, []).append(project.id)
+
+    def add_build_type(self, build_type: BuildType):
+        self.build_types[build_type.id] = build_type
+        self._project_build_types.setdefault(build_type.project_id, []).append(build_type.id)
+
+    def add_vcs_root(self, vcs_root: VcsRoot):
+        self.vcs_roots[vcs_root.id] = vcs_root
+
+    def add_feature(self, feature: Feature):
+        self._features.setdefault(feature.project_id, []).append(feature)
+
+    def project(self, project_id: str) -> Optional[Project]:
+        return self.projects.get(project_id)
+
+    def projects_named(self, name: str) -> List[Project]:
+        return [self.projects[project_id] for project_id in self._by_name.get(name, [])]
+
+    def children(self, project_id: str) -> List[Project]:
+        return [self.projects[child_id] for child_id in self._children.get(project_id, [])]
+
+    def subtree(self, project_id: str) -> Iterator[Project]:
+        """Yield the project's descendants breadth-first (the project itself excluded)"""
+        queue = deque(self._children.get(project_id, []))
+        while queue:
+            child_id = queue.popleft()
+            yield self.projects[child_id]
+            queue.extend(self._children.get(child_id, []))
+
+    def build_types_of(self, project_id: str, recursive: bool = False) -> List[BuildType]:
+        project_ids = [project_id]
+        if recursive:
+            project_ids += [p.id for p in self.subtree(project_id)]
+        return [self.build_types[bt_id]
+                for pid in project_ids for bt_id in self._project_build_types.get(pid, [])]
+
+    def project_of(self, build_type_id: str) -> Optional[Project]:
+        build_type = self.build_types.get(build_type_id)
+        return self.projects.get(build_type.project_id) if build_type else None
+
+    def features(self, project_id: str = ROOT_PROJECT_ID, type: Optional[str] = None) -> List[Feature]:
+        features = self._features.get(project_id, [])
+        return [f for f in features if f.type == type] if type else list(features)
+
+    def missing(self, project_ids: Iterable[str]) -> List[str]:
+        return [project_id for project_id in project_ids if project_id not in self.projects]
+
+    @classmethod
+    def from_api(cls, api: TeamCityAPI, page_size: int = DEFAULT_PAGE_SIZE,
+                 build_types: bool = True, vcs_roots: bool = False) -> 'ProjectTree':
+        """Build the registry from one paged walk per collection
+
+        Raises requests.HTTPError if a collection cannot be read.
+        """
+        tree = cls()
+        for data in api.iter_projects(fields=PROJECT_FIELDS, page_size=page_size):
+            tree.add_project(Project.from_json(data))
+        if build_types:
+            for data in api.iter_build_types(fields=BUILD_TYPE_FIELDS, page_size=page_size):
+                tree.add_build_type(BuildType.from_json(data))
+        if vcs_roots:
+            fields = {'vcs-root': VCS_ROOT_FIELDS['vcs-root'] + [{'project': ['id']}]}
+            for data in api.iter_vcs_roots(fields=fields, page_size=page_size):
+                tree.add_vcs_root(VcsRoot.from_json(data))
+        return tree
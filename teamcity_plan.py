@@ -0,0 +1,331 @@
+"""
+TeamCity Plan/Apply Reconciliation
+Declarative desired state, server snapshot diff and minimal write plan
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from teamcity_api import TeamCityAPI, build_fields, DEFAULT_PAGE_SIZE, PROPERTY_FIELDS, VCS_ROOT_FIELDS, PROJECT_FEATURE_FIELDS
+from teamcity_model import ROOT_PROJECT_ID, property_dict
+
+VCS_ROOT_ID = 'TeamcityConfigurations_GitHubRepo'
+VCS_ROOT_NAME = 'TeamCity Configurations GitHub Repository'
+
+VERSIONED_SETTINGS_PROPERTIES = {
+    'credentialsStorageType': 'credentialsJSON',
+    'enabled': 'true',
+    'rootId': VCS_ROOT_ID,
+    'showChanges': 'true',
+    'buildSettings': 'PREFER_VCS',
+    'importSettings': 'true',
+}
+
+# Project fields needed to diff VCS roots and features, read in a single request
+SNAPSHOT_FIELDS = build_fields(['id', {'vcsRoots': VCS_ROOT_FIELDS}, {'projectFeatures': PROJECT_FEATURE_FIELDS}])
+
+# Whole-server reads for bulk provisioning: every project, VCS root and build configuration in three paged queries
+PARAMETER_FIELDS = {'parameters': {'property': ['name', 'value']}}
+BULK_PROJECT_FIELDS = {'project': ['id', 'name', 'parentProjectId', PARAMETER_FIELDS,
+                                   {'projectFeatures': PROJECT_FEATURE_FIELDS}]}
+BULK_VCS_ROOT_FIELDS = {'vcs-root': ['id', 'name', 'vcsName', {'project': ['id']}, PROPERTY_FIELDS]}
+BULK_BUILD_TYPE_FIELDS = {'buildType': ['id', 'name', 'projectId', PARAMETER_FIELDS,
+                                        {'vcs-root-entries': {'vcs-root-entry': ['id']}}]}
+
+
+def property_list(properties: Dict[str, str]) -> Dict:
+    return {'property': [{'name': name, 'value': value} for name, value in properties.items()]}
+
+
+class VcsRootSpec:
+    def __init__(self, id: str, name: str, properties: Dict[str, str],
+                 vcs_name: str = 'jetbrains.git', project_id: str = '_Root'):
+        self.id = id
+        self.name = name
+        self.properties = dict(properties)
+        self.vcs_name = vcs_name
+        self.project_id = project_id
+
+    def create_payload(self) -> Dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'vcsName': self.vcs_name,
+            'project': {'id': self.project_id},
+            'properties': property_list(self.properties),
+        }
+
+
+class FeatureSpec:
+    """A project feature, matched on the server by id when given, otherwise by type"""
+
+    def __init__(self, type: str, properties: Dict[str, str], project_id: str = '_Root',
+                 id: Optional[str] = None):
+        self.type = type
+        self.properties = dict(properties)
+        self.project_id = project_id
+        self.id = id
+
+    def create_payload(self) -> Dict:
+        payload = {'type': self.type, 'properties': property_list(self.properties)}
+        if self.id:
+            payload['id'] = self.id
+        return payload
+
+
+class ProjectSpec:
+    def __init__(self, id: str, name: str, parent_id: str = ROOT_PROJECT_ID,
+                 parameters: Optional[Dict[str, str]] = None):
+        self.id = id
+        self.name = name
+        self.parent_id = parent_id
+        self.parameters = dict(parameters or {})
+
+    def create_payload(self) -> Dict:
+        # New projects take no parameters; they are set one by one after the POST
+        return {'id': self.id, 'name': self.name, 'parentProject': {'locator': f"id:{self.parent_id}"}}
+
+
+class BuildTypeSpec:
+    def __init__(self, id: str, name: str, project_id: str, vcs_root_ids: Sequence[str] = (),
+                 parameters: Optional[Dict[str, str]] = None):
+        self.id = id
+        self.name = name
+        self.project_id = project_id
+        self.vcs_root_ids = list(vcs_root_ids)
+        self.parameters = dict(parameters or {})
+
+    def create_payload(self) -> Dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'project': {'id': self.project_id},
+            'vcs-root-entries': {'vcs-root-entry': [vcs_root_entry(root_id) for root_id in self.vcs_root_ids]},
+            'parameters': property_list(self.parameters),
+        }
+
+
+def vcs_root_entry(root_id: str) -> Dict:
+    return {'id': root_id, 'vcs-root': {'id': root_id}}
+
+
+class DesiredState:
+    def __init__(self, vcs_roots: Sequence[VcsRootSpec] = (), features: Sequence[FeatureSpec] = (),
+                 projects: Sequence[ProjectSpec] = (), build_types: Sequence[BuildTypeSpec] = ()):
+        self.vcs_roots = list(vcs_roots)
+        self.features = list(features)
+        self.projects = list(projects)
+        self.build_types = list(build_types)
+
+    def project_ids(self) -> List[str]:
+        project_ids = []
+        for spec in [*self.vcs_roots, *self.features]:
+            if spec.project_id not in project_ids:
+                project_ids.append(spec.project_id)
+        return project_ids
+
+
+def default_desired_state(repo_url: str) -> DesiredState:
+    """The VCS root and versioned settings this repository deploys to _Root"""
+    return DesiredState(
+        vcs_roots=[VcsRootSpec(VCS_ROOT_ID, VCS_ROOT_NAME, {
+            'branch': 'refs/heads/main',
+            'url': repo_url,
+            'authMethod': 'PRIVATE_KEY_DEFAULT',
+            'ignoreKnownHosts': 'true',
+        })],
+        features=[FeatureSpec('versionedSettings', VERSIONED_SETTINGS_PROPERTIES)],
+    )
+
+
+class ServerSnapshot:
+    """VCS roots and project features of the projects a desired state touches"""
+
+    def __init__(self, projects: Dict[str, Dict], build_types: Optional[Dict[str, Dict]] = None):
+        self.projects = projects
+        self.build_types = build_types or {}
+
+    @classmethod
+    def fetch(cls, api: TeamCityAPI, project_ids: Sequence[str]) -> 'ServerSnapshot':
+        """Read each project once with its VCS roots and features inline
+
+        Raises requests.HTTPError if a project cannot be read.
+        """
+        projects = {}
+        for project_id in project_ids:
+            response = api.query(f'projects/id:{project_id}', fields=SNAPSHOT_FIELDS, max_age=0)
+            response.raise_for_status()
+            projects[project_id] = response.json()
+        return cls(projects)
+
+    @classmethod
+    def fetch_all(cls, api: TeamCityAPI, page_size: int = DEFAULT_PAGE_SIZE) -> 'ServerSnapshot':
+        """Read every project, VCS root and build configuration with the fields a plan compares
+
+        The cost is a few paged queries however many entities a manifest
+        names. Raises requests.HTTPError if a collection cannot be read.
+        """
+        projects = {}
+        for project in api.iter_projects(fields=BULK_PROJECT_FIELDS, page_size=page_size, max_age=0):
+            project['vcsRoots'] = {'vcs-root': []}
+            projects[project['id']] = project
+        for root in api.iter_vcs_roots(fields=BULK_VCS_ROOT_FIELDS, page_size=page_size, max_age=0):
+            owner = projects.get(root.get('project', {}).get('id', ROOT_PROJECT_ID))
+            if owner is not None:
+                owner['vcsRoots']['vcs-root'].append(root)
+        build_types = {build_type['id']: build_type for build_type in
+                       api.iter_build_types(fields=BULK_BUILD_TYPE_FIELDS, page_size=page_size, max_age=0)}
+        return cls(projects, build_types)
+
+    def vcs_roots(self, project_id: str) -> List[Dict]:
+        return self.projects.get(project_id, {}).get('vcsRoots', {}).get('vcs-root', [])
+
+    def features(self, project_id: str) -> List[Dict]:
+        return self.projects.get(project_id, {}).get('projectFeatures', {}).get('projectFeature', [])
+
+
+Write = Tuple[str, str, Union[Dict, str]]
+
+
+class PlanAction:
+    def __init__(self, kind: str, resource: str, label: str, writes: Sequence[Write] = (),
+                 changes: Optional[Dict[str, Tuple[Optional[str], str]]] = None, spec: Any = None):
+        self.kind = kind  # 'create', 'update' or 'noop'
+        self.resource = resource
+        self.label = label
+        self.writes = list(writes)
+        self.changes = changes or {}
+        self.spec = spec
+
+
+class Plan:
+    SYMBOLS = {'create': '➕', 'update': '🔄', 'noop': '✅'}
+
+    def __init__(self, actions: Sequence[PlanAction]):
+        self.actions = list(actions)
+
+    @property
+    def write_count(self) -> int:
+        return sum(len(action.writes) for action in self.actions)
+
+    @property
+    def has_changes(self) -> bool:
+        return self.write_count > 0
+
+    def print(self):
+        print("📝 Plan:")
+        for action in self.actions:
+            print(f"  {self.SYMBOLS[action.kind]} {action.kind:<6} {action.resource} {action.label}")
+            for name, (old, new) in action.changes.items():
+                before = 'unset' if old is None else repr(old)
+                print(f"       {name}: {before} → {new!r}")
+        counts = {kind: sum(1 for a in self.actions if a.kind == kind) for kind in ('create', 'update', 'noop')}
+        print(f"   {counts['create']} to create, {counts['update']} to update, "
+              f"{counts['noop']} unchanged ({self.write_count} writes)")
+
+
+def _property_changes(current: Dict[str, str], desired: Dict[str, str]) -> Dict[str, Tuple[Optional[str], str]]:
+    """Desired properties that differ on the server; properties the spec doesn't mention are left alone"""
+    return {name: (current.get(name), value) for name, value in desired.items() if current.get(name) != value}
+
+
+def _parameter_dict(entity: Dict) -> Dict[str, str]:
+    return {prop['name']: prop.get('value', '') for prop in entity.get('parameters', {}).get('property', [])}
+
+
+def _plan_project(spec: ProjectSpec, snapshot: ServerSnapshot) -> PlanAction:
+    project_path = f"projects/id:{spec.id}"
+    existing = snapshot.projects.get(spec.id)
+    # The parent is only used on creation; moving an existing project is left to the UI
+    changes = _property_changes(_parameter_dict(existing or {}), spec.parameters)
+    writes: List[Write] = [('PUT', f"{project_path}/parameters/{name}", value) for name, (_, value) in changes.items()]
+    if existing is None:
+        return PlanAction('create', 'project', spec.id, [('POST', 'projects', spec.create_payload())] + writes,
+                          spec=spec)
+
+    if existing.get('name') != spec.name:
+        changes['name'] = (existing.get('name'), spec.name)
+        writes.append(('PUT', f"{project_path}/name", spec.name))
+    return PlanAction('update' if writes else 'noop', 'project', spec.id, writes, changes, spec)
+
+
+def _plan_build_type(spec: BuildTypeSpec, snapshot: ServerSnapshot) -> PlanAction:
+    existing = snapshot.build_types.get(spec.id)
+    if existing is None:
+        return PlanAction('create', 'build-type', spec.id, [('POST', 'buildTypes', spec.create_payload())], spec=spec)
+
+    build_type_path = f"buildTypes/id:{spec.id}"
+    changes = _property_changes(_parameter_dict(existing), spec.parameters)
+    writes: List[Write] = [('PUT', f"{build_type_path}/parameters/{name}", value)
+                           for name, (_, value) in changes.items()]
+    attached = {entry['id'] for entry in existing.get('vcs-root-entries', {}).get('vcs-root-entry', [])}
+    for root_id in spec.vcs_root_ids:
+        if root_id not in attached:
+            changes[f"vcs-root-entry {root_id}"] = (None, 'attached')
+            writes.append(('POST', f"{build_type_path}/vcs-root-entries", vcs_root_entry(root_id)))
+    if existing.get('name') != spec.name:
+        changes['name'] = (existing.get('name'), spec.name)
+        writes.append(('PUT', f"{build_type_path}/name", spec.name))
+    return PlanAction('update' if writes else 'noop', 'build-type', spec.id, writes, changes, spec)
+
+
+def _plan_vcs_root(spec: VcsRootSpec, snapshot: ServerSnapshot) -> PlanAction:
+    roots = snapshot.vcs_roots(spec.project_id)
+    existing = next((r for r in roots if r['id'] == spec.id), None) \
+        or next((r for r in roots if r.get('name') == spec.name), None)
+    if existing is None:
+        return PlanAction('create', 'vcs-root', spec.id, [('POST', 'vcs-roots', spec.create_payload())], spec=spec)
+
+    root_path = f"vcs-roots/id:{existing['id']}"
+    changes = _property_changes(property_dict(existing), spec.properties)
+    writes = [('PUT', f"{root_path}/properties/{name}", value) for name, (_, value) in changes.items()]
+    if existing.get('name') != spec.name:
+        changes['name'] = (existing.get('name'), spec.name)
+        writes.append(('PUT', f"{root_path}/name", spec.name))
+    return PlanAction('update' if writes else 'noop', 'vcs-root', existing['id'], writes, changes, spec)
+
+
+def _plan_feature(spec: FeatureSpec, snapshot: ServerSnapshot) -> PlanAction:
+    features = snapshot.features(spec.project_id)
+    if spec.id:
+        existing = next((f for f in features if f['id'] == spec.id), None)
+    else:
+        existing = next((f for f in features if f.get('type') == spec.type), None)
+    features_path = f"projects/id:{spec.project_id}/projectFeatures"
+    label = f"{spec.type} in {spec.project_id}"
+    if existing is None:
+        return PlanAction('create', 'feature', label, [('POST', features_path, spec.create_payload())], spec=spec)
+
+    feature_path = f"{features_path}/id:{existing['id']}"
+    changes = _property_changes(property_dict(existing), spec.properties)
+    writes = [('PUT', f"{feature_path}/properties/{name}", value) for name, (_, value) in changes.items()]
+    return PlanAction('update' if writes else 'noop', 'feature', f"{label} ({existing['id']})", writes, changes, spec)
+
+
+def build_plan(desired: DesiredState, snapshot: ServerSnapshot) -> Plan:
+    """Diff the desired state against a snapshot in dependency order
+
+    Projects come first since everything lives in one, then VCS roots, then
+    the build configurations and features that reference them.
+    """
+    actions = [_plan_project(spec, snapshot) for spec in desired.projects]
+    actions += [_plan_vcs_root(spec, snapshot) for spec in desired.vcs_roots]
+    actions += [_plan_build_type(spec, snapshot) for spec in desired.build_types]
+    actions += [_plan_feature(spec, snapshot) for spec in desired.features]
+    return Plan(actions)
+
+
+def apply_plan(api: TeamCityAPI, plan: Plan) -> bool:
+    """Execute the plan's writes in order, stopping at the first failure"""
+    print("🚧 Applying plan...")
+    for action in plan.actions:
+        if action.kind == 'noop':
+            continue
+        for method, endpoint, data in action.writes:
+            response = api.post(endpoint, data) if method == 'POST' else api.put(endpoint, data)
+            if response.status_code not in (200, 201, 204):
+                print(f"   ❌ {action.kind} {action.resource} {action.label} failed "
+                      f"({method} {endpoint}: HTTP {response.status_code})")
+                print(f"   Response: {response.text}")
+                return False
+        print(f"   ✅ {action.kind} {action.resource} {action.label}")
+    return True
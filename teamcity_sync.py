@@ -0,0 +1,254 @@
+"""
+TeamCity Sync Completion Detection
+Pluggable waiter that probes targeted endpoints with adaptive backoff
+"""
+
+import re
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import requests
+
+from teamcity_api import TeamCityAPI, build_locator
+
+SETTINGS_PATH = Path(__file__).resolve().parent / '.teamcity' / 'settings.kts'
+
+_SUBPROJECT_RE = re.compile(r'\bsubProject\(\s*([A-Za-z_][\w.]*)\s*\)')
+_PROJECT_OBJECT_RE = re.compile(r'\bobject\s+([A-Za-z_]\w*)\s*:\s*Project\(\s*\{')
+_EXPLICIT_ID_RE = re.compile(r'\bid\(\s*"([^"]+)"\s*\)|\bid\s*=\s*(?:RelativeId|AbsoluteId)\(\s*"([^"]+)"\s*\)')
+
+Predicate = Callable[[TeamCityAPI], bool]
+
+
+def expected_projects_from_settings(settings_path: Path = SETTINGS_PATH) -> List[str]:
+    """Return the ids of the subprojects registered in settings.kts
+
+    A project without an explicit ``id(...)`` gets the name of its Kotlin
+    object, which is what TeamCity uses for subprojects of ``_Root``.
+    """
+    text = Path(settings_path).read_text(encoding='utf-8')
+
+    explicit_ids = {}
+    for match in _PROJECT_OBJECT_RE.finditer(text):
+        body_start = match.end()
+        next_object = _PROJECT_OBJECT_RE.search(text, body_start)
+        body = text[body_start:next_object.start() if next_object else len(text)]
+        id_match = _EXPLICIT_ID_RE.search(body)
+        if id_match:
+            explicit_ids[match.group(1)] = id_match.group(1) or id_match.group(2)
+
+    project_ids = []
+    for match in _SUBPROJECT_RE.finditer(text):
+        name = match.group(1).split('.')[-1]
+        project_id = explicit_ids.get(name, name)
+        if project_id not in project_ids:
+            project_ids.append(project_id)
+    return project_ids
+
+
+def adaptive_intervals(initial: float = 0.5, factor: float = 1.6, maximum: float = 10.0) -> Iterator[float]:
+    """Yield sleep intervals that start fast and widen up to ``maximum``"""
+    interval = initial
+    while True:
+        yield interval
+        interval = min(interval * factor, maximum)
+
+
+class ProjectsExistProbe:
+    """Complete once every listed project can be fetched by id
+
+    Found projects are remembered, so each attempt only probes the ones
+    still missing with a single-entity GET.
+    """
+
+    def __init__(self, project_ids: Sequence[str]):
+        self.project_ids = list(project_ids)
+        self.found = set()
+
+    @property
+    def name(self) -> str:
+        return f"projects {', '.join(self.missing())}"
+
+    def missing(self) -> List[str]:
+        return [project_id for project_id in self.project_ids if project_id not in self.found]
+
+    def __call__(self, api: TeamCityAPI) -> bool:
+        for project_id in self.missing():
+            response = api.query(f'projects/id:{project_id}', fields='id', max_age=0)
+            if response.status_code == 200:
+                self.found.add(project_id)
+        return not self.missing()
+
+
+class VersionedSettingsStatusProbe:
+    """Complete once the project's versioned-settings status changes to a non-warning entry
+
+    The status seen on the first probe is the baseline, so create the probe
+    before triggering the sync.
+    """
+
+    def __init__(self, project_id: str = '_Root'):
+        self.project_id = project_id
+        self.baseline: Optional[str] = None
+        self.initialized = False
+        self.name = f"versioned settings status of {project_id}"
+
+    def _status(self, api: TeamCityAPI) -> Optional[dict]:
+        response = api.get(f'projects/id:{self.project_id}/versionedSettings/status', max_age=0)
+        if response.status_code != 200:
+            return None
+        return response.json()
+
+    def capture_baseline(self, api: TeamCityAPI):
+        status = self._status(api)
+        self.baseline = status.get('timestamp') if status else None
+        self.initialized = True
+
+    def __call__(self, api: TeamCityAPI) -> bool:
+        if not self.initialized:
+            self.capture_baseline(api)
+            return False
+        status = self._status(api)
+        if not status or status.get('timestamp') == self.baseline:
+            return False
+        return status.get('type', 'info') not in ('warn', 'error')
+
+
+class StatusChangedProbe:
+    """Complete as soon as the versioned-settings status differs from the baseline in any way
+
+    Unlike VersionedSettingsStatusProbe this also counts in-progress
+    entries, so it marks when the server started working on a change
+    rather than when it finished.
+    """
+
+    def __init__(self, project_id: str = '_Root'):
+        self.project_id = project_id
+        self.baseline: Optional[Tuple] = None
+        self.initialized = False
+        self.name = f"change in versioned settings status of {project_id}"
+
+    def _status(self, api: TeamCityAPI) -> Optional[Tuple]:
+        response = api.get(f'projects/id:{self.project_id}/versionedSettings/status', max_age=0)
+        if response.status_code != 200:
+            return None
+        status = response.json()
+        return status.get('timestamp'), status.get('type'), status.get('message')
+
+    def capture_baseline(self, api: TeamCityAPI):
+        self.baseline = self._status(api)
+        self.initialized = True
+
+    def __call__(self, api: TeamCityAPI) -> bool:
+        if not self.initialized:
+            self.capture_baseline(api)
+            return False
+        status = self._status(api)
+        return status is not None and status != self.baseline
+
+
+class ParameterValueProbe:
+    """Complete once a project parameter has the expected value"""
+
+    def __init__(self, name: str, value: str, project_id: str = '_Root'):
+        self.parameter = name
+        self.value = value
+        self.project_id = project_id
+        self.name = f"parameter {name}={value} in {project_id}"
+
+    def __call__(self, api: TeamCityAPI) -> bool:
+        response = api.get(f'projects/id:{self.project_id}/parameters/{self.parameter}', max_age=0)
+        if response.status_code != 200:
+            return False
+        return response.json().get('value') == self.value
+
+
+class BuildTypeCountProbe:
+    """Complete once at least ``minimum`` build configurations exist (optionally under one project)"""
+
+    def __init__(self, minimum: int, project_id: Optional[str] = None):
+        self.minimum = minimum
+        self.project_id = project_id
+        scope = f" under {project_id}" if project_id else ""
+        self.name = f"at least {minimum} build configurations{scope}"
+
+    def __call__(self, api: TeamCityAPI) -> bool:
+        locator = build_locator(affectedProject={'id': self.project_id}) if self.project_id else None
+        response = api.query('buildTypes', locator=locator, fields='count', max_age=0)
+        if response.status_code != 200:
+            return False
+        return response.json().get('count', 0) >= self.minimum
+
+
+class SyncResult:
+    def __init__(self, completed: bool, elapsed: float, attempts: int, pending: List[str],
+                 completed_at: Optional[Dict[str, float]] = None):
+        self.completed = completed
+        self.elapsed = elapsed
+        self.attempts = attempts
+        self.pending = pending
+        # Seconds from the origin to the check that first saw each predicate hold, by predicate name
+        self.completed_at = completed_at or {}
+
+
+class SyncWaiter:
+    """Poll completion predicates with adaptive backoff until all of them hold
+
+    Predicates are callables taking the API client; a probe that has
+    completed once is not evaluated again. Time-to-sync is measured from
+    ``started_at`` (a ``time.monotonic()`` value, e.g. when the sync was
+    triggered) or from the start of the wait, for the whole wait and for
+    each predicate.
+    """
+
+    def __init__(self, api: TeamCityAPI, predicates: Sequence[Predicate],
+                 initial_interval: float = 0.5, max_interval: float = 10.0, factor: float = 1.6,
+                 verbose: bool = True):
+        self.api = api
+        self.predicates = list(predicates)
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.verbose = verbose
+
+    @staticmethod
+    def describe(predicate: Predicate) -> str:
+        return getattr(predicate, 'name', getattr(predicate, '__name__', repr(predicate)))
+
+    def wait(self, timeout: float = 120, started_at: Optional[float] = None) -> SyncResult:
+        origin = started_at if started_at is not None else time.monotonic()
+        deadline = time.monotonic() + timeout
+        pending = list(self.predicates)
+        completed_at: Dict[str, float] = {}
+        attempts = 0
+
+        for interval in adaptive_intervals(self.initial_interval, self.factor, self.max_interval):
+            attempts += 1
+            still_pending = []
+            for predicate in pending:
+                try:
+                    done = predicate(self.api)
+                except requests.RequestException as e:
+                    print(f"   ⚠️  Probe '{self.describe(predicate)}' failed: {e}")
+                    done = False
+                if done:
+                    completed_at[self.describe(predicate)] = time.monotonic() - origin
+                else:
+                    still_pending.append(predicate)
+            pending = still_pending
+
+            if not pending:
+                return SyncResult(True, time.monotonic() - origin, attempts, [], completed_at)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            sleep_for = min(interval, remaining)
+            if self.verbose:
+                waiting_on = ', '.join(self.describe(p) for p in pending)
+                print(f"   🔄 Still synchronizing... waiting on {waiting_on} (next check in {sleep_for:.1f}s)")
+            time.sleep(sleep_for)
+
+        return SyncResult(False, time.monotonic() - origin, attempts, [self.describe(p) for p in pending],
+                          completed_at)
@@ -0,0 +1,303 @@
+"""
+TeamCity Sync Latency Probe
+Times a settings commit through trigger, first server observation and convergence, keeping histograms across runs
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+from teamcity_api import TeamCityAPI
+from teamcity_metrics import Histogram
+from teamcity_sync import (
+    SETTINGS_PATH, ParameterValueProbe, ProjectsExistProbe, StatusChangedProbe, SyncWaiter,
+    VersionedSettingsStatusProbe,
+)
+
+MARKER_PARAMETER = 'sync.probe.marker'
+DEFAULT_RESULTS_PATH = Path('.teamcity-sync-latency.json')
+DEFAULT_PROBE_TIMEOUT = 300.0
+DEFAULT_PROBE_INTERVAL = 0.5
+# Runs kept per server in the results file; the histograms keep counting past it
+MAX_KEPT_RUNS = 500
+# A session median above the previous p95 is flagged once there are this many earlier runs
+MIN_RUNS_FOR_REGRESSION = 10
+
+# Seconds; sync stages range from one REST call to minutes of DSL compilation
+SYNC_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 45.0,
+                        60.0, 90.0, 120.0, 180.0, 300.0, 600.0)
+
+# Moments of one run, in order, as seconds from its start
+STAGES = ('applied', 'triggered', 'observed', 'converged')
+# Reported intervals: name -> (from stage, to stage); 'start' is the beginning of the run
+SPANS = {
+    'commit': ('start', 'applied'),
+    'trigger': ('applied', 'triggered'),
+    'pickup': ('triggered', 'observed'),
+    'apply': ('observed', 'converged'),
+    'end_to_end': ('applied', 'converged'),
+}
+
+_MARKER_RE = re.compile(r'(\bparam\(\s*"' + re.escape(MARKER_PARAMETER) + r'"\s*,\s*")([^"]*)("\s*\))')
+
+
+class ProbeError(Exception):
+    """The probe cannot continue, e.g. the marker commit could not be made"""
+
+
+class SettingsRepo:
+    """The git checkout holding settings.kts, where each run commits (and pushes) a new marker value
+
+    Pushing needs an explicit branch, the one the settings VCS root follows,
+    and a checkout whose HEAD is exactly that remote branch, so nothing but
+    the marker commits is pushed.
+    """
+
+    def __init__(self, settings_path: Path = SETTINGS_PATH, remote: str = 'origin', branch: Optional[str] = None,
+                 push: bool = True):
+        if push and not branch:
+            raise ProbeError("pushing markers needs --probe-branch, the branch the settings VCS root follows "
+                             "(or --no-push)")
+        self.settings_path = Path(settings_path).resolve()
+        self.root = Path(self._git('rev-parse', '--show-toplevel', cwd=self.settings_path.parent))
+        self.relative_path = self.settings_path.relative_to(self.root).as_posix()
+        self.remote = remote
+        self.branch = branch
+        self.push = push
+
+    def _git(self, *args: str, cwd: Optional[Path] = None) -> str:
+        try:
+            result = subprocess.run(['git', *args], cwd=cwd or self.root, capture_output=True, text=True,
+                                    timeout=120)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise ProbeError(f"git {args[0]} failed: {e}")
+        if result.returncode != 0:
+            raise ProbeError(f"git {args[0]} failed: {result.stderr.strip() or result.stdout.strip()}")
+        return result.stdout.strip()
+
+    def check(self):
+        """Refuse to start when settings.kts has no marker or uncommitted edits, or HEAD is not the remote branch"""
+        if not _MARKER_RE.search(self.settings_path.read_text(encoding='utf-8')):
+            raise ProbeError(f'{self.relative_path} has no param("{MARKER_PARAMETER}", ...) in its root project')
+        if self._git('status', '--porcelain', '--', self.relative_path):
+            raise ProbeError(f"{self.relative_path} has uncommitted changes")
+        if self.push:
+            # Pushing HEAD would publish any local commits along with the marker
+            self._git('fetch', '--quiet', self.remote, f"refs/heads/{self.branch}")
+            if self._git('rev-parse', 'HEAD') != self._git('rev-parse', 'FETCH_HEAD'):
+                raise ProbeError(f"HEAD is not {self.remote}/{self.branch}; check out that branch, "
+                                 f"up to date and without local commits")
+
+    def commit_marker(self, marker: str) -> str:
+        """Commit settings.kts with the marker set, push it, and return the commit hash"""
+        text = self.settings_path.read_text(encoding='utf-8')
+        self.settings_path.write_text(_MARKER_RE.sub(lambda m: m.group(1) + marker + m.group(3), text, count=1),
+                                      encoding='utf-8')
+        try:
+            self._git('commit', '--quiet', '-m', f"Sync latency probe {marker}", '--', self.relative_path)
+        except ProbeError:
+            self.settings_path.write_text(text, encoding='utf-8')
+            raise
+        if self.push:
+            self._git('push', '--quiet', self.remote, f"HEAD:refs/heads/{self.branch}")
+        return self._git('rev-parse', '--short', 'HEAD')
+
+
+class ProbeRun:
+    """Stage timestamps of one marker commit, as seconds from the start of the run"""
+
+    def __init__(self, marker: str):
+        self.marker = marker
+        self.started_at = time.time()
+        self.commit: Optional[str] = None
+        self.stages: Dict[str, float] = {}
+        self.outcome = 'running'
+        self.pending: List[str] = []
+
+    def spans(self) -> Dict[str, float]:
+        """Intervals between the stages this run reached"""
+        moments = dict(self.stages, start=0.0)
+        return {name: moments[end] - moments[begin] for name, (begin, end) in SPANS.items()
+                if begin in moments and end in moments}
+
+    def describe(self) -> str:
+        stages = ', '.join(f"{stage} +{self.stages[stage]:.2f}s" for stage in STAGES if stage in self.stages)
+        end_to_end = self.spans().get('end_to_end')
+        return stages + (f" ({end_to_end:.2f}s end to end)" if end_to_end is not None else '')
+
+    def as_dict(self) -> Dict:
+        return {'marker': self.marker, 'commit': self.commit,
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.started_at)),
+                'outcome': self.outcome, 'stages': {k: round(v, 3) for k, v in self.stages.items()},
+                'pending': self.pending}
+
+
+class LatencyResults:
+    """Histograms of every span and recent runs per server, kept in a local JSON file
+
+    Only converged runs are added to the histograms; the rest are counted
+    by outcome. A file written with different buckets starts over.
+    """
+
+    def __init__(self, path: Path, server_url: str):
+        self.path = path
+        self.server_url = server_url
+        self.data: Dict = {'servers': {}}
+        try:
+            with open(path) as f:
+                self.data = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"   ⚠️  Ignoring unreadable results file {path}: {e}")
+        server = self.data.setdefault('servers', {}).setdefault(server_url, {})
+        self.runs: List[Dict] = server.setdefault('runs', [])
+        self.outcomes: Dict[str, int] = server.setdefault('outcomes', {})
+        self.histograms: Dict[str, Histogram] = {}
+        for name in SPANS:
+            try:
+                histogram = Histogram.from_dict(server.get('histograms', {})[name])
+                if histogram.buckets != SYNC_LATENCY_BUCKETS:
+                    raise ValueError("buckets changed")
+            except (KeyError, TypeError, ValueError):
+                histogram = Histogram(SYNC_LATENCY_BUCKETS)
+            self.histograms[name] = histogram
+
+    def record(self, run: ProbeRun):
+        self.outcomes[run.outcome] = self.outcomes.get(run.outcome, 0) + 1
+        if run.outcome == 'converged':
+            for name, seconds in run.spans().items():
+                self.histograms[name].observe(seconds)
+        self.runs.append(run.as_dict())
+        del self.runs[:-MAX_KEPT_RUNS]
+
+    def end_to_end_samples(self) -> List[float]:
+        """Exact end-to-end seconds of the converged runs still kept in the file"""
+        return [run['stages']['converged'] - run['stages']['applied'] for run in self.runs
+                if run.get('outcome') == 'converged' and {'applied', 'converged'} <= run.get('stages', {}).keys()]
+
+    def save(self):
+        server = self.data['servers'][self.server_url]
+        server['histograms'] = {name: histogram.as_dict() for name, histogram in self.histograms.items()}
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(tmp, self.path)
+
+
+def probe_once(api: TeamCityAPI, repo: SettingsRepo, trigger: Callable[[], bool], expected_projects: Sequence[str],
+               timeout: float = DEFAULT_PROBE_TIMEOUT, interval: float = DEFAULT_PROBE_INTERVAL) -> ProbeRun:
+    """Commit a fresh marker, trigger a sync and poll until the server shows it with settled status
+
+    ``trigger`` must load settings from VCS into the server (checkForChanges
+    or reloadSettingsFromVcs); commitCurrentSettings would write the
+    server's settings, still without the marker, back over it.
+    'observed' is the first check where the versioned-settings status had
+    changed or the marker was visible; 'converged' is when the marker, a
+    fresh non-warning status and every expected project were all there.
+    Raises ProbeError if the commit fails.
+    """
+    run = ProbeRun(uuid.uuid4().hex[:12])
+    status_changed = StatusChangedProbe()
+    settled = VersionedSettingsStatusProbe()
+    marker = ParameterValueProbe(MARKER_PARAMETER, run.marker)
+    # Baselines come from before the commit, so a server that is quick to react is not missed
+    status_changed.capture_baseline(api)
+    settled.capture_baseline(api)
+
+    origin = time.monotonic()
+    run.commit = repo.commit_marker(run.marker)
+    run.stages['applied'] = time.monotonic() - origin
+    if not trigger():
+        run.outcome = 'trigger failed'
+        return run
+    run.stages['triggered'] = time.monotonic() - origin
+
+    waiter = SyncWaiter(api, [status_changed, marker, settled, ProjectsExistProbe(expected_projects)],
+                        initial_interval=interval, max_interval=interval, factor=1.0, verbose=False)
+    result = waiter.wait(timeout, started_at=origin)
+    seen = [result.completed_at[name] for name in (status_changed.name, marker.name) if name in result.completed_at]
+    if seen:
+        run.stages['observed'] = min(seen)
+    if result.completed:
+        run.stages['converged'] = max(result.completed_at.values())
+        run.outcome = 'converged'
+    else:
+        run.outcome = 'timed out'
+        run.pending = result.pending
+    return run
+
+
+def format_seconds(seconds: float) -> str:
+    return '∞' if seconds == float('inf') else f"{seconds:.2f}s" if seconds < 10 else f"{seconds:.1f}s"
+
+
+def print_report(session: List[ProbeRun], results: LatencyResults, previous_end_to_end: List[float]):
+    """Percentiles of this session and of every run on record, plus the end-to-end histogram
+
+    The regression check compares exact end-to-end times: the session
+    median against the p95 of the runs kept from earlier sessions.
+    """
+    converged = [run for run in session if run.outcome == 'converged']
+    total = results.histograms['end_to_end'].count
+    print(f"📊 Sync latency: {len(converged)}/{len(session)} runs converged this session, "
+          f"{total} on record for {results.server_url}")
+    print("   (session: exact; on record: upper bound of the histogram bucket)")
+    print(f"   {'Span':<11} {'median':>8} {'max':>8} │ {'p50':>7} {'p90':>7} {'p95':>7} {'p99':>7}")
+    for name in SPANS:
+        samples = [run.spans()[name] for run in converged if name in run.spans()]
+        histogram = results.histograms[name]
+        session_columns = (f"{format_seconds(statistics.median(samples)):>8} {format_seconds(max(samples)):>8}"
+                           if samples else f"{'-':>8} {'-':>8}")
+        record_columns = ' '.join(f"{format_seconds(histogram.quantile(q)):>7}" for q in (0.5, 0.9, 0.95, 0.99))
+        print(f"   {name:<11} {session_columns} │ {record_columns}")
+
+    failed = {outcome: count for outcome, count in results.outcomes.items() if outcome != 'converged'}
+    if failed:
+        print(f"   Not converged on record: {', '.join(f'{count} {outcome}' for outcome, count in failed.items())}")
+
+    histogram = results.histograms['end_to_end']
+    if histogram.count:
+        print()
+        print("   End-to-end histogram (all runs on record):")
+        widest = max(histogram.counts)
+        lower = 0.0
+        for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+            if count:
+                bar = '█' * max(1, round(30 * count / widest))
+                print(f"   {format_seconds(lower):>7} – {format_seconds(bound):<7} {bar} {count}")
+            lower = bound
+
+    session_samples = [run.spans()['end_to_end'] for run in converged]
+    if session_samples and len(previous_end_to_end) >= MIN_RUNS_FOR_REGRESSION:
+        median = statistics.median(session_samples)
+        previous_p95 = statistics.quantiles(previous_end_to_end, n=20, method='inclusive')[-1]
+        if median > previous_p95:
+            print()
+            print(f"⚠️  Regression: median end-to-end {format_seconds(median)} this session is above the "
+                  f"p95 of the {len(previous_end_to_end)} earlier runs ({format_seconds(previous_p95)})")
+
+
+def add_probe_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('sync latency probe')
+    group.add_argument('--probe', type=int, metavar='N',
+                       help="Commit a marker to settings.kts and time its sync N times (adds N commits)")
+    group.add_argument('--probe-results', type=Path, default=DEFAULT_RESULTS_PATH,
+                       help=f"Latency histograms kept across runs (default: {DEFAULT_RESULTS_PATH})")
+    group.add_argument('--probe-timeout', type=float, default=DEFAULT_PROBE_TIMEOUT,
+                       help=f"Seconds to wait for each run to converge (default: {DEFAULT_PROBE_TIMEOUT:g})")
+    group.add_argument('--probe-interval', type=float, default=DEFAULT_PROBE_INTERVAL,
+                       help=f"Seconds between checks; bounds the timing resolution (default: {DEFAULT_PROBE_INTERVAL:g})")
+    group.add_argument('--probe-remote', default='origin', help="Remote the marker commits are pushed to")
+    group.add_argument('--probe-branch',
+                       help="Branch the settings VCS root follows; markers are pushed there, so HEAD must match "
+                            "it (required unless --no-push)")
+    group.add_argument('--no-push', action='store_true',
+                       help="Commit markers locally without pushing, for a server reading this checkout")
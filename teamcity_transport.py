@@ -0,0 +1,350 @@
+"""
+TeamCity HTTP Transport
+Shared connection pool with timeouts, idempotency-aware retries, a circuit breaker and a request governor
+"""
+
+import argparse
+import random
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from teamcity_governor import (
+    DEFAULT_INITIAL_LIMIT, DEFAULT_MAX_CONCURRENCY, DEFAULT_RATE_LIMIT, EndpointClass, Governor, classify,
+)
+
+# Disable SSL warnings for self-signed certificates
+requests.packages.urllib3.disable_warnings()
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 60.0
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised without contacting the server while its circuit is open"""
+
+
+class CircuitBreaker:
+    """Fail fast after consecutive failures, letting one trial call through after a cool-down
+
+    States follow the usual closed -> open -> half-open cycle: a success in
+    half-open closes the circuit, a failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self, host: str):
+        with self._lock:
+            state = self.state
+            if state == 'open' or (state == 'half-open' and self._trial_in_flight):
+                raise CircuitOpenError(
+                    f"circuit open for {host} after {self.failures} consecutive failures; "
+                    f"retrying in {self.reset_timeout - (time.monotonic() - self.opened_at):.0f}s"
+                )
+            if state == 'half-open':
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class RetryPolicy:
+    """Retry transient failures with full-jitter exponential backoff
+
+    Only idempotent methods are retried unless ``retry_post`` is set, so a
+    POST that may have reached the server is never repeated by accident.
+    """
+
+    def __init__(self, max_retries: int = DEFAULT_MAX_RETRIES, backoff_base: float = 0.5,
+                 backoff_max: float = 8.0, retry_post: bool = False):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_post = retry_post
+
+    def allows(self, method: str) -> bool:
+        return method in IDEMPOTENT_METHODS or (self.retry_post and method == 'POST')
+
+    def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+class TransportStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.timeouts = 0
+        self.connection_errors = 0
+        self.rejected = 0
+
+    def bump(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            'retries': self.retries,
+            'timeouts': self.timeouts,
+            'connection_errors': self.connection_errors,
+            'rejected': self.rejected,
+        }
+
+
+class Transport:
+    """HTTP transport shared by every TeamCityAPI client in the process
+
+    The session carries no credentials, so one transport can serve clients
+    for several servers; each host gets its own circuit breaker and, unless
+    ``governed`` is off, its own Governor shared by every client and thread
+    talking to it.
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, keep_alive: bool = True,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT, read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 retry: Optional[RetryPolicy] = None, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT, verify: bool = False, governed: bool = True,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, rate_limit: Optional[float] = DEFAULT_RATE_LIMIT):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retry = retry or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.governed = governed
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit
+        self.stats = TransportStats()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._governors: Dict[str, Governor] = {}
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        # Disable SSL verification for development
+        self.session.verify = verify
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+        self.pool_size = 0
+        self.ensure_pool_size(pool_size)
+
+    def ensure_pool_size(self, pool_size: int):
+        """Grow the connection pool so ``pool_size`` requests can run without waiting for a socket"""
+        with self._lock:
+            if pool_size <= self.pool_size:
+                return
+            # Retries are handled here rather than by urllib3, so they respect the breaker
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+            self.pool_size = pool_size
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[host]
+
+    def governor(self, host: str) -> Optional[Governor]:
+        """The host's request governor, or None when the transport is ungoverned"""
+        if not self.governed:
+            return None
+        with self._lock:
+            if host not in self._governors:
+                initial = min(DEFAULT_INITIAL_LIMIT, self.max_concurrency)
+                self._governors[host] = Governor(initial, self.max_concurrency, self.rate_limit)
+            return self._governors[host]
+
+    def _send(self, governor: Optional[Governor], method: str, url: str, **kwargs) -> requests.Response:
+        """One attempt, admitted by the governor and reported back to it
+
+        A streamed response keeps its slot until its body has been read or
+        it is closed, see _release_when_read().
+        """
+        if governor is None:
+            return self.session.request(method, url, **kwargs)
+        endpoint_class, baseline_key = classify(method, url)
+        governor.acquire(endpoint_class)
+        started = time.monotonic()
+        status = None
+        try:
+            response = self.session.request(method, url, **kwargs)
+            status = response.status_code
+        finally:
+            if status is None or not kwargs.get('stream'):
+                governor.release(endpoint_class, time.monotonic() - started, status, baseline_key)
+        if kwargs.get('stream'):
+            self._release_when_read(governor, response, endpoint_class, started, baseline_key)
+        return response
+
+    @staticmethod
+    def _release_when_read(governor: Governor, response: requests.Response, endpoint_class: EndpointClass,
+                           started: float, baseline_key: str):
+        """Release a streamed response's governor slot once urllib3 gives its connection back
+
+        That happens when the body is read to the end and on close(), so
+        callers must close responses they stop reading. The latency then
+        covers the transfer, and is compared with bodies of similar size.
+        """
+        length = response.headers.get('Content-Length', '')
+        if length.isdigit():
+            # Powers of four: a one-byte probe and a multi-megabyte part are different endpoints
+            baseline_key = f"{baseline_key} bytes~{1 << (2 * (int(length).bit_length() // 2))}"
+        release_conn = response.raw.release_conn
+        lock = threading.Lock()
+        released = False
+
+        def release():
+            nonlocal released
+            with lock:
+                first, released = not released, True
+            if first:
+                governor.release(endpoint_class, time.monotonic() - started, response.status_code, baseline_key)
+            release_conn()
+
+        response.raw.release_conn = release
+
+    def request(self, method: str, url: str, timeout: Optional[Tuple[float, float]] = None,
+                **kwargs) -> requests.Response:
+        """Send a request, retrying transient failures when the method allows it
+
+        ``timeout`` is a (connect, read) pair overriding the transport defaults.
+        Raises CircuitOpenError while the host's circuit is open. Each attempt
+        waits for the host's governor to admit it; backoff sleeps hold no slot.
+        """
+        host = urlsplit(url).netloc
+        breaker = self.breaker(host)
+        governor = self.governor(host)
+        timeout = timeout or (self.connect_timeout, self.read_timeout)
+        retryable = self.retry.allows(method)
+        attempt = 0
+
+        while True:
+            try:
+                breaker.before_call(host)
+            except CircuitOpenError:
+                self.stats.bump('rejected')
+                raise
+
+            try:
+                response = self._send(governor, method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                breaker.record_failure()
+                self.stats.bump('timeouts' if isinstance(e, requests.Timeout) else 'connection_errors')
+                if not retryable or attempt >= self.retry.max_retries:
+                    e.retries = attempt
+                    raise
+                delay = self.retry.delay(attempt)
+            else:
+                # Exposed for request hooks, see teamcity_metrics
+                response.retries = attempt
+                if response.status_code not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+                if not retryable or attempt >= self.retry.max_retries:
+                    return response
+                delay = self.retry.delay(attempt, response.headers.get('Retry-After'))
+                response.close()
+
+            attempt += 1
+            self.stats.bump('retries')
+            time.sleep(delay)
+
+    def summary(self) -> str:
+        states = ', '.join(f"{host} {breaker.state}" for host, breaker in self._breakers.items())
+        return (f"{self.stats.retries} retries, {self.stats.timeouts} timeouts, "
+                f"{self.stats.connection_errors} connection errors, {self.stats.rejected} rejected by breaker"
+                f"{f' (circuit: {states})' if states else ''}")
+
+
+_shared_transport: Optional[Transport] = None
+_shared_lock = threading.Lock()
+
+
+def shared_transport() -> Transport:
+    """Return the process-wide transport, creating it with defaults on first use"""
+    global _shared_transport
+    with _shared_lock:
+        if _shared_transport is None:
+            _shared_transport = Transport()
+        return _shared_transport
+
+
+def configure_shared_transport(**options) -> Transport:
+    """Replace the process-wide transport, e.g. from command-line options"""
+    global _shared_transport
+    with _shared_lock:
+        _shared_transport = Transport(**options)
+        return _shared_transport
+
+
+def add_transport_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('transport')
+    group.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE,
+                       help=f"HTTP connections kept per host (default: {DEFAULT_POOL_SIZE})")
+    group.add_argument('--no-keep-alive', action='store_true',
+                       help="Close the connection after every request")
+    group.add_argument('--connect-timeout', type=float, default=DEFAULT_CONNECT_TIMEOUT,
+                       help=f"Seconds to wait for a connection (default: {DEFAULT_CONNECT_TIMEOUT})")
+    group.add_argument('--read-timeout', type=float, default=DEFAULT_READ_TIMEOUT,
+                       help=f"Seconds to wait for a response (default: {DEFAULT_READ_TIMEOUT})")
+    group.add_argument('--retries', type=int, default=DEFAULT_MAX_RETRIES,
+                       help=f"Retries for idempotent requests (default: {DEFAULT_MAX_RETRIES})")
+    group.add_argument('--retry-post', action='store_true',
+                       help="Also retry POST requests")
+    group.add_argument('--max-concurrency', type=int, default=DEFAULT_MAX_CONCURRENCY,
+                       help=f"Ceiling for the adaptive per-server request limit (default: {DEFAULT_MAX_CONCURRENCY})")
+    group.add_argument('--rate-limit', type=float, default=DEFAULT_RATE_LIMIT,
+                       help=f"Request cost units per second per server, 0 for no limit (default: {DEFAULT_RATE_LIMIT:g})")
+    group.add_argument('--no-governor', action='store_true',
+                       help="Send requests without adaptive concurrency or rate limiting")
+
+
+def transport_from_args(args: argparse.Namespace) -> Transport:
+    """Configure the shared transport from add_transport_arguments options"""
+    return configure_shared_transport(
+        pool_size=args.pool_size,
+        keep_alive=not args.no_keep_alive,
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout,
+        retry=RetryPolicy(max_retries=args.retries, retry_post=args.retry_post),
+        governed=not args.no_governor,
+        max_concurrency=args.max_concurrency,
+        rate_limit=args.rate_limit or None,
+    )
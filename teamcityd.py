@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+TeamCity Warm Daemon
+Keeps an authenticated session and response cache warm, serving commands to a thin client over a Unix socket
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# The client path imports only the standard library above; the TeamCity
+# modules (and requests) are imported by serve() so a client invocation
+# costs interpreter startup plus one socket round trip.
+
+DEFAULT_URL = "https://teamcity.devinfra.ru"
+DEFAULT_REPO_URL = "git@github.com:muratslavich/teamcity-configurations.git"
+DEFAULT_KEEPALIVE = 30.0
+CLIENT_COMMANDS = ('ping', 'status', 'diagnose', 'sync', 'wait', 'stats', 'stop')
+
+
+def default_socket_path() -> Path:
+    """$TEAMCITY_DAEMON_SOCKET, else a per-user socket in $XDG_RUNTIME_DIR or /tmp"""
+    if os.getenv('TEAMCITY_DAEMON_SOCKET'):
+        return Path(os.environ['TEAMCITY_DAEMON_SOCKET'])
+    runtime_dir = os.getenv('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return Path(runtime_dir) / 'teamcityd.sock'
+    return Path(f"/tmp/teamcityd-{os.getuid()}.sock")
+
+
+def send_message(stream, message: Dict):
+    stream.write(json.dumps(message).encode('utf-8') + b'\n')
+    stream.flush()
+
+
+# --- client ------------------------------------------------------------------
+
+def call(socket_path: Path, command: str, arguments: Optional[Dict] = None,
+         on_output: Callable[[str], None] = sys.stdout.write) -> Tuple[int, Any]:
+    """Send one command and relay its output as it arrives; returns (exit code, result data)
+
+    The daemon answers with any number of ``output`` messages followed by a
+    single ``result``, one JSON object per line.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        stream = sock.makefile('rwb')
+        send_message(stream, {'command': command, 'args': arguments or {}})
+        for line in stream:
+            message = json.loads(line)
+            if message['type'] == 'output':
+                on_output(message['text'])
+            elif message['type'] == 'result':
+                return message['exit_code'], message.get('data')
+    raise ConnectionError("daemon closed the connection without a result")
+
+
+def daemon_running(socket_path: Path) -> bool:
+    try:
+        return call(socket_path, 'ping', on_output=lambda text: None)[0] == 0
+    except (OSError, ValueError, ConnectionError):
+        return False
+
+
+# --- server ------------------------------------------------------------------
+
+class ThreadOutput:
+    """sys.stdout replacement that sends each handler thread's prints to its own client
+
+    The deployer and diagnostic code report progress with print(); routing
+    by thread lets several clients be served at once without mixing output.
+    """
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.local = threading.local()
+
+    def redirect(self, write: Optional[Callable[[str], None]]):
+        self.local.write = write
+
+    def write(self, text: str) -> int:
+        write = getattr(self.local, 'write', None)
+        if write is None:
+            return self.fallback.write(text)
+        write(text)
+        return len(text)
+
+    def flush(self):
+        if getattr(self.local, 'write', None) is None:
+            self.fallback.flush()
+
+    def isatty(self) -> bool:
+        return False
+
+
+class DaemonState:
+    """Everything that stays warm between commands"""
+
+    def __init__(self, deployer, concurrency: int, page_size: int):
+        self.deployer = deployer
+        self.api = deployer.api
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.started = time.time()
+        self.commands_served = 0
+        self.stop_requested = threading.Event()
+        # Sync and wait share the deployer's trigger time, so run one at a time
+        self.sync_lock = threading.Lock()
+
+
+def command_ping(state: DaemonState, arguments: Dict) -> Tuple[int, Any]:
+    return 0, {'pid': os.getpid(), 'uptime': time.time() - state.started}
+
+
+def command_status(state: DaemonState, arguments: Dict) -> Tuple[int, Any]:
+    from teamcity_sync import ProjectsExistProbe
+
+    response = state.api.get('server')
+    if response.status_code != 200:
+        print(f"❌ Server returned HTTP {response.status_code}")
+        return 1, None
+    version = response.json().get('version', 'Unknown')
+    print(f"✅ {state.deployer.teamcity_url} (version {version})")
+
+    response = state.api.get('projects/id:_Root/versionedSettings/status', max_age=0)
+    sync_status = response.json() if response.status_code == 200 else {}
+    if sync_status:
+        print(f"🔄 Versioned settings: [{sync_status.get('type', 'info')}] {sync_status.get('message', '')} "
+              f"({sync_status.get('timestamp', 'no timestamp')})")
+
+    probe = ProjectsExistProbe(state.deployer.expected_projects)
+    probe(state.api)
+    for project_id in state.deployer.expected_projects:
+        print(f"   {'✅' if project_id in probe.found else '❌'} {project_id}")
+    missing = probe.missing()
+    return (1 if missing else 0), {'version': version, 'sync_status': sync_status, 'missing': missing}
+
+
+def command_diagnose(state: DaemonState, arguments: Dict) -> Tuple[int, Any]:
+    from diagnose import print_diagnosis
+    from teamcity_api import AsyncTeamCityAPI
+
+    # A worker pool per command; the connections it uses stay in the shared transport
+    async_api = AsyncTeamCityAPI(state.api, state.concurrency)
+    try:
+        print_diagnosis(state.api, async_api, arguments.get('page_size', state.page_size))
+    finally:
+        async_api.close()
+    return 0, None
+
+
+def command_sync(state: DaemonState, arguments: Dict) -> Tuple[int, Any]:
+    with state.sync_lock:
+        return (0 if state.deployer.force_sync_from_vcs() else 1), None
+
+
+def command_wait(state: DaemonState, arguments: Dict) -> Tuple[int, Any]:
+    with state.sync_lock:
+        if not state.deployer.wait_for_sync(arguments.get('timeout', 120)):
+            return 1, None
+        return (0 if state.deployer.validate_configuration() else 1), None
+
+
+def command_stats(state: DaemonState, arguments: Dict) -> Tuple[int, Any]:
+    print(f"⏱️  Up {time.time() - state.started:.0f}s, {state.commands_served} commands served")
+    print(f"📊 API usage: {state.api.stats.summary()}")
+    print(f"🔁 Transport: {state.api.transport.summary()}")
+    print(f"📦 Response cache: {state.api.cache.stats.summary()}")
+    return 0, {'api': state.api.stats.as_dict(), 'cache': state.api.cache.stats.as_dict(),
+               'uptime': time.time() - state.started, 'commands': state.commands_served}
+
+
+def command_stop(state: DaemonState, arguments: Dict) -> Tuple[int, Any]:
+    print("👋 Stopping daemon")
+    state.stop_requested.set()
+    return 0, None
+
+
+COMMANDS: Dict[str, Callable[[DaemonState, Dict], Tuple[int, Any]]] = {
+    'ping': command_ping,
+    'status': command_status,
+    'diagnose': command_diagnose,
+    'sync': command_sync,
+    'wait': command_wait,
+    'stats': command_stats,
+    'stop': command_stop,
+}
+
+
+def make_handler(state: DaemonState, output: ThreadOutput):
+    import socketserver
+
+    import requests
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline()
+            if not line:
+                return
+            try:
+                request = json.loads(line)
+                handler = COMMANDS[request['command']]
+            except (ValueError, KeyError, TypeError):
+                send_message(self.wfile, {'type': 'result', 'exit_code': 2, 'data': None,
+                                          'error': f"unknown request {line[:80]!r}"})
+                return
+
+            output.redirect(lambda text: send_message(self.wfile, {'type': 'output', 'text': text}))
+            try:
+                exit_code, data = handler(state, request.get('args') or {})
+            except BrokenPipeError:
+                return
+            except requests.RequestException as e:
+                print(f"❌ Request failed: {e}")
+                exit_code, data = 1, None
+            except (Exception, SystemExit) as e:
+                # The client always gets a result; the traceback goes to the daemon's own log
+                print(f"❌ {request['command']} failed: {type(e).__name__}: {e}")
+                traceback.print_exc()
+                exit_code, data = 1, None
+            finally:
+                output.redirect(None)
+            state.commands_served += 1
+            try:
+                send_message(self.wfile, {'type': 'result', 'exit_code': exit_code, 'data': data})
+            except BrokenPipeError:
+                pass
+
+    return Handler
+
+
+def keep_warm(state: DaemonState, interval: float):
+    """Refresh the server endpoint so the pooled connection and its TLS session do not go idle"""
+    while not state.stop_requested.wait(interval):
+        try:
+            state.api.get('server', max_age=0)
+        except Exception:
+            pass
+
+
+def serve(args: argparse.Namespace):
+    import socketserver
+
+    from deploy import TeamCityDeployer, load_environment
+    from teamcity_cache import ResponseCache
+    from teamcity_transport import transport_from_args
+
+    load_environment()
+    teamcity_url = args.url or os.getenv('TEAMCITY_URL', DEFAULT_URL)
+    admin_token = os.getenv('TEAMCITY_ADMIN_TOKEN')
+    if not admin_token:
+        print("❌ ERROR: TEAMCITY_ADMIN_TOKEN environment variable not set")
+        sys.exit(1)
+
+    socket_path = args.socket
+    if socket_path.exists():
+        if daemon_running(socket_path):
+            print(f"❌ ERROR: A daemon is already serving {socket_path}")
+            sys.exit(1)
+        socket_path.unlink()
+
+    deployer = TeamCityDeployer(teamcity_url, admin_token, DEFAULT_REPO_URL, page_size=args.page_size,
+                                cache=ResponseCache(), transport=transport_from_args(args))
+    state = DaemonState(deployer, args.concurrency, args.page_size)
+    if not deployer.test_connection():
+        sys.exit(1)
+
+    output = ThreadOutput(sys.stdout)
+    sys.stdout = output
+
+    old_umask = os.umask(0o077)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(str(socket_path), make_handler(state, output))
+    finally:
+        os.umask(old_umask)
+    server.daemon_threads = True
+
+    threading.Thread(target=server.serve_forever, name='teamcityd', daemon=True).start()
+    if args.keepalive > 0:
+        threading.Thread(target=keep_warm, args=(state, args.keepalive), name='teamcityd-keepalive',
+                         daemon=True).start()
+    print(f"🟢 Serving {teamcity_url} on {socket_path} (pid {os.getpid()})", flush=True)
+    try:
+        while not state.stop_requested.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        if socket_path.exists():
+            socket_path.unlink()
+        print("🛑 Daemon stopped", flush=True)
+
+
+def detach(log_path: Path):
+    """Fork into the background, keeping the parent's working directory for .env and settings.kts"""
+    if os.fork() > 0:
+        os._exit(0)
+    os.setsid()
+    if os.fork() > 0:
+        os._exit(0)
+    log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+    null_fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null_fd, 0)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Warm TeamCity session served over a Unix socket")
+    parser.add_argument('--socket', type=Path, default=default_socket_path(),
+                        help=f"Socket path (default: {default_socket_path()})")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    start = commands.add_parser('start', help="Run the daemon")
+    start.add_argument('--url', help=f"TeamCity URL (default: $TEAMCITY_URL or {DEFAULT_URL})")
+    start.add_argument('--detach', action='store_true', help="Run in the background")
+    start.add_argument('--log', type=Path, default=Path('teamcityd.log'),
+                       help="Output file when detached (default: teamcityd.log)")
+    start.add_argument('--keepalive', type=float, default=DEFAULT_KEEPALIVE,
+                       help=f"Seconds between connection keep-alive requests, 0 to disable (default: {DEFAULT_KEEPALIVE:.0f})")
+    start.add_argument('--concurrency', type=int, default=8, help="Concurrent page requests for diagnose")
+    start.add_argument('--page-size', type=int, default=100, help="Items per page when listing collections")
+
+    for name in CLIENT_COMMANDS:
+        command = commands.add_parser(name, help=f"Ask the daemon to run '{name}'")
+        if name == 'wait':
+            command.add_argument('--timeout', type=int, default=120, help="Seconds to wait (default: 120)")
+        if name == 'diagnose':
+            command.add_argument('--page-size', type=int, help="Items per page when listing collections")
+        command.add_argument('--json', action='store_true', help="Print the result data as JSON")
+
+    # Transport options need the TeamCity modules, so only the daemon side pays for them
+    if 'start' in sys.argv[1:]:
+        from teamcity_transport import add_transport_arguments
+        add_transport_arguments(start)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == 'start':
+        if args.detach:
+            detach(args.log)
+        serve(args)
+        return
+
+    arguments = {}
+    if args.command == 'wait':
+        arguments['timeout'] = args.timeout
+    if args.command == 'diagnose' and args.page_size:
+        arguments['page_size'] = args.page_size
+    try:
+        exit_code, data = call(args.socket, args.command, arguments)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"❌ ERROR: No daemon on {args.socket}; start one with: python3 teamcityd.py start --detach",
+              file=sys.stderr)
+        sys.exit(2)
+    except ConnectionError as e:
+        print(f"❌ ERROR: Lost the daemon on {args.socket}: {e}", file=sys.stderr)
+        sys.exit(2)
+    if args.json:
+        print(json.dumps(data, indent=2))
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
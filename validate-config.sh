@@ -3,6 +3,8 @@
 # TeamCity Configuration Validation Script
 set -e
 
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
 echo "🚀 Starting TeamCity Configuration Validation..."
 
 # Check if we're in the right directory
@@ -11,6 +13,15 @@ if [ ! -d ".teamcity" ]; then
     exit 1
 fi
 
+# Fast structural check; skipped when the tree is unchanged since it last passed
+echo "🔍 Checking settings.kts structure..."
+python3 "$SCRIPT_DIR/dslcheck.py" --dir .teamcity
+
+MAVEN_CLEAN=0
+if python3 "$SCRIPT_DIR/dslcheck.py" --dir .teamcity --is-clean maven; then
+    MAVEN_CLEAN=1
+fi
+
 cd .teamcity
 
 echo "📋 Checking Maven configuration..."
@@ -23,10 +34,14 @@ echo "✅ Found pom.xml"
 
 # Validate the Maven project
 echo "🔍 Validating Maven project structure..."
-mvn validate 2>/dev/null || {
+if [ "$MAVEN_CLEAN" = "1" ]; then
+    echo "✅ .teamcity unchanged since the last successful Maven validation, skipping Maven"
+elif mvn validate 2>/dev/null; then
+    (cd .. && python3 "$SCRIPT_DIR/dslcheck.py" --dir .teamcity --mark-clean maven)
+else
     echo "⚠️  Maven validation failed, but this might be expected in local development"
     echo "   The configuration should still work when deployed to TeamCity server"
-}
+fi
 
 # Check Kotlin files syntax
 echo "🔍 Checking Kotlin syntax..."
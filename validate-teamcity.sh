@@ -42,6 +42,15 @@ echo "   - VCS roots: $vcsroot_files"
 echo ""
 echo "3. Checking for common issues..."
 
+# Structural check of the DSL (duplicate ids, undeclared references, features without ids)
+echo "   - Checking settings.kts structure..."
+dsl_check=$(python3 "$(dirname "${BASH_SOURCE[0]}")/dslcheck.py" --dir .teamcity)
+dsl_status=$?
+echo "$dsl_check" | sed 's/^/     /'
+if [ "$dsl_status" -ne 0 ]; then
+    exit 1
+fi
+
 # Check for proper object naming
 echo "   - Checking object naming conventions..."
 inconsistent_names=$(grep -r "object.*:" .teamcity --include="*.kt" | grep -v "_" | wc -l | tr -d ' ')